@@ -1,10 +1,35 @@
-import duhportinf.main_portinf
-import duhportinf.main_portbundler
-from duhportinf.main_portinf import (
-    get_bus_defs,
-    get_bus_matches,
-    load_bus_defs,
-)
-from duhportinf.busdef import (
-    debug_bus_mapping,
-)
+import sys
+import types
+import importlib
+
+# the public api is imported on first access, so that importing a light
+# submodule such as main_portbundler does not pull in the solver and
+# numeric stacks along with the whole package
+_lazy_attrs = {
+    'get_bus_defs'      : 'main_portinf',
+    'get_bus_matches'   : 'main_portinf',
+    'load_bus_defs'     : 'main_portinf',
+    'debug_bus_mapping' : 'busdef',
+}
+_lazy_modules = [
+    'main_portinf',
+    'main_portbundler',
+    'main_portinf_batch',
+    'main_portinfd',
+]
+
+class _LazyModule(types.ModuleType):
+    # module level __getattr__ (PEP 562) needs python 3.7, so the package
+    # module gets a class of its own instead
+    def __getattr__(self, name):
+        if name in _lazy_attrs:
+            module = importlib.import_module('.' + _lazy_attrs[name], __name__)
+            return getattr(module, name)
+        if name in _lazy_modules:
+            return importlib.import_module('.' + name, __name__)
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    def __dir__(self):
+        return sorted(list(self.__dict__) + list(_lazy_attrs) + _lazy_modules)
+
+sys.modules[__name__].__class__ = _LazyModule
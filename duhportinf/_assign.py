@@ -0,0 +1,479 @@
+import os
+import hashlib
+import logging
+import tempfile
+import time
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from ._defaults import SOLVER_NAMES, DEFAULT_SOLVER, DEFAULT_MAX_SIZE
+from ._mapcache import prune_cache_dir
+
+# scipy and cvxopt are slow to import, so they are only loaded by the
+# backends that use them when first called
+_cvxopt = None
+
+def _get_cvxopt():
+    global _cvxopt
+    if _cvxopt is None:
+        import cvxopt
+        import cvxopt.solvers
+        cvxopt.solvers.options['show_progress'] = False
+        cvxopt.solvers.options['glpk'] = dict(msg_lev='GLP_MSG_OFF')
+        _cvxopt = cvxopt
+    return _cvxopt
+
+#--------------------------------------------------------------------------
+# assignment solver backends
+#
+# each backend takes an (m x n) cost matrix C with m <= n and returns a
+# boolean (m x n) matrix X that assigns every row to exactly one column and
+# every column to at most one row at minimum total cost
+#--------------------------------------------------------------------------
+def get_hungarian_assignment(C):
+    """
+    exact rectangular min cost assignment (shortest augmenting path)
+    """
+    from scipy.optimize import linear_sum_assignment
+    rows, cols = linear_sum_assignment(C)
+    X = np.zeros(C.shape, dtype=bool)
+    X[rows, cols] = True
+    return X
+
+@lru_cache(maxsize=64)
+def _get_lp_constraints(m, n):
+    """
+    sparse constraints (G, h, A, b) of the (m x n) assignment LP over the
+    row-major x = vec(X): 0 <= x <= 1, every column sums to at most 1 and
+    every row sums to exactly 1.  only depends on the shape, so it is
+    shared by all problems of the same size
+    """
+    cvxopt = _get_cvxopt()
+    matrix, spmatrix = cvxopt.matrix, cvxopt.spmatrix
+    k = m*n
+    idx = np.arange(k)
+    # G stacks -x <= 0, x <= 1 and the column sums <= 1
+    G = spmatrix(
+        np.concatenate([-np.ones(k), np.ones(k), np.ones(k)]).tolist(),
+        np.concatenate([idx, k + idx, 2*k + idx % n]).tolist(),
+        np.concatenate([idx, idx, idx]).tolist(),
+        (2*k + n, k),
+    )
+    h = matrix(np.concatenate([np.zeros(k), np.ones(k), np.ones(n)]))
+    A = spmatrix(1.0, (idx // n).tolist(), idx.tolist(), (m, k))
+    b = matrix(np.ones(m))
+    return G, h, A, b
+
+def get_glpk_assignment(C):
+    """
+    min cost assignment formulated as an LP and solved with glpk
+    """
+    cvxopt = _get_cvxopt()
+    m,n = C.shape
+    G, h, A, b = _get_lp_constraints(m, n)
+    c = cvxopt.matrix(np.ascontiguousarray(C, dtype=np.float64).reshape(m*n))
+    # NOTE must use external solver (such as glpk), the default one is
+    # _very_ slow
+    sol = cvxopt.solvers.lp(c, G, h, A, b, solver='glpk')
+    X = np.array(sol['x']).reshape(m,n) > 0.01
+    return X
+
+# slack allowed on reduced costs when checking a warm start
+WARM_START_TOL = 1e-9
+
+def get_ssp_assignment(C, init=None):
+    """
+    exact rectangular min cost assignment by successive shortest augmenting
+    paths with dual potentials.  `init` may be specified with (row, col)
+    pairs of a partial assignment, such as one taken from an already solved
+    sub-problem, that is repaired by augmenting just the remaining rows
+    rather than solving from scratch.  `init` is only used if it is a
+    min cost assignment of its own rows, otherwise C is solved cold
+    """
+    m, n = C.shape
+    u = np.zeros(m)
+    # column 0 is a virtual column from which each augmenting path starts,
+    # p[j] is the row assigned to column j or -1
+    v = np.zeros(n+1)
+    p = np.full(n+1, -1, dtype=np.int64)
+    if init:
+        warm = _get_warm_potentials(C, init)
+        if warm is not None:
+            rows, cols, u_warm, v_warm = warm
+            u[rows] = u_warm
+            v[1:] = v_warm
+            p[cols+1] = rows
+    assigned = np.zeros(m, dtype=bool)
+    assigned[p[1:][p[1:] >= 0]] = True
+    for i in np.flatnonzero(~assigned):
+        _augment(C, i, u, v, p)
+
+    X = np.zeros(C.shape, dtype=bool)
+    cols = np.flatnonzero(p[1:] >= 0)
+    X[p[cols+1], cols] = True
+    return X
+get_ssp_assignment.warm_start = True
+
+def _augment(C, i, u, v, p):
+    # dijkstra over the columns on reduced costs C - u - v, which are kept
+    # non-negative, extended by the shortest path from row i to a free column
+    n = C.shape[1]
+    # start row i tight against its lowest reduced cost column
+    u[i] = np.min(C[i] - v[1:])
+    p[0] = i
+    j0 = 0
+    minv = np.full(n+1, np.inf)
+    way = np.zeros(n+1, dtype=np.int64)
+    used = np.zeros(n+1, dtype=bool)
+    while True:
+        used[j0] = True
+        i0 = p[j0]
+        cur = np.empty(n+1)
+        cur[0] = np.inf
+        cur[1:] = C[i0] - u[i0] - v[1:]
+        upd = ~used & (cur < minv)
+        minv[upd] = cur[upd]
+        way[upd] = j0
+        free_minv = np.where(used, np.inf, minv)
+        j1 = int(np.argmin(free_minv))
+        delta = free_minv[j1]
+        u[p[used]] += delta
+        v[used] -= delta
+        minv[~used] -= delta
+        j0 = j1
+        if p[j0] < 0:
+            break
+    # flip the assignment along the path
+    while j0:
+        j1 = way[j0]
+        p[j0] = p[j1]
+        j0 = j1
+
+def _get_warm_potentials(C, init):
+    """
+    return (rows, cols, u, v) potentials under which the partial assignment
+    `init` is optimal, or None if there are none.  the potentials of all
+    assigned pairs must be tight, all other reduced costs of the assigned
+    rows non-negative and the potentials of columns non-positive and zero
+    if unassigned, so that the remaining rows can be augmented as if the
+    assigned ones had been
+    """
+    rows = np.array([i for i, _ in init], dtype=np.int64)
+    cols = np.array([j for _, j in init], dtype=np.int64)
+    if (
+        len(set(rows.tolist())) < len(rows) or
+        len(set(cols.tolist())) < len(cols)
+    ):
+        return None
+    n = C.shape[1]
+    Cr = C[rows]
+    c_assigned = C[rows, cols]
+    # tightness gives u = c_assigned - v[cols], so non-negative reduced costs
+    # are the difference constraints v[cols] >= v + c_assigned - Cr, which
+    # are solved for the least potentials by longest paths from the
+    # unassigned columns.  a path that keeps growing is a cycle of cheaper
+    # reassignments
+    v = np.zeros(n)
+    free = np.ones(n, dtype=bool)
+    free[cols] = False
+    if np.any(free):
+        v[cols] = -np.inf
+    for _ in range(len(rows)+1):
+        v_cols = c_assigned + np.max(v - Cr, axis=1)
+        if np.all(v_cols <= v[cols] + WARM_START_TOL):
+            break
+        v[cols] = np.maximum(v[cols], v_cols)
+    else:
+        return None
+    if not np.any(free):
+        v -= np.max(v)
+    # a positive potential means a cheaper assignment to a free column
+    if np.any(v[cols] > WARM_START_TOL):
+        return None
+    v = np.minimum(v, 0)
+    return rows, cols, c_assigned - v[cols], v
+
+#--------------------------------------------------------------------------
+# block decomposition
+#--------------------------------------------------------------------------
+def get_blocks(C, threshold):
+    """
+    return the (rows, cols) of the independent blocks of the assignment
+    problem C, the connected components of the bipartite graph of the
+    entries below `threshold`.  None if there are less than two blocks or
+    if some block cannot assign all of its rows by itself
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    m, n = C.shape
+    rows, cols = np.nonzero(C < threshold)
+    graph = coo_matrix(
+        (np.ones(len(rows)), (rows, m + cols)),
+        shape=(m+n, m+n),
+    )
+    _, labels = connected_components(graph, directed=False)
+    row_labels, col_labels = labels[:m], labels[m:]
+    blocks = []
+    # columns of blocks without rows stay unassigned
+    for label in np.unique(row_labels):
+        block_rows = np.flatnonzero(row_labels == label)
+        block_cols = np.flatnonzero(col_labels == label)
+        if len(block_cols) < len(block_rows):
+            return None
+        blocks.append((block_rows, block_cols))
+    if len(blocks) < 2:
+        return None
+    return blocks
+
+class BlockSolver(object):
+    """
+    wrapper around a solver backend that solves the independent blocks of
+    the cost matrix (see `get_blocks`) separately instead of as one
+    problem.  the combined assignment is only returned if it is optimal
+    for the whole problem, which fails if reassigning rows across blocks
+    is cheaper, otherwise the whole problem is solved after all
+    """
+    def __init__(self, solver=None, threshold=np.inf):
+        self.solver = get_solver(solver)
+        self.threshold = threshold
+        self.name = '{}/blocks<{}'.format(get_solver_name(self.solver), threshold)
+        self.warm_start = getattr(self.solver, 'warm_start', False)
+        self.sparse = getattr(self.solver, 'sparse', None)
+        self.num_split = 0
+        self.num_fallback = 0
+
+    def _solve(self, C, init):
+        return self.solver(C) if init is None else self.solver(C, init=init)
+
+    def __call__(self, C, init=None):
+        blocks = get_blocks(C, self.threshold)
+        if blocks is None:
+            return self._solve(C, init)
+        X = np.zeros(C.shape, dtype=bool)
+        seed = dict(init) if init is not None else None
+        for rows, cols in blocks:
+            block_init = None
+            if seed is not None:
+                # seed each block with the pairs of the seed inside it
+                col_idx = {j : jj for jj, j in enumerate(cols)}
+                block_init = [
+                    (ii, col_idx[seed[i]])
+                    for ii, i in enumerate(rows)
+                    if i in seed and seed[i] in col_idx
+                ] or None
+            X[np.ix_(rows, cols)] = self._solve(C[np.ix_(rows, cols)], block_init)
+        # optimal iff there are potentials under which no reassignment,
+        # across blocks or not, has a negative reduced cost
+        if _get_warm_potentials(C, np.argwhere(X)) is None:
+            self.num_fallback += 1
+            return self._solve(C, init)
+        self.num_split += 1
+        return X
+
+#--------------------------------------------------------------------------
+# sparse assignment
+#--------------------------------------------------------------------------
+def has_sparse_assignment():
+    """
+    whether `get_sparse_assignment` is available, which needs scipy >= 1.6
+    """
+    try:
+        from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+    except ImportError:
+        return False
+    return True
+
+def get_sparse_assignment(C, unmapped_cost):
+    """
+    min cost assignment over the sparse (m x n) matrix C of candidate
+    pairs, where every row is either assigned to one of its candidate
+    columns or left unassigned at `unmapped_cost`, and every column to at
+    most one row.  returns the assigned column of each row, -1 if none
+    """
+    import scipy.sparse as sp
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+    m, n = C.shape
+    C = sp.csr_matrix(C)
+    # a dummy column of its own for every row makes a full matching of the
+    # rows always exist.  explicit zeros are no edges, so all weights are
+    # shifted by 1, which adds m to every full matching alike
+    G = sp.hstack([
+        sp.csr_matrix((C.data + 1, C.indices, C.indptr), shape=C.shape),
+        sp.identity(m, format='csr')*(unmapped_cost + 1),
+    ], format='csr')
+    rows, cols = min_weight_full_bipartite_matching(G)
+    assigned = np.full(m, -1, dtype=np.int64)
+    assigned[rows] = np.where(cols < n, cols, -1)
+    return assigned
+
+class SparseSolver(object):
+    """
+    wrapper around a solver backend that marks problems with at least
+    `min_rows` rows to be solved with `get_sparse_assignment` over the `k`
+    cheapest candidates of each row and column instead of over the dense
+    cost matrix, by whoever builds the cost matrix (see `sparse`).  dense
+    problems are passed on to the wrapped backend
+    """
+    def __init__(self, solver=None, k=8, min_rows=128):
+        self.solver = get_solver(solver)
+        self.sparse = (k, min_rows)
+        self.name = '{}/sparse{}>={}'.format(get_solver_name(self.solver), k, min_rows)
+        self.warm_start = getattr(self.solver, 'warm_start', False)
+
+    def __call__(self, C, init=None):
+        return self.solver(C) if init is None else self.solver(C, init=init)
+
+SOLVERS = {
+    'hungarian' : get_hungarian_assignment,
+    'glpk'      : get_glpk_assignment,
+    'ssp'       : get_ssp_assignment,
+}
+assert sorted(SOLVERS) == SOLVER_NAMES
+
+def get_solver(solver=None):
+    """
+    resolve `solver`, either the name of a registered backend, a backend
+    function or None for the default, to a backend function
+    """
+    if solver is None:
+        solver = DEFAULT_SOLVER
+    if callable(solver):
+        return solver
+    assert solver in SOLVERS, 'unknown assignment solver {}, must be one of {}'.format(
+        solver,
+        ', '.join(sorted(SOLVERS)),
+    )
+    return SOLVERS[solver]
+
+def get_solver_name(solver=None):
+    """
+    name identifying the backend resolved from `solver` across runs
+    """
+    solver = get_solver(solver)
+    if isinstance(solver, (CachedSolver, BlockSolver, SparseSolver)):
+        return solver.name
+    return '{}.{}'.format(
+        solver.__module__,
+        getattr(solver, '__qualname__', type(solver).__qualname__),
+    )
+
+def supports_warm_start(solver=None):
+    """
+    whether the backend resolved from `solver` accepts a partial assignment
+    to start from as `init`
+    """
+    return getattr(get_solver(solver), 'warm_start', False)
+
+class CachedSolver(object):
+    """
+    memoizing wrapper around a solver backend, keyed by a fingerprint of the
+    backend, the shape and contents of the cost matrix and the seed, if
+    any.  the `maxsize` most recently used solutions are kept in memory
+    and, if `cache_dir` is specified, every solution is also stored on disk
+    so that it is reused by later runs.  as with `MappingStore`, reading a
+    solution from disk refreshes its mtime and `prune` evicts the least
+    recently used ones beyond `max_disk_size` bytes, at most once every
+    `prune_interval` seconds, or never if it is None.  backends are
+    deterministic, so a cached solution is exactly the one the backend
+    would return
+    """
+    def __init__(
+        self,
+        solver=None,
+        maxsize=4096,
+        cache_dir=None,
+        max_disk_size=DEFAULT_MAX_SIZE,
+        prune_interval=0,
+    ):
+        self.solver = get_solver(solver)
+        self.name = get_solver_name(self.solver)
+        self.warm_start = getattr(self.solver, 'warm_start', False)
+        self.sparse = getattr(self.solver, 'sparse', None)
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+        self.prune_interval = prune_interval
+        self._last_prune = None
+        # <key>: <(row, col) pairs of the solution>
+        self._solutions = OrderedDict()
+        self.num_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+
+    def get_stats(self):
+        return (self.num_hits, self.num_disk_hits, self.num_misses)
+
+    def _get_key(self, C, init):
+        h = hashlib.sha1(self.name.encode('utf-8'))
+        h.update(np.array(C.shape, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(C, dtype=np.float64).tobytes())
+        if init is not None:
+            h.update(b'init')
+            h.update(np.array(init, dtype=np.int64).tobytes())
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def _load(self, key):
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            nz = np.load(path)
+            os.utime(path)
+            return nz
+        except Exception:
+            logging.warning('Warning, discarding unreadable cached solution {}'.format(path))
+            return None
+
+    def _save(self, key, nz):
+        path = self._get_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write atomically so concurrent runs never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fout:
+                np.save(fout, nz)
+            os.replace(tmp_path, path)
+        except OSError:
+            logging.warning('Warning, unable to write cached solution {}'.format(path))
+
+    def prune(self):
+        """
+        evict the least recently used solutions on disk until they fit in
+        `max_disk_size` bytes and return the number evicted
+        """
+        now = time.monotonic()
+        if self.cache_dir is None or self.prune_interval is None or (
+            self._last_prune is not None and
+            now - self._last_prune < self.prune_interval
+        ):
+            return 0
+        self._last_prune = now
+        return prune_cache_dir(self.cache_dir, self.max_disk_size, '.npy')
+
+    def __call__(self, C, init=None):
+        key = self._get_key(C, init)
+        nz = self._solutions.get(key)
+        if nz is not None:
+            self._solutions.move_to_end(key)
+            self.num_hits += 1
+        else:
+            if self.cache_dir is not None:
+                nz = self._load(key)
+            if nz is not None:
+                self.num_disk_hits += 1
+            else:
+                X = self.solver(C) if init is None else self.solver(C, init=init)
+                nz = np.argwhere(X).astype(np.int32)
+                self.num_misses += 1
+                if self.cache_dir is not None:
+                    self._save(key, nz)
+            self._solutions[key] = nz
+            if len(self._solutions) > self.maxsize:
+                self._solutions.popitem(last=False)
+
+        X = np.zeros(C.shape, dtype=bool)
+        X[nz[:, 0], nz[:, 1]] = True
+        return X
@@ -4,6 +4,7 @@ import collections
 from collections import deque, defaultdict, Counter
 from itertools import chain
 from . import util
+from . import _tokenize
 
 def is_range(keys):
     if not all([k.isdigit() for k in keys]):
@@ -28,12 +29,42 @@ class Interface(object):
     def prefix(self):
         assert self.ports is not None
         return util.common_prefix([p[0] for p in self.all_ports])
+    @property
+    def signature(self):
+        """
+        canonical form shared by isomorphic interfaces, such as replicated
+        instances that only differ in their prefix.  lists the suffix,
+        width, direction, vector length (0 if not a vector) and the words
+        not shared by all ports of each port to map in order of name, which
+        is all that the cost matrix of the interface against a bus def
+        depends on
+        """
+        if self._signature is None:
+            plen = len(self.prefix)
+            dup_words = frozenset.intersection(
+                *[_tokenize.word_ids(p[0]) for p in self.ports]
+            ) if len(self.ports) > 0 else frozenset()
+            self._signature = tuple(
+                (
+                    name[plen:],
+                    w,
+                    d,
+                    len(self._vkey_vector_map[name]) if self.is_vector(name) else 0,
+                    tuple(sorted(
+                        _tokenize.get_word(wid)
+                        for wid in _tokenize.word_ids(name) - dup_words
+                    )),
+                )
+                for name, w, d in sorted(self.get_ports_to_map(), key=lambda p: p[0])
+            )
+        return self._signature
 
     def __init__(self, ports, vectors):
         assert ports is not None
         assert vectors is not None
         self.ports = ports
         self.vectors = vectors
+        self._signature = None
         # <vector port name prefix>: <mapping port>
         self._vkey_mapport_map = {}
         # <vector port name prefix>: <vector>
@@ -92,6 +123,11 @@ class BundleTreeNode(object):
     def vports(self): return iter(self._vports)
     @property
     def interface(self): return self._interface
+    @property
+    def signature(self):
+        # isomorphic subtrees compile to isomorphic interfaces
+        assert self._interface is not None
+        return self._interface.signature
 
     def __init__(
         self,
@@ -272,7 +308,9 @@ class BundleTree(object):
             lambda n: (n.id, n.interface),
         ):
             if nid == rootnid and interface.size >= 100:
-                yield nid, abbr_root_interface
+                # there may be no "rest" if all ports fall under subtrees
+                if abbr_root_interface.size > 0:
+                    yield nid, abbr_root_interface
             elif (
                 (interface.size >= min_size) and
                 (max_size is None or interface.size <= max_size)
@@ -342,12 +380,43 @@ class BundleTree(object):
 
         return bundles
 
+    def get_subtrees(self, split=None):
+        """
+        partition the ports of the tree into (path, ports) subtrees, one for
+        each non-leaf child of the root and a single one with a path ending
+        in `None` for the remaining leaf children of the root, split the same way as
+        `get_bundles`.  if specified, `split(parts)` is called with the port
+        lists of the partition of each non-leaf child, which is the same
+        partition one level down, and returns whether to replace the child
+        by its partition
+        """
+        return self._get_subtrees(self._root_node, (), split)
+
+    def _get_subtrees(self, node, path, split):
+        subtrees = []
+        for ptr, n in node.children_refs:
+            if n.is_leaf:
+                continue
+            parts = self._get_subtrees(n, path+(ptr,), split) if split else []
+            if split and split([ports for _, ports in parts]):
+                subtrees.extend(parts)
+            else:
+                subtrees.append((path+(ptr,), list(n.interface.all_ports)))
+        rest_ports = util.flatten([
+            list(n.interface.all_ports)
+            for n in node.children
+                if n.is_leaf
+        ])
+        if len(rest_ports) > 0:
+            subtrees.append((path+(None,), rest_ports))
+        return subtrees
+
     def _subtree_from_port(self, port):
         """
         convert name of port to subtree to be inserted
         """
         name, _, _ = port
-        words = util.words_from_name(name)
+        words = _tokenize.words_from_name(name)
         nodes = [BundleTreeNode() for i in range(len(words)+1)]
         # leaf should map to port
         nodes[-1].add_port(port)
@@ -0,0 +1,227 @@
+import os
+import pickle
+import multiprocessing
+import hashlib
+import logging
+import tempfile
+
+# bump whenever the pickled representation of a BusDef changes so that
+# stale libraries are discarded rather than unpickled into the wrong shape
+CACHE_VERSION = 3
+
+def get_default_cache_dir():
+    """
+    per-user cache directory, honoring $XDG_CACHE_HOME
+    """
+    root = os.environ.get('XDG_CACHE_HOME')
+    if not root:
+        root = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'duhportinf')
+
+def get_candidate_spec_paths(rootdir):
+    """
+    walk `rootdir` and return all files that could hold a bus spec
+    """
+    spec_paths = []
+    for root, dirs, fnames in os.walk(rootdir):
+        for fname in fnames:
+            if fname.endswith('json5'):
+                spec_paths.append(os.path.join(root, fname))
+    return spec_paths
+
+def _get_digest(spec_path):
+    with open(spec_path, 'rb') as fin:
+        return hashlib.sha1(fin.read()).hexdigest()
+
+def _parse_spec(spec_path):
+    # non bus spec files are recorded with an empty list of bus defs so they
+    # are not parsed again on the next run either
+    from .busdef import BusDef
+    spec = BusDef.load_spec(spec_path)
+    if spec is None:
+        return []
+    return BusDef.bus_defs_from_obj(spec)
+
+class BusLibCache(object):
+    """
+    compiled library of parsed bus defs, keyed by spec path and validated
+    against the mtime, size and content hash of each spec file
+    """
+
+    @classmethod
+    def get_cache_path(cls, cache_dir, rootdir):
+        rkey = hashlib.sha1(os.path.abspath(rootdir).encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, 'buslib-{}.pickle'.format(rkey[:16]))
+
+    @classmethod
+    def load(cls, cache_path):
+        """
+        load a cache from `cache_path`, falling back to an empty cache if
+        it does not exist or is stale
+        """
+        cache = cls(cache_path)
+        if cache_path is None or not os.path.isfile(cache_path):
+            return cache
+        try:
+            with open(cache_path, 'rb') as fin:
+                o = pickle.load(fin)
+            assert o['version'] == CACHE_VERSION
+            cache._entries = o['entries']
+        except Exception:
+            logging.warning('Warning, discarding unreadable bus library cache {}'.format(cache_path))
+        return cache
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        # <abs spec path>: (mtime_ns, size, digest, [bus_def, ...])
+        self._entries = {}
+        self._dirty = False
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def lookup(self, spec_path):
+        """
+        return `(bus_defs, stamp)` for `spec_path`.  on a miss `bus_defs`
+        is None and `stamp` must be passed back to `update` along with the
+        newly parsed bus defs
+        """
+        key = os.path.abspath(spec_path)
+        st = os.stat(spec_path)
+        entry = self._entries.get(key)
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            self.num_hits += 1
+            return entry[3], None
+
+        # stat info changed (touched, copied, checked out), so fall back to
+        # comparing the content hash before paying for a reparse
+        stamp = (st.st_mtime_ns, st.st_size, _get_digest(spec_path))
+        if entry is not None and entry[2] == stamp[2]:
+            self.num_hits += 1
+            self.update(spec_path, stamp, entry[3])
+            return entry[3], None
+        self.num_misses += 1
+        return None, stamp
+
+    def update(self, spec_path, stamp, bus_defs):
+        self._entries[os.path.abspath(spec_path)] = stamp + (bus_defs,)
+        self._dirty = True
+
+    def get_bus_defs(self, spec_path, parse_func=_parse_spec):
+        """
+        return bus defs described in `spec_path`, only parsing the spec if
+        its contents changed since it was cached
+        """
+        bus_defs, stamp = self.lookup(spec_path)
+        if bus_defs is None:
+            bus_defs = parse_func(spec_path)
+            self.update(spec_path, stamp, bus_defs)
+        return bus_defs
+
+    def prune(self, spec_paths):
+        """
+        drop entries for spec files that no longer exist under the root
+        """
+        keep = set(os.path.abspath(p) for p in spec_paths)
+        stale = [k for k in self._entries if k not in keep]
+        for k in stale:
+            del self._entries[k]
+        self._dirty |= len(stale) > 0
+
+    def save(self):
+        if self.cache_path is None or not self._dirty:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write atomically so concurrent runs never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fout:
+                pickle.dump(
+                    {'version': CACHE_VERSION, 'entries': self._entries},
+                    fout,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.warning('Warning, could not write bus library cache {}: {}'.format(
+                self.cache_path, e,
+            ))
+            return
+        self._dirty = False
+
+def get_num_jobs(jobs):
+    """
+    resolve a user specified number of worker processes, where 0 means one
+    per cpu
+    """
+    assert jobs >= 0, 'number of jobs must be non-negative'
+    return jobs if jobs > 0 else (os.cpu_count() or 1)
+
+def parse_specs(spec_paths, jobs=1):
+    """
+    parse `spec_paths` into lists of bus defs, in the same order as
+    `spec_paths`, using a pool of `jobs` worker processes
+    """
+    jobs = min(get_num_jobs(jobs), len(spec_paths))
+    if jobs <= 1:
+        return [_parse_spec(spec_path) for spec_path in spec_paths]
+    # hand out several specs per task to amortize ipc, while still leaving
+    # enough tasks to balance the large specs across workers
+    chunksize = max(1, len(spec_paths) // (4*jobs))
+    with multiprocessing.Pool(jobs) as pool:
+        return pool.map(_parse_spec, spec_paths, chunksize=chunksize)
+
+def load_bus_defs(rootdir, cache_dir=None, jobs=1, cache=None, shared=False):
+    """
+    load all bus defs specified under `rootdir`.  if `cache_dir` is
+    specified, parsed bus defs are reused across runs and only the spec
+    files that changed since the last run are parsed again.  `cache` may
+    be specified with a BusLibCache for `rootdir` that is kept in memory
+    across calls in place of the one in `cache_dir`.  specs that must be
+    parsed are split across `jobs` worker processes (0 for one per cpu),
+    and the bus defs are returned in the same order regardless of the
+    number of jobs.  if `shared` is specified along with `cache_dir`, the
+    bus defs are backed by a shared bus library in `cache_dir` (see
+    `_sharedlib`), which worker processes attach rather than receiving
+    copies of the bus defs
+    """
+    spec_paths = get_candidate_spec_paths(rootdir)
+    if cache is None:
+        cache_path = None if cache_dir is None else \
+            BusLibCache.get_cache_path(cache_dir, rootdir)
+        cache = BusLibCache.load(cache_path)
+    cache_path = cache.cache_path
+    num_hits, num_misses = cache.num_hits, cache.num_misses
+
+    logging.info('loading bus specs from {} candidate files'.format(len(spec_paths)))
+    spec_bus_defs = [None]*len(spec_paths)
+    misses = []
+    for i, spec_path in enumerate(spec_paths):
+        bus_defs, stamp = cache.lookup(spec_path)
+        if bus_defs is None:
+            misses.append((i, spec_path, stamp))
+        else:
+            spec_bus_defs[i] = bus_defs
+
+    parsed = parse_specs([spec_path for _, spec_path, _ in misses], jobs)
+    for (i, spec_path, stamp), bus_defs in zip(misses, parsed):
+        spec_bus_defs[i] = bus_defs
+        cache.update(spec_path, stamp, bus_defs)
+    cache.prune(spec_paths)
+    cache.save()
+
+    bus_defs = [bd for bds in spec_bus_defs for bd in bds]
+    if cache_path is not None:
+        logging.info('  - bus library cache: {} reused, {} parsed'.format(
+            cache.num_hits - num_hits,
+            cache.num_misses - num_misses,
+        ))
+    logging.info('  - done, loaded {} bus defs with {} required and {} optional ports '.format(
+        len(bus_defs),
+        sum([bd.num_req_ports for bd in bus_defs]),
+        sum([bd.num_opt_ports for bd in bus_defs]),
+    ))
+    if shared and cache_dir is not None:
+        from ._sharedlib import get_shared_bus_defs
+        bus_defs = get_shared_bus_defs(bus_defs, cache_dir, rootdir)
+    return bus_defs
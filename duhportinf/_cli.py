@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import socket
+import logging
+import argparse
+from ._defaults import (
+    SOLVER_NAMES,
+    DEFAULT_SOLVER,
+    DEFAULT_MAX_SIZE,
+    SPARSE_MIN_PORTS,
+)
+from ._buslib import get_default_cache_dir
+
+# arguments that name files, which are made absolute before a request is
+# handed to a server running in another directory
+PATH_ARGS = ['duh_bus', 'output', 'cache_dir', 'incremental', 'component_json5']
+
+def _positive_int(value):
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: {!r}'.format(value))
+    if n < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got {}'.format(value))
+    return n
+
+def get_portinf_parser(prog=None, batch=False):
+    """
+    argument parser shared by `duh-portinf` and its client.  if `batch` is
+    specified, the parser of `duh-portinf-batch` instead, which takes any
+    number of components and writes the output of each next to it
+    """
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument(
+        '-b', '--duh-bus',
+        default=None,
+        required=False,
+        help='duh-bus root directory that contains bus specifications.  will default to $(duh-bus-which), which requires duh-bus to be installed',)
+    if not batch:
+        parser.add_argument(
+            '-o', '--output',
+            default=sys.stdout,
+            required=False,
+            help='output path to busprop.json with proposed bus mappings for select groups of ports (default: stdout)',
+        )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        required=False,
+        help='number of worker processes used to parse bus specs and map {} (0: one per cpu, default: 1)'.format(
+            'components' if batch else 'ports'
+        ),
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        required=False,
+        help='keep the compiled bus library and bus mapping caches in this directory across runs, e.g. {} (default: nothing is written to disk)'.format(get_default_cache_dir()),
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='ignore --cache-dir, always parse bus specs and map ports from scratch and do not update the cache',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE >> 20,
+        required=False,
+        help='maximum size in MB of each of the bus mapping and assignment solution caches, least recently used entries are evicted beyond it (default: {})'.format(DEFAULT_MAX_SIZE >> 20),
+    )
+    parser.add_argument(
+        '--solver',
+        choices=SOLVER_NAMES,
+        default=DEFAULT_SOLVER,
+        required=False,
+        help='assignment solver backend used to map ports to bus defs (default: {})'.format(DEFAULT_SOLVER),
+    )
+    parser.add_argument(
+        '--decompose',
+        action='store_true',
+        help='solve the ports of each direction as separate, smaller assignment problems, falling back to the whole problem whenever that would not be optimal',
+    )
+    parser.add_argument(
+        '--sparse-k',
+        type=_positive_int,
+        default=None,
+        required=False,
+        metavar='K',
+        help='map port groups of at least {} ports over the K cheapest bus ports of each port and ports of each bus port only, instead of over all pairs (default: all pairs)'.format(SPARSE_MIN_PORTS),
+    )
+    parser.add_argument(
+        '--solve-cache',
+        action='store_true',
+        help='also keep assignment solutions in the cache directory so that identical solves are skipped on later runs',
+    )
+    parser.add_argument(
+        '--keep-alts',
+        type=_positive_int,
+        default=None,
+        required=False,
+        help='only keep the K lowest cost bus mappings for each port group, skipping bus mapping solves that provably cannot place among them (default: keep all)',
+    )
+    if not batch:
+        parser.add_argument(
+            '--incremental',
+            default=None,
+            required=False,
+            metavar='PREV_OUTPUT',
+            help='output of a previous run on an earlier version of the component, port groups whose ports did not change are carried forward from it and only the remaining ports are mapped',
+        )
+    parser.add_argument(
+        '--debug',
+        action='store_true',
+        help='dump debug format',
+
+    )
+    if batch:
+        parser.add_argument(
+            'component_json5s',
+            nargs='+',
+            metavar='component_json5',
+            help='input component.json5 files or glob patterns matching them, the output of each is written next to it as <name>.portinf.json',
+        )
+    else:
+        parser.add_argument(
+            'component_json5',
+            help='input component.json5 with port list of top-level module',
+
+        )
+    return parser
+
+def check_portinf_args(args):
+    assert os.path.isfile(args.component_json5), '{} does not exist'.format(args.component_json5)
+    assert args.incremental is None or os.path.isfile(args.incremental), \
+        '{} does not exist'.format(args.incremental)
+    if args.output != sys.stdout and os.path.dirname(args.output) != '':
+        dn = os.path.dirname(args.output)
+        assert os.path.isdir(dn), 'output directory {} does not exist'.format(dn)
+    assert args.duh_bus is None or os.path.isdir(args.duh_bus), \
+        '{} not a directory'.format(args.duh_bus)
+    if args.solve_cache and get_cache_dir(args) is None:
+        logging.warning('Warning, --solve-cache has no effect without --cache-dir')
+
+def get_cache_dir(args):
+    """
+    cache directory selected by the parsed `args`, or None if caching is
+    disabled, which is the default
+    """
+    return None if args.no_cache else args.cache_dir
+
+def get_abs_args(args):
+    """
+    return a copy of the parsed `args` as a dict with all paths made
+    absolute and stdout as None
+    """
+    d = dict(vars(args))
+    for k in PATH_ARGS:
+        if d[k] is sys.stdout:
+            d[k] = None
+        elif d[k] is not None:
+            d[k] = os.path.abspath(d[k])
+    return d
+
+#--------------------------------------------------------------------------
+# duh-portinfd client
+#--------------------------------------------------------------------------
+def get_default_socket_path():
+    return os.path.join(get_default_cache_dir(), 'portinfd.sock')
+
+def send_request(socket_path, request):
+    """
+    send `request` to the server listening on `socket_path` and return its
+    response.  a response that can not be decoded is returned as an error
+    response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as fin:
+            data = fin.read()
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return {
+            'status' : 1,
+            'log' : '',
+            'output' : None,
+            'error' : 'invalid response from duh-portinfd: {!r}'.format(data[:80]),
+        }
+
+def is_listening(socket_path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,15 @@
+# defaults shared by the command line parser and the modules implementing
+# them.  this module must only import the standard library, as every entry
+# point, including the thin duh-portinfd client, loads it to parse its
+# arguments
+
+# names of the assignment solver backends in `_assign.SOLVERS`
+SOLVER_NAMES = ['glpk', 'hungarian', 'ssp']
+DEFAULT_SOLVER = 'hungarian'
+
+# default bound on the total size of the bus mapping store
+DEFAULT_MAX_SIZE = 256 << 20
+
+# interfaces with at least this many ports to map are solved over a sparse
+# candidate graph with --sparse-k
+SPARSE_MIN_PORTS = 128
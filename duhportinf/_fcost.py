@@ -0,0 +1,246 @@
+import numpy as np
+from collections import Counter
+from ._optimize import (
+    MatchCost,
+    get_dup_words,
+    get_effective_words,
+)
+from . import util
+from . import _tokenize
+
+def get_interface_tokens(interface):
+    """
+    name token ids of all interface ports, less the words shared by every
+    port
+    """
+    dup_words = get_dup_words(interface.ports)
+    p_words = frozenset().union(
+        *[_tokenize.word_ids(p[0]) for p in interface.ports]
+    )
+    return _tokenize.ngram_ids(p_words - dup_words)
+
+class BusDefIndex(object):
+    """
+    index over a library of bus defs for computing fcosts of interfaces
+    against all bus defs at once.
+
+    port name n-grams are mapped to integer ids and each bus def is stored
+    as a row of a sparse n-gram incidence matrix, the transpose of which is
+    an inverted index from n-grams to bus defs.  a single sparse product
+    with the incidence matrix of a batch of interfaces gives the exact name
+    component of the global and local fcost of every interface against
+    every bus def, which is in turn a lower bound on the full fcost.
+    """
+    @property
+    def bus_defs(self): return list(self._bus_defs)
+
+    def __init__(self, bus_defs):
+        self._bus_defs = list(bus_defs)
+        self._token_ids = {}
+        self._bus_tokens = util.get_incidence_matrix(
+            [bd.compiled.all_ngrams for bd in self._bus_defs],
+            self._token_ids,
+            add_tokens=True,
+        )
+        self._num_tokens = np.asarray(
+            self._bus_tokens.sum(axis=1),
+            dtype=np.float64,
+        ).ravel()
+
+        # encode required and optional ports of each bus def as dense
+        # histograms over all distinct (width, direction) keys in the library
+        wd_keys = {}
+        for bd in self._bus_defs:
+            for counts in [bd.compiled.req_wd_counts, bd.compiled.opt_wd_counts]:
+                for k in counts:
+                    wd_keys.setdefault(k, len(wd_keys))
+        self._wd_keys = wd_keys
+        self._req_wd = np.zeros((len(self._bus_defs), len(wd_keys)), dtype=np.int64)
+        self._opt_wd = np.zeros((len(self._bus_defs), len(wd_keys)), dtype=np.int64)
+        for i, bd in enumerate(self._bus_defs):
+            for k, cnt in bd.compiled.req_wd_counts.items():
+                self._req_wd[i, wd_keys[k]] = cnt
+            for k, cnt in bd.compiled.opt_wd_counts.items():
+                self._opt_wd[i, wd_keys[k]] = cnt
+        key_dirs = np.array([k[-1] for k in wd_keys], dtype=np.int64)
+        self._key_dir_masks = [key_dirs == 1, key_dirs == -1]
+
+    def __len__(self):
+        return len(self._bus_defs)
+
+    def get_name_fcosts(self, interface):
+        """
+        return the global (jaccard distance) and local (fraction of missing
+        bus def tokens) name fcosts of `interface` against all bus defs
+        """
+        fcosts_global, fcosts_local = self.get_name_fcosts_batch([interface])
+        return fcosts_global[0], fcosts_local[0]
+
+    def get_name_fcosts_batch(self, interfaces):
+        """
+        return `(interfaces x bus defs)` matrices of global (jaccard
+        distance) and local (fraction of missing bus def tokens) name
+        fcosts
+        """
+        p_token_sets = [get_interface_tokens(i) for i in interfaces]
+        p_num_tokens = np.array(
+            [len(tokens) for tokens in p_token_sets],
+            dtype=np.float64,
+        )[:, None]
+        # tokens absent from the library still count towards the size of the
+        # interface token set, but never towards an intersection
+        hits = (
+            util.get_incidence_matrix(p_token_sets, self._token_ids) @
+            self._bus_tokens.T
+        ).toarray()
+        union = p_num_tokens + self._num_tokens - hits
+        name_fcosts_global = 1 - hits / union
+        name_fcosts_local = (self._num_tokens - hits) / self._num_tokens
+        return name_fcosts_global, name_fcosts_local
+
+    def get_port_name_bounds(self, interface, ports):
+        """
+        return a `(ports x bus defs)` matrix of lower bounds on the name
+        mismatch cost of each of `ports` with the nearest match port of each
+        bus def.  this is the fraction of the n-grams of the port found in
+        no port of the bus def, as its jaccard distance to any one of them
+        is at least that
+        """
+        p_token_sets = [
+            _tokenize.ngram_ids(w) for w in get_effective_words(interface, ports)
+        ]
+        p_num_tokens = np.array(
+            [len(tokens) for tokens in p_token_sets],
+            dtype=np.float64,
+        )[:, None]
+        hits = (
+            util.get_incidence_matrix(p_token_sets, self._token_ids) @
+            self._bus_tokens.T
+        ).toarray()
+        # ports without any n-gram share none with any bus port
+        return 1 - hits / np.maximum(p_num_tokens, 1)
+
+    def get_wd_fcosts(self, interface, idx=None):
+        """
+        return the width+direction components of the global and local fcost
+        of `interface` against the bus defs at `idx` (default: all) as
+        arrays `(wc_global, dc_global, wc_local, dc_local)`.  this is the
+        batched equivalent of `_optimize._get_mapping_fcost_base`
+        """
+        if idx is None:
+            idx = np.arange(len(self._bus_defs))
+        phy_cnts = Counter(p[1:] for p in interface.get_ports_to_map())
+        # physical keys that do not appear anywhere in the library can only
+        # ever be matched on direction
+        phy = np.zeros(len(self._wd_keys), dtype=np.int64)
+        phy_extra = [0, 0]
+        for k, cnt in phy_cnts.items():
+            if k in self._wd_keys:
+                phy[self._wd_keys[k]] = cnt
+            elif k[-1] == 1:
+                phy_extra[0] += cnt
+            elif k[-1] == -1:
+                phy_extra[1] += cnt
+
+        # first match exact (width, direction) keys with required ports and
+        # then with optional ports
+        req = self._req_wd[idx]
+        opt = self._opt_wd[idx]
+        num_matched = np.minimum(phy, req)
+        phy_umap = phy - num_matched
+        req = req - num_matched
+        num_matched = np.minimum(phy_umap, opt)
+        phy_umap = phy_umap - num_matched
+        opt = opt - num_matched
+
+        # then try coarser matches requiring just direction to match
+        wc = np.zeros(len(idx), dtype=np.int64)
+        dc = np.zeros(len(idx), dtype=np.int64)
+        phy_umap_total = np.zeros(len(idx), dtype=np.int64)
+        for dmask, extra in zip(self._key_dir_masks, phy_extra):
+            ppc = phy_umap[:, dmask].sum(axis=1) + extra
+            brc = req[:, dmask].sum(axis=1)
+            boc = opt[:, dmask].sum(axis=1)
+
+            num_dir_matched = np.minimum(ppc, brc)
+            ppc = ppc - num_dir_matched
+            brc = brc - num_dir_matched
+            # harsh penalty for unmatched required bus ports
+            wc += num_dir_matched + brc
+            dc += brc
+
+            # no cost for unmatched optional bus ports
+            num_dir_matched = np.minimum(ppc, boc)
+            ppc = ppc - num_dir_matched
+            wc += num_dir_matched
+            phy_umap_total += ppc
+
+        # only the global fcost penalizes unmatched physical ports
+        return (
+            wc + phy_umap_total,
+            dc + phy_umap_total,
+            wc,
+            dc,
+        )
+
+def get_mapping_cost_bounds(interface, bus_defs, bus_index=None):
+    """
+    cheap lower bounds on the value of the cost of the bus mapping returned
+    by `map_ports_to_bus(interface, bus_def)` for each of `bus_defs`.
+    `bus_index`, if specified, must be built over `bus_defs`
+    """
+    if bus_index is None:
+        bus_index = BusDefIndex(bus_defs)
+    ports = list(interface.get_ports_to_map())
+    # each physical port is either in the primary mapping, costing at least
+    # its name mismatch with the nearest bus port, or is a sideband port,
+    # which is penalized with a width+direction mismatch
+    name_bounds = np.minimum(
+        MatchCost.NAME_W*bus_index.get_port_name_bounds(interface, ports)/len(ports),
+        MatchCost(0,1,1).value,
+    ).sum(axis=0)
+
+    # each physical port not mapped to a bus port of the same direction and
+    # each required bus port not mapped from a physical port of the same
+    # direction adds at least one direction mismatch
+    phy_cnts = Counter(p[2] for p in ports)
+    bounds = []
+    for bus_def, name_bound in zip(bus_defs, name_bounds):
+        cbd = bus_def.compiled
+        bus_cnts = Counter(p[2] for p in cbd.match_ports)
+        req_cnts = Counter(p[2] for p in cbd.req_set)
+        dirs = set(phy_cnts) | set(req_cnts)
+        num_dir_umap_phy = sum([
+            max(phy_cnts[d] - bus_cnts[d], 0) for d in dirs
+        ])
+        num_dir_umap_req = sum([
+            max(req_cnts[d] - phy_cnts[d], 0) for d in dirs
+        ])
+        # a single mismatched pair can account for both an unmatched
+        # physical and required bus port, so these bounds can not be summed
+        dir_bound = MatchCost.DIR_W*max(num_dir_umap_phy, num_dir_umap_req)
+        bounds.append(max(name_bound, dir_bound))
+    return bounds
+
+def get_lowest_fcosts(bounds, fcosts_func, k, batch_size=16):
+    """
+    return the `k` lowest `(fcost, i)` pairs, ordered by fcost value and
+    then by i.  `bounds[i]` must be a lower bound on the value of the fcost
+    of candidate i.  candidates are scored in batches with
+    `fcosts_func(idx)` in order of increasing bound, until no remaining
+    bound can place among the `k` lowest
+    """
+    order = np.argsort(bounds, kind='stable')
+    lowest = []
+    start = 0
+    while start < len(order):
+        if len(lowest) >= k and bounds[order[start]] > lowest[k-1][0]:
+            break
+        idx = order[start:start+batch_size]
+        for i, fcost in zip(idx, fcosts_func(idx)):
+            lowest.append((fcost.value, i, fcost))
+        lowest.sort(key=lambda x: x[:2])
+        start += batch_size
+        # widen the batch if the bounds were not tight enough
+        batch_size *= 2
+    return [(fcost, i) for _, i, fcost in lowest[:k]]
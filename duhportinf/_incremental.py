@@ -0,0 +1,147 @@
+import re
+import json
+import json5
+import logging
+from . import util
+from ._bundle import BundleTree
+
+_busint_re = re.compile(r'^busint-portgroup_(\d+)-mapping_(\d+)-')
+
+def _get_portmap_names(o):
+    # port names of a portMaps value, which may hold vectors and user group
+    # lists of either
+    if isinstance(o, str):
+        return [o]
+    if isinstance(o, dict):
+        return util.flatten([_get_portmap_names(v) for v in o.values()])
+    return util.flatten([_get_portmap_names(v) for v in o])
+
+def _get_bus_key(bus_type, driver_type):
+    return (json.dumps(bus_type, sort_keys=True), driver_type)
+
+def get_prev_port_groups(prev_json, ports, bus_defs):
+    """
+    diff `ports` against the port groups recorded by a previous run in the
+    duh-document `prev_json` and return `(carried, remaining_ports)`.
+
+    ports are split into the subtrees of their `BundleTree`.  a subtree is
+    dirty if any of its ports are new to the previous run or changed width
+    or direction, or if it holds a port of a previous port group that can
+    not be carried forward because it lost ports or its bus defs are no
+    longer in `bus_defs`.  dirty subtrees are split further as long as no
+    previous port group spans more than one of their children.  port groups
+    of clean subtrees are carried forward as is, `carried` holds their
+    definitions to be passed on to `util.dump_json_bus_candidates`, and
+    `remaining_ports` are the ports of dirty subtrees that need to be mapped
+    again
+    """
+    with open(prev_json) as fin:
+        prev = json5.load(fin)
+    defs = prev.get('definitions', {})
+    prev_ports = {
+        p[0] : p for p in util.format_ports(prev['component']['model']['ports'])
+    }
+    bus_keys = set([_get_bus_key(bd.bus_type, bd.driver_type) for bd in bus_defs])
+
+    # <port group number>: [(<mapping number>, <name>), ...]
+    group_names = {}
+    for name in defs.get('busDefinitions', {}):
+        m = _busint_re.match(name)
+        if m:
+            group_names.setdefault(int(m.group(1)), []).append((int(m.group(2)), name))
+
+    # <port group number>: <port names>
+    group_pnames = {}
+    for n, names in group_names.items():
+        # the primary mapping lists every port of the port group
+        o = defs['busDefinitions'][sorted(names)[0][1]]
+        group_pnames[n] = set(_get_portmap_names(o['abstractionTypes'][0]['portMaps']))
+
+    # ports the previous run had to map, either grouped or left over
+    prev_pnames = set(util.flatten(group_pnames.values()))
+    prev_pnames.update([p[0] for p in util.get_unassigned_ports(prev_json)])
+
+    curr_ports = {p[0] : p for p in ports}
+    dirty_pnames = set([
+        pn for pn, p in curr_ports.items()
+            if pn not in prev_pnames or prev_ports.get(pn) != p
+    ])
+    group_ports = {}
+    for n, pnames in group_pnames.items():
+        if (
+            all([pn in curr_ports for pn in pnames]) and
+            all([
+                _get_bus_key(o['busType'], o['interfaceMode']) in bus_keys
+                for o in [defs['busDefinitions'][name] for _, name in group_names[n]]
+            ])
+        ):
+            group_ports[n] = pnames
+        else:
+            dirty_pnames.update([pn for pn in pnames if pn in curr_ports])
+
+    def split(parts):
+        # only split subtrees with changes, and only if no port group spans
+        # more than one part
+        part_idx = {}
+        for k, sports in enumerate(parts):
+            part_idx.update([(p[0], k) for p in sports])
+        return (
+            any([pn in dirty_pnames for pn in part_idx]) and
+            all([
+                len(set([part_idx[pn] for pn in pnames if pn in part_idx])) <= 1
+                for pnames in group_ports.values()
+            ])
+        )
+    subtree_keys = {}
+    for key, sports in BundleTree(ports).get_subtrees(split):
+        subtree_keys.update([(p[0], key) for p in sports])
+    dirty = set([subtree_keys[pn] for pn in dirty_pnames])
+    group_ports = {
+        n : pnames for n, pnames in group_ports.items()
+            if not any([subtree_keys[pn] in dirty for pn in pnames])
+    }
+
+    carried_names = set(util.flatten([
+        [name for _, name in group_names[n]] for n in group_ports
+    ]))
+    def is_carried_ref(ref):
+        return ref['$ref'].split('/')[-1] in carried_names
+    # port group entries are listed in order of their port group numbers,
+    # but the numbers in their keys may differ from those of their bus
+    # interfaces, so they are matched by position whenever possible
+    pgos = defs.get('busMappedPortGroups', [])
+    if len(pgos) == len(group_names):
+        group_pgos = dict(zip(sorted(group_names), pgos))
+    else:
+        pgo_map = {pgo[0] : pgo for pgo in pgos}
+        group_pgos = {
+            n : pgo_map['portgroup_{}'.format(n)] for n in group_names
+                if 'portgroup_{}'.format(n) in pgo_map
+        }
+    component = prev['component']
+    carried = {
+        'pg_cnt' : defs.get('pg_cnt', 0),
+        'busDefinitions' : {
+            name : o for name, o in defs.get('busDefinitions', {}).items()
+                if name in carried_names
+        },
+        'busMappedPortGroups' : [
+            group_pgos[n] for n in sorted(group_ports) if n in group_pgos
+        ],
+        'busInterfaces' : [
+            ref for ref in component.get('busInterfaces', [])
+                if '$ref' in ref and is_carried_ref(ref)
+        ],
+        'busInterfaceAlts' : [
+            ref for ref in component.get('busInterfaceAlts', [])
+                if '$ref' in ref and is_carried_ref(ref)
+        ],
+    }
+    remaining_ports = [p for p in ports if subtree_keys[p[0]] in dirty]
+    logging.info('  - carried forward {} of {} port groups, {} of {} ports left to map'.format(
+        len(group_ports),
+        len(group_names),
+        len(remaining_ports),
+        len(ports),
+    ))
+    return carried, remaining_ports
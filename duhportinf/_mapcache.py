@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import time
+from . import util
+from ._defaults import DEFAULT_MAX_SIZE
+
+# bump whenever the serialized form of a mapping changes so that stale
+# entries are never read back
+CACHE_VERSION = 1
+
+class MappingStore(object):
+    """
+    content addressed on-disk store of primary bus mappings, shared across
+    runs.  entries are json files named by a digest of everything the
+    mapping depends on, see `_optimize.MappingClassCache`.  reading an
+    entry refreshes its mtime, so that once the store grows beyond
+    `max_size` bytes the least recently used entries are evicted first.
+    long-lived stores may set `prune_interval` to walk the store at most
+    once every `prune_interval` seconds, or to None to leave pruning to
+    another store over the same directory
+    """
+    @classmethod
+    def get_key(cls, *parts):
+        return hashlib.sha1(
+            json.dumps(
+                [CACHE_VERSION] + list(parts),
+                default=util.json_default,
+            ).encode('utf-8')
+        ).hexdigest()
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE, prune_interval=0):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self._last_prune = None
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_stats(self):
+        return (self.num_hits, self.num_misses)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        return the value stored under `key` or None
+        """
+        path = self._get_path(key)
+        value = None
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as fin:
+                    value = json.load(fin)
+                os.utime(path)
+            except (OSError, ValueError):
+                logging.warning('Warning, discarding unreadable cached mapping {}'.format(path))
+                value = None
+        if value is None:
+            self.num_misses += 1
+        else:
+            self.num_hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._get_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write atomically so concurrent runs never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as fout:
+                json.dump(value, fout, default=util.json_default)
+            os.replace(tmp_path, path)
+        except OSError:
+            logging.warning('Warning, unable to write cached mapping {}'.format(path))
+
+    def prune(self):
+        """
+        evict the least recently used entries until the store fits in
+        `max_size` bytes and return the number evicted
+        """
+        now = time.monotonic()
+        if self.prune_interval is None or (
+            self._last_prune is not None and
+            now - self._last_prune < self.prune_interval
+        ):
+            return 0
+        self._last_prune = now
+        return prune_cache_dir(self.cache_dir, self.max_size, '.json')
+
+def prune_cache_dir(cache_dir, max_size, ext):
+    """
+    evict the least recently used (by mtime) files ending in `ext` under
+    `cache_dir` until they fit in `max_size` bytes and return the number
+    evicted
+    """
+    entries = []
+    for root, dirs, fnames in os.walk(cache_dir):
+        for fname in fnames:
+            if not fname.endswith(ext):
+                continue
+            path = os.path.join(root, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, path, st.st_size))
+    total = sum([size for _, _, size in entries])
+    num_evicted = 0
+    for _, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        num_evicted += 1
+    return num_evicted
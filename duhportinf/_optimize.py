@@ -1,37 +1,47 @@
 import numpy as np
+import logging
 import operator
-import cvxopt
 from collections import Counter, defaultdict
-from cvxopt import matrix, solvers
-from cvxopt.modeling import variable, dot, op
-from cvxopt.modeling import sum as cvx_sum
 from . import util
+from . import _tokenize
+from ._assign import (
+    get_solver,
+    get_solver_name,
+    supports_warm_start,
+    get_sparse_assignment,
+    has_sparse_assignment,
+    BlockSolver,
+    SparseSolver,
+)
+from ._mapcache import MappingStore
+from ._defaults import SPARSE_MIN_PORTS
 
-solvers.options['show_progress'] = False
-solvers.options['glpk'] = dict(msg_lev='GLP_MSG_OFF')
+# bump whenever the cost model changes so that mappings cached on disk by
+# earlier versions are not reused
+COST_MODEL_VERSION = 1
 
 def _get_port_words(interface, bus_def):
     dup_words = get_dup_words(interface.ports)
     # get tokens for all port names (less duplicate words appearing in all
     # signals) and bus def logical names and return jaccard distance as a
     # measure of compatibility
-    p_words = set(util.flatten(
-        [util.words_from_name(p[0]) for p in interface.ports]
-    ))
+    p_words = frozenset().union(
+        *[_tokenize.word_ids(p[0]) for p in interface.ports]
+    )
     p_words -= dup_words
-    b_words = set(util.flatten([
-        bus_def.words_from_name(p[0])
-        for pp in [bus_def.req_ports, bus_def.opt_ports] for p in pp
-    ]))
-    return p_words, b_words
+    return p_words, bus_def.compiled.all_words
 
 def _get_name_fcost1(interface, bus_def):
-    p_words, b_words = _get_port_words(interface, bus_def)
-    return util.get_jaccard_dist(p_words, b_words)
+    p_words, _ = _get_port_words(interface, bus_def)
+    p_tokens = _tokenize.ngram_ids(p_words)
+    b_tokens = bus_def.compiled.all_ngrams
+    return 1 - len(p_tokens & b_tokens) / len(p_tokens | b_tokens)
 
 def _get_name_fcost2(interface, bus_def):
-    p_words, b_words = _get_port_words(interface, bus_def)
-    return util.get_frac_missing_tokens(b_words, p_words)
+    p_words, _ = _get_port_words(interface, bus_def)
+    p_tokens = _tokenize.ngram_ids(p_words)
+    b_tokens = bus_def.compiled.all_ngrams
+    return len(b_tokens - p_tokens) / len(b_tokens)
 
 def get_mapping_fcost_global(interface, bus_def):
     """
@@ -62,8 +72,8 @@ def _get_mapping_fcost_base(interface, bus_def, penalize_umap=True):
     ports = interface.get_ports_to_map()
     # strip name and just match based off of width+direction
     phy_port_cnts = Counter(map(lambda x: tuple(x[1:]), ports))
-    bus_req_port_cnts = Counter(map(lambda x: tuple(x[1:]), bus_def.req_ports))
-    bus_opt_port_cnts = Counter(map(lambda x: tuple(x[1:]), bus_def.opt_ports))
+    bus_req_port_cnts = Counter(bus_def.compiled.req_wd_counts)
+    bus_opt_port_cnts = Counter(bus_def.compiled.opt_wd_counts)
 
     ds = [
         phy_port_cnts,
@@ -127,25 +137,57 @@ def _get_mapping_fcost_base(interface, bus_def, penalize_umap=True):
 
     return cost
 
-def map_ports_to_bus(interface, bus_def, penalize_umap=True):
+def map_ports_to_bus(
+    interface,
+    bus_def,
+    penalize_umap=True,
+    solver=None,
+    row_cache=None,
+    warm_starts=None,
+    class_cache=None,
+):
     """
     optimally map interface ports to bus definition {req, opt} ports by
-    formulating as a convex LP and solving
+    solving the min cost assignment problem with the backend `solver` (see
+    `_assign.SOLVERS`).  `row_cache` may be specified with a CostRowCache
+    shared across calls, `warm_starts` with a WarmStartCache to seed
+    solvers that support it with the solutions of nested interfaces and
+    `class_cache` with a MappingClassCache to only solve once for all
+    isomorphic interfaces
+    """
+    ports = interface.get_ports_to_map()
+    init = None
+    if warm_starts is not None and supports_warm_start(solver):
+        init = warm_starts.get_init(ports, bus_def)
+    mapping = None
+    if class_cache is not None:
+        mapping = class_cache.get_mapping(interface, bus_def, init)
+    if mapping is None:
+        mapping = solve_ports_to_bus(interface, bus_def, solver, row_cache, init)
+        if class_cache is not None:
+            class_cache.add_mapping(interface, bus_def, init, mapping)
+    if warm_starts is not None:
+        warm_starts.add(ports, bus_def, mapping)
+    return get_bus_mapping(interface, bus_def, mapping, penalize_umap)
+
+def solve_ports_to_bus(interface, bus_def, solver=None, row_cache=None, init=None):
+    """
+    return the primary mapping of interface ports to bus def ports that
+    solves the min cost assignment problem, prior to designating sideband
+    ports.  `init` may be specified with a partial mapping to seed solvers
+    that support it
     """
-    # get cost functions from closure, which takes into account specifics of
-    # bus_def
-    match_cost_func, mapping_cost_func = get_cost_funcs(interface, bus_def)
-
     ports = interface.get_ports_to_map()
-    ports1 = list(ports)
-    ports2 = list(bus_def.req_ports)
-    ports2.extend(bus_def.opt_ports)
+    # order by name so that the mapping does not depend on set order
+    ports1 = list(sorted(ports, key=lambda p: p[0]))
+    ports2 = list(bus_def.compiled.match_ports)
+
+    sparse = getattr(get_solver(solver), 'sparse', None)
+    if sparse is not None and len(ports1) >= sparse[1] and len(ports2) > 0:
+        return solve_ports_to_bus_sparse(interface, ports1, bus_def, sparse[0])
 
     m, n  = len(ports1), len(ports2)
-    C = np.zeros((m, n))
-    for i, p1 in enumerate(ports1):
-        for j, p2 in enumerate(ports2):
-            C[i,j] = match_cost_func(p1, p2).value
+    C = get_cost_matrix(interface, ports1, bus_def, row_cache)
 
     # swap phy ports with bus def so that the columns are always the ones
     # underdetermined
@@ -167,25 +209,66 @@ def map_ports_to_bus(interface, bus_def, penalize_umap=True):
 
     X = _get_greedy_assignment(C)
     if not is_satisfiable(X):
-        X = _get_convex_opt_assignment(C)
+        if init is not None:
+            if swap:
+                init = {v:k for k, v in init.items()}
+            idx1 = {p : i for i, p in enumerate(ports1)}
+            idx2 = {p : j for j, p in enumerate(ports2)}
+            X = get_solver(solver)(C, init=[
+                (idx1[k], idx2[v]) for k, v in init.items()
+            ])
+        else:
+            X = get_solver(solver)(C)
         #assert is_satisfiable(X)
 
     mapping = {ports1[i] : ports2[j] for i, j in np.argwhere(X)}
     if swap:
         mapping = {v:k for k, v in mapping.items()}
+    return mapping
+
+def solve_ports_to_bus_sparse(interface, ports, bus_def, k):
+    """
+    return the mapping of `ports` to bus def ports of least cost among the
+    ones that only map each port to one of its `k` cheapest bus def ports
+    or a bus def port to one of its `k` cheapest ports, see
+    `get_sparse_cost_matrix`.  as many ports as possible are mapped, the
+    rest are left unmapped
+    """
+    ports2 = list(bus_def.compiled.match_ports)
+    C = get_sparse_cost_matrix(interface, ports, bus_def, k)
+    # more than any mapping of all ports costs, so that leaving a port
+    # unmapped never pays off if it could be mapped instead
+    max_cost = MatchCost.NAME_W + MatchCost.WIDTH_W + MatchCost.DIR_W
+    cols = get_sparse_assignment(C, max_cost*(len(ports)+1))
+    return {ports[i] : ports2[j] for i, j in enumerate(cols) if j >= 0}
+
+def get_bus_mapping(interface, bus_def, mapping, penalize_umap=True):
+    """
+    return the BusMapping given by the primary `mapping` of interface ports
+    to bus def ports, designating poorly matched and unmapped ports as
+    sideband ports
+    """
+    # get cost functions from closure, which takes into account specifics of
+    # bus_def
+    match_cost_func, mapping_cost_func = get_cost_funcs(interface, bus_def)
+
+    ports = interface.get_ports_to_map()
+    mapping = dict(mapping)
     sideband_ports = get_sideband_ports(
         mapping,
         ports,
         bus_def,
         match_cost_func,
     )
+    # keep a stable order of sideband ports in all derived mappings
+    sorted_sideband_ports = list(sorted(sideband_ports, key=lambda p: p[0]))
     # create a separate 'best guess' mapping for sideband ports
     # all ports without a primary mapping mapped to None
     sideband_mapping = {
         k : v for k,v in mapping.items() if k in sideband_ports
     }
     sideband_mapping.update({
-        k : None for k in sideband_ports if k not in mapping
+        k : None for k in sorted_sideband_ports if k not in mapping
     })
     # remove sideband ports from primary mapping
     for p in sideband_ports:
@@ -194,7 +277,7 @@ def map_ports_to_bus(interface, bus_def, penalize_umap=True):
     # assign sideband signals to user groups if they are specified
     user_group_mapping, unmapped_ports = get_user_group_assignment(
         interface,
-        sideband_ports,
+        sorted_sideband_ports,
         bus_def,
     )
 
@@ -222,66 +305,307 @@ def _get_greedy_assignment(C):
     X[rmask] = True
     return X
 
-def _get_convex_opt_assignment(C):
-    m,n = C.shape
-    c = matrix(C.reshape(m*n))
-    x = variable(m*n)
-    constraints = [
-        x >= 0,
-        x <= 1,
-    ]
-    # row constraints
-    for i in range(m):
-        #print('setting constraint', i*n, i*n+n)
-        constraints.append(
-            cvx_sum(x[i*n:i*n+n]) == 1
-        )
-    # col constraints
-    # add constraints so max number of assignments to each port in ports2
-    # is 1 as well
-    for j in range(n):
-        #print(list(range(j, m*n, n)))
-        constraints.append(
-            cvx_sum([x[jj] for jj in range(j, m*n, n)]) <= 1
-        )
-
-    # NOTE must use external solver (such as glpk), the default one is
-    # _very_ slow
-    op(
-        dot(c, x),
-        constraints,
-    ).solve(solver='glpk')
-    X = np.array(x.value).reshape(m,n) > 0.01
-    return X
-
 #--------------------------------------------------------------------------
 # helpers for computing cost function
 #--------------------------------------------------------------------------
 def get_dup_words(ports):
     """
-    get port words that appear in *all* ports
+    get ids of port words that appear in *all* ports
     """
     ports = set(ports)
-    all_port_words = util.flatten([
-        list(set(util.words_from_name(p[0])))
-        for p in ports
-    ])
-    dup_words = set()
-    for w, cnt in Counter(all_port_words).most_common():
-        if cnt == len(ports):
-            dup_words.add(w)
-    return dup_words
+    word_cnts = Counter(
+        w for p in ports for w in _tokenize.word_ids(p[0])
+    )
+    return frozenset(w for w, cnt in word_cnts.items() if cnt == len(ports))
+
+def get_effective_words(interface, ports):
+    """
+    return the ids of the words of each of `ports` that are not shared by
+    all ports of `interface`, which is all that the name mismatch cost of a
+    port depends on
+    """
+    dup_words = get_dup_words(interface.ports)
+    return [_tokenize.word_ids(p[0]) - dup_words for p in ports]
+
+def _get_name_costs(p_words, bus_def):
+    cbd = bus_def.compiled
+    p_tokens = [_tokenize.ngram_ids(w) for w in p_words]
+    # name attr mismatch: jaccard distance of the n-grams of every pair from
+    # the intersection sizes given by a single sparse product
+    B = cbd.get_ngram_matrix()
+    hits = (util.get_incidence_matrix(p_tokens, cbd.ngram_cols) @ B.T).toarray()
+    p_num_ngrams = np.array([len(t) for t in p_tokens], dtype=np.float64)
+    b_num_ngrams = cbd.num_ngrams[:cbd.num_match]
+    return 1 - hits / (p_num_ngrams[:, None] + b_num_ngrams - hits)
+
+def _get_costs(p_words, p_widths, p_dirs, bus_def):
+    cbd = bus_def.compiled
+    cost_n = _get_name_costs(p_words, bus_def)
+
+    # width mismatch (either being None does *not* count as a match)
+    p_widths = np.array(
+        [np.nan if w is None else w for w in p_widths],
+        dtype=np.float64,
+    )
+    b_widths = cbd.widths[:cbd.num_match]
+    cost_w = (
+        (p_widths[:, None] != b_widths) &
+        ~np.isnan(p_widths)[:, None] &
+        ~np.isnan(b_widths)
+    )
+    # direction mismatch
+    p_dirs = np.array(p_dirs, dtype=np.int8)
+    cost_d = p_dirs[:, None] != cbd.dirs[:cbd.num_match]
+
+    return (
+        MatchCost.NAME_W*cost_n +
+        MatchCost.WIDTH_W*cost_w +
+        MatchCost.DIR_W*cost_d
+    )
+
+def get_name_cost_matrix(interface, ports, bus_def):
+    """
+    return the (ports x bus_def match ports) matrix of name mismatch costs,
+    as computed by `match_cost_func`
+    """
+    return _get_name_costs(get_effective_words(interface, ports), bus_def)
+
+def get_cost_matrix(interface, ports, bus_def, row_cache=None):
+    """
+    return the (ports x bus_def match ports) matrix of match cost values,
+    equal to `match_cost_func(p1, p2).value` for each pair but computed
+    from per-port features in bulk.  rows are reused from and added to
+    `row_cache` if specified
+    """
+    p_words = get_effective_words(interface, ports)
+    if row_cache is not None:
+        return row_cache.get_rows(p_words, ports, bus_def)
+    return _get_costs(
+        p_words,
+        [p[1] for p in ports],
+        [p[2] for p in ports],
+        bus_def,
+    )
+
+# rows of the cost matrix evaluated at once by `get_sparse_cost_matrix`
+SPARSE_CHUNK_SIZE = 256
+
+def get_sparse_cost_matrix(interface, ports, bus_def, k):
+    """
+    return the sparse (ports x bus_def match ports) matrix of the match
+    costs of the `k` cheapest bus def ports of each port and of the `k`
+    cheapest ports of each bus def port.  costs are evaluated a chunk of
+    rows at a time, so the dense matrix is never built
+    """
+    import scipy.sparse as sp
+    p_words = get_effective_words(interface, ports)
+    m, n = len(ports), bus_def.compiled.num_match
+    k_row, k_col = min(k, n), min(k, m)
+    rows, cols, vals = [], [], []
+    # k cheapest rows of each column so far
+    best_rows = np.zeros((0, n), dtype=np.int64)
+    best_vals = np.zeros((0, n))
+    for start in range(0, m, SPARSE_CHUNK_SIZE):
+        end = min(start+SPARSE_CHUNK_SIZE, m)
+        C = _get_costs(
+            p_words[start:end],
+            [p[1] for p in ports[start:end]],
+            [p[2] for p in ports[start:end]],
+            bus_def,
+        )
+        sel = np.argpartition(C, k_row-1, axis=1)[:, :k_row]
+        rows.append(np.repeat(np.arange(start, end), k_row))
+        cols.append(sel.reshape(-1))
+        vals.append(np.take_along_axis(C, sel, axis=1).reshape(-1))
+
+        best_vals = np.vstack([best_vals, C])
+        best_rows = np.vstack([
+            best_rows,
+            np.repeat(np.arange(start, end)[:, None], n, axis=1),
+        ])
+        if len(best_vals) > k_col:
+            sel = np.argpartition(best_vals, k_col-1, axis=0)[:k_col]
+            best_vals = np.take_along_axis(best_vals, sel, axis=0)
+            best_rows = np.take_along_axis(best_rows, sel, axis=0)
+    rows.append(best_rows.reshape(-1))
+    cols.append(np.tile(np.arange(n), len(best_rows)))
+    vals.append(best_vals.reshape(-1))
+
+    rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    # pairs that are candidates of both their row and column appear twice
+    _, first = np.unique(rows*n + cols, return_index=True)
+    return sp.csr_matrix(
+        (vals[first], (rows[first], cols[first])),
+        shape=(m, n),
+    )
+
+def get_direction_block_solver(solver=None):
+    """
+    wrap `solver` to solve the ports of each direction separately.  a
+    direction mismatch costs more than any name and width mismatch
+    together, so the entries of the cost matrix below DIR_W are exactly the
+    pairs of the same direction and the blocks are split by direction
+    """
+    assert MatchCost.NAME_W + MatchCost.WIDTH_W < MatchCost.DIR_W
+    return BlockSolver(solver, threshold=MatchCost.DIR_W)
+
+def get_sparse_solver(solver=None, k=8, min_ports=SPARSE_MIN_PORTS):
+    """
+    wrap `solver` to map interfaces with at least `min_ports` ports to map
+    over their `k` cheapest candidates only, see `solve_ports_to_bus_sparse`.
+    `solver` is returned as is if the installed scipy cannot solve sparse
+    assignment problems
+    """
+    if not has_sparse_assignment():
+        logging.warning('Warning, sparse mapping needs scipy >= 1.6, mapping all pairs instead')
+        return solver
+    return SparseSolver(solver, k=k, min_rows=min_ports)
+
+class CostRowCache(object):
+    """
+    cache of cost matrix rows of physical ports against bus defs, shared
+    across the nested interfaces of a BundleTree.  the row of a port only
+    depends on the interface through the words shared by all of its ports,
+    so rows are keyed by the remaining (effective) words of the port along
+    with its width and direction.  this lets ports of sibling and parent
+    interfaces share rows whenever their effective words agree
+    """
+    def __init__(self):
+        # <bus_def>: {<(effective words, width, direction)>: <row>}
+        self._rows = {}
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_rows(self, p_words, ports, bus_def):
+        """
+        return the cost matrix of `ports`, with effective words `p_words`,
+        against `bus_def`
+        """
+        rows = self._rows.setdefault(bus_def, {})
+        keys = [(w, p[1], p[2]) for w, p in zip(p_words, ports)]
+        # compute all missing rows in a single batch
+        missing = list(dict.fromkeys([k for k in keys if k not in rows]))
+        if len(missing) > 0:
+            C = _get_costs(
+                [k[0] for k in missing],
+                [k[1] for k in missing],
+                [k[2] for k in missing],
+                bus_def,
+            )
+            rows.update(zip(missing, C))
+        self.num_misses += len(missing)
+        self.num_hits += len(keys) - len(missing)
+        return np.array([rows[k] for k in keys])
+
+class WarmStartCache(object):
+    """
+    cache of the primary mappings of already solved interfaces, used to seed
+    the solve of an interface containing them with a partial assignment.
+    the cost matrix rows of shared ports differ between nested interfaces,
+    so the solver still has to verify the seed before repairing it
+    """
+    def __init__(self):
+        # <bus_def>: [<(ports, mapping)>]
+        self._mappings = {}
+        self.num_seeded = 0
+
+    def get_init(self, ports, bus_def):
+        """
+        return the mapping of the largest solved interface against `bus_def`
+        with all of its ports in `ports`, or an empty mapping
+        """
+        ports = frozenset(ports)
+        init = {}
+        for i_ports, mapping in self._mappings.get(bus_def, []):
+            if len(mapping) > len(init) and i_ports <= ports:
+                init = mapping
+        if len(init) > 0:
+            self.num_seeded += 1
+        return init
+
+    def add(self, ports, bus_def, mapping):
+        self._mappings.setdefault(bus_def, []).append(
+            (frozenset(ports), dict(mapping))
+        )
+
+class MappingClassCache(object):
+    """
+    cache of primary mappings shared by the isomorphic interfaces of an
+    equivalence class, such as replicated instances of the same bus.  such
+    interfaces have the same cost matrix against a bus def, so the solve
+    of one is remapped onto the others by the order of their port names.
+    only the designation of sideband ports depends on the full port names
+    and is still done for every interface.
+
+    if `store` is specified with a MappingStore, mappings are also kept on
+    disk keyed by the interface signature, the bus def digest, the seed,
+    the `solver` and the cost model version, so they are reused by later
+    runs
+    """
+    def __init__(self, store=None, solver=None):
+        # <(signature, bus_def, seed)>: <((port index, bus port), ...)>
+        self._mappings = {}
+        self.store = store
+        self.solver_name = get_solver_name(solver)
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def _get_key(self, interface, bus_def, init):
+        idx = {
+            p : i for i, p in enumerate(sorted(
+                interface.get_ports_to_map(),
+                key=lambda p: p[0],
+            ))
+        }
+        seed = tuple((idx[pp], bp) for pp, bp in init.items()) if init else None
+        return (interface.signature, bus_def, seed), idx
+
+    def _get_store_key(self, key):
+        signature, bus_def, seed = key
+        return MappingStore.get_key(
+            COST_MODEL_VERSION,
+            self.solver_name,
+            bus_def.compiled.digest,
+            signature,
+            seed,
+        )
+
+    def get_mapping(self, interface, bus_def, init=None):
+        """
+        return the primary mapping of `interface` against `bus_def` remapped
+        from that of an isomorphic interface, seeded the same way with
+        `init`, or None
+        """
+        key, idx = self._get_key(interface, bus_def, init)
+        if key not in self._mappings and self.store is not None:
+            value = self.store.get(self._get_store_key(key))
+            if value is not None:
+                self._mappings[key] = tuple((i, tuple(bp)) for i, bp in value)
+        if key not in self._mappings:
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        ports = list(idx)
+        return {ports[i] : bp for i, bp in self._mappings[key]}
+
+    def add_mapping(self, interface, bus_def, init, mapping):
+        key, idx = self._get_key(interface, bus_def, init)
+        self._mappings[key] = tuple((idx[pp], bp) for pp, bp in mapping.items())
+        if self.store is not None:
+            self.store.put(self._get_store_key(key), self._mappings[key])
 
 def get_cost_funcs(interface, bus_def):
     """
     determine cost functions in a closure with access to bus_def
     """
     dup_words = get_dup_words(interface.ports)
+    cbd = bus_def.compiled
     def match_cost_func(phy_port, bus_port):
 
-        p_words = set(util.words_from_name(phy_port[0])) - dup_words
-        b_words = bus_def.words_from_name(bus_port[0])
-        cost_n = util.get_jaccard_dist(p_words, b_words)
+        p_words = _tokenize.word_ids(phy_port[0]) - dup_words
+        p_tokens = _tokenize.ngram_ids(p_words)
+        b_tokens = cbd.ngrams[cbd.index[bus_port]]
+        cost_n = 1 - len(p_tokens & b_tokens) / len(p_tokens | b_tokens)
 
         return MatchCost(
             # name attr mismatch
@@ -302,7 +626,7 @@ def get_cost_funcs(interface, bus_def):
         if penalize_umap:
             cost += MatchCost(0,1,1)*len(bm.sbm)
         # penalize only width+direction for unmapped bus ports
-        umap_busports = set(bm.bus_def.req_ports) - set(bm.mapping.values())
+        umap_busports = cbd.req_set - set(bm.mapping.values())
         cost += MatchCost(0,1,1)*len(umap_busports)
         return cost
 
@@ -317,17 +641,16 @@ def get_sideband_ports(mapping, ports, bus_def, match_cost_func):
     # designate phy ports as sideband based on the number of tokens from
     # the bus_def port that are missing from the tokens in the mapped phy
     # port
-    num_missing_tokens = [
-        util.get_num_missing_tokens(bp[0], pp[0])
+    cbd = bus_def.compiled
+    num_missing_tokens = {
+        pp : len(cbd.name_ngrams[cbd.index[bp]] - _tokenize.name_ngram_ids(pp[0]))
         for pp, bp in mapping.items()
-    ]
+    }
     # label mappings as sideband if they are missing more than 1 token
     # than the median mapping
-    cutoff = np.median(num_missing_tokens) + 1
+    cutoff = np.median(list(num_missing_tokens.values())) + 1
     sideband_mapping = dict(filter(
-        lambda x: (
-            util.get_num_missing_tokens(x[1][0], x[0][0]) > cutoff
-        ),
+        lambda x: num_missing_tokens[x[0]] > cutoff,
         mapping.items(),
     ))
     sideband_ports = set(sideband_mapping.keys())
@@ -345,14 +668,14 @@ def get_user_group_assignment(interface, ports, bus_def):
     # strip shared prefix between ports for determing user group
     # assignment
     sprefix = interface.prefix
-    bd_user_port_groups = bus_def.user_port_groups
+    bd_user_port_groups = bus_def.compiled.user_port_groups
     if len(bd_user_port_groups) == 0:
         return {}, ports
 
     def get_user_group_port(port):
         # return the port of the user group with the prefix match nearest
         # to the root of the given port name
-        for w in util.words_from_name(port[0][len(sprefix):]):
+        for w in _tokenize.words_from_name(port[0][len(sprefix):]):
             for prefix, uport in bd_user_port_groups:
                 # prefix *and* direction must match to be assigned to a group
                 if w.startswith(prefix) and port[2] == uport[2]:
@@ -0,0 +1,201 @@
+import os
+import io
+import json
+import logging
+import traceback
+import socketserver
+from argparse import Namespace
+from ._buslib import (
+    BusLibCache,
+    load_bus_defs,
+)
+from ._fcost import BusDefIndex
+from ._mapcache import MappingStore
+from ._assign import CachedSolver
+from . import main_portinf
+from . import _tokenize
+from . import _cli
+
+# minimum number of seconds between two walks of the on-disk caches to
+# evict their least recently used entries
+PRUNE_INTERVAL = 60
+
+# words and n-grams interned by the server before it forgets them, along
+# with the bus defs and indexes holding their ids, between two requests
+MAX_INTERNED = 1 << 20
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            assert isinstance(request, dict), 'request is not a json object'
+            response = self.server.serve_request(request)
+        except Exception as e:
+            # malformed requests still get a response the client can report
+            response = get_error_response('{}: {}'.format(type(e).__name__, e))
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+def get_error_response(error):
+    return {'status' : 1, 'log' : '', 'output' : None, 'error' : error}
+
+class PortinfServer(socketserver.UnixStreamServer):
+    """
+    duh-portinf server listening on a Unix socket.  parsed bus libraries,
+    bus def indexes, assignment solutions and mapping stores are kept in
+    memory across requests, and each request only reparses the bus spec
+    files that changed on disk since the last one.  requests are handled
+    one at a time.
+
+    a request is a json object with the `command` 'infer', along with
+    `args`, the arguments of `duh-portinf` as returned by
+    `_cli.get_abs_args`, or 'stop'.  the response holds the exit `status`,
+    the `log` of the request and its `output` if no output path was given,
+    along with an `error` message if the request could not be served at all
+    """
+    def __init__(self, socket_path):
+        super().__init__(socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self.num_requests = 0
+        self._stopped = False
+        # duh-bus root located by duh-bus-which for requests without -b
+        self._duh_bus_path = None
+        # <(duh-bus root, cache dir)>: <BusLibCache>
+        self._libs = {}
+        # <(duh-bus root, cache dir)>: (<bus defs>, <BusDefIndex>)
+        self._indexes = {}
+        # <(solver, decompose, sparse k, solve cache dir, max size)>:
+        #   <CachedSolver>
+        self._solvers = {}
+        # <(mapping store dir, max size)>: <MappingStore>
+        self._stores = {}
+
+    def serve(self):
+        try:
+            while not self._stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def get_bus_defs(self, args):
+        """
+        return the bus defs under the duh-bus root of `args` along with a
+        BusDefIndex over them
+        """
+        if args.duh_bus is None:
+            if self._duh_bus_path is None:
+                self._duh_bus_path = main_portinf.get_duh_bus_path()
+            rootdir = self._duh_bus_path
+        else:
+            rootdir = main_portinf.get_duh_bus_path(args.duh_bus)
+        cache_dir = _cli.get_cache_dir(args)
+        key = (os.path.abspath(rootdir), cache_dir)
+        if key not in self._libs:
+            self._libs[key] = BusLibCache.load(
+                None if cache_dir is None else
+                BusLibCache.get_cache_path(cache_dir, rootdir)
+            )
+        bus_defs = load_bus_defs(
+            rootdir,
+            jobs=args.jobs,
+            cache=self._libs[key],
+        )
+        # the bus defs of unchanged specs are the very same objects, which
+        # are kept alive by the index entry, so their ids are never reused
+        prev = self._indexes.get(key)
+        if prev is None or list(map(id, prev[0])) != list(map(id, bus_defs)):
+            self._indexes[key] = (bus_defs, BusDefIndex(bus_defs))
+        return self._indexes[key]
+
+    def get_solver(self, args):
+        cache_dir = _cli.get_cache_dir(args)
+        solve_cache_dir = os.path.join(cache_dir, 'solves') \
+            if args.solve_cache and cache_dir is not None else None
+        key = (
+            args.solver,
+            args.decompose,
+            args.sparse_k,
+            solve_cache_dir,
+            args.cache_size << 20,
+        )
+        if key not in self._solvers:
+            self._solvers[key] = CachedSolver(
+                main_portinf.get_args_solver(args),
+                cache_dir=solve_cache_dir,
+                max_disk_size=args.cache_size << 20,
+                prune_interval=PRUNE_INTERVAL,
+            )
+        return self._solvers[key]
+
+    def get_mapping_store(self, args):
+        cache_dir = _cli.get_cache_dir(args)
+        if cache_dir is None:
+            return None
+        key = (os.path.join(cache_dir, 'mappings'), args.cache_size << 20)
+        if key not in self._stores:
+            self._stores[key] = MappingStore(*key, prune_interval=PRUNE_INTERVAL)
+        return self._stores[key]
+
+    def infer(self, args):
+        """
+        run `duh-portinf` for the parsed arguments `args` and return the
+        output if `args.output` is None
+        """
+        output = io.StringIO() if args.output is None else None
+        if output is not None:
+            args.output = output
+        bus_defs, bus_index = self.get_bus_defs(args)
+        main_portinf.infer_component(
+            args,
+            bus_defs,
+            bus_index=bus_index,
+            solver=self.get_solver(args),
+            mapping_store=self.get_mapping_store(args),
+        )
+        return None if output is None else output.getvalue()
+
+    def serve_request(self, request):
+        command = request.get('command', 'infer')
+        if command == 'stop':
+            self._stopped = True
+            return {'status' : 0, 'log' : '', 'output' : None, 'error' : None}
+        if command != 'infer':
+            return get_error_response('unknown command {}'.format(command))
+        if not isinstance(request.get('args'), dict):
+            return get_error_response('infer request without args')
+
+        self.num_requests += 1
+        log = io.StringIO()
+        handler = logging.StreamHandler(log)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logging.getLogger().addHandler(handler)
+        status = 0
+        output = None
+        try:
+            output = self.infer(Namespace(**request['args']))
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            logging.error(traceback.format_exc())
+            status = 1
+        finally:
+            logging.getLogger().removeHandler(handler)
+        if _tokenize.get_num_interned() > MAX_INTERNED:
+            self.reset_tokens()
+        return {
+            'status' : status,
+            'log' : log.getvalue(),
+            'output' : output,
+            'error' : None,
+        }
+
+    def reset_tokens(self):
+        """
+        forget the interned words and n-grams.  the bus defs and indexes
+        hold their ids, so they are dropped as well and reloaded by the
+        next request
+        """
+        _tokenize.reset()
+        self._libs = {}
+        self._indexes = {}
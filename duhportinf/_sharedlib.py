@@ -0,0 +1,388 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import time
+import numpy as np
+from collections import Counter
+from .busdef import BusDef, CompiledBusDef, dotdict
+from . import util
+from . import _tokenize
+
+# bump whenever the layout of the arrays or metadata changes so that stale
+# libraries are never attached
+FORMAT_VERSION = 1
+
+# libraries of earlier contents of a bus root are removed once unused for
+# this many seconds, long after every run that could still attach them
+SHARED_LIB_MAX_AGE = 24*3600
+
+# port roles as stored in the `roles` array
+ROLE_REQ, ROLE_OPT, ROLE_USER = 0, 1, 2
+
+#--------------------------------------------------------------------------
+# shared bus library
+#
+# a directory of flat arrays over the ports of all bus defs, laid out one
+# bus def after the other as in `CompiledBusDef`, which is memory-mapped
+# read-only by every process that attaches it:
+#
+#   bd_ptr                 ports of bus def i are bd_ptr[i]:bd_ptr[i+1]
+#   widths                 width of each port, nan if parameterized
+#   dirs                   direction of each port
+#   roles                  ROLE_REQ, ROLE_OPT or ROLE_USER
+#   {word,ngram,name_ngram}_{ptr,ids}
+#                          interned token ids of each port, in csr form
+#
+# along with `meta.json` (port names, user groups and the bus type,
+# abstract type, driver type and digest of each bus def) and `vocab.json`
+# (the interned words and n-grams the ids refer to)
+#--------------------------------------------------------------------------
+_ARRAYS = [
+    'bd_ptr', 'widths', 'dirs', 'roles',
+    'word_ptr', 'word_ids',
+    'ngram_ptr', 'ngram_ids',
+    'name_ngram_ptr', 'name_ngram_ids',
+]
+
+def get_lib_key(bus_defs):
+    """
+    digest of the contents of `bus_defs`, in order
+    """
+    h = hashlib.sha1('{}'.format(FORMAT_VERSION).encode('utf-8'))
+    for bd in bus_defs:
+        h.update(bd.compiled.digest.encode('utf-8'))
+    return h.hexdigest()
+
+def _get_csr(id_sets):
+    ptr = np.zeros(len(id_sets)+1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(ids) for ids in id_sets])
+    ids = np.array(
+        util.flatten([sorted(ids) for ids in id_sets]),
+        dtype=np.int32,
+    )
+    return ptr, ids
+
+def write_shared_lib(path, bus_defs):
+    """
+    write `bus_defs` as a shared bus library to the directory `path`.  the
+    library is written to a temporary directory first and then moved into
+    place, so processes never attach a partial library
+    """
+    cbds = [bd.compiled for bd in bus_defs]
+    ports = util.flatten([list(cbd.ports) for cbd in cbds])
+    arrays = {
+        'bd_ptr' : np.cumsum([0] + [len(cbd.ports) for cbd in cbds]).astype(np.int64),
+        'widths' : np.concatenate([cbd.widths for cbd in cbds] + [np.zeros(0)]),
+        'dirs'   : np.concatenate([cbd.dirs for cbd in cbds] + [np.zeros(0, dtype=np.int8)]),
+        'roles'  : np.concatenate([
+            np.where(cbd.req_mask, ROLE_REQ, np.where(cbd.opt_mask, ROLE_OPT, ROLE_USER))
+            for cbd in cbds
+        ] + [np.zeros(0)]).astype(np.int8),
+    }
+    for key, attr in [
+        ('word', 'words'),
+        ('ngram', 'ngrams'),
+        ('name_ngram', 'name_ngrams'),
+    ]:
+        arrays[key+'_ptr'], arrays[key+'_ids'] = _get_csr(
+            util.flatten([list(getattr(cbd, attr)) for cbd in cbds])
+        )
+    meta = {
+        'version' : FORMAT_VERSION,
+        'names' : [p[0] for p in ports],
+        'bus_defs' : [
+            {
+                'bus_type' : bd.bus_type,
+                'abstract_type' : bd.abstract_type,
+                'driver_type' : bd.driver_type,
+                'user_groups' : [prefix for prefix, _ in cbd.user_port_groups],
+                'digest' : cbd.digest,
+            }
+            for bd, cbd in zip(bus_defs, cbds)
+        ],
+    }
+    # the vocab is taken after compiling, so it covers every id above
+    words, ngrams = _tokenize.get_vocab()
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        for key in _ARRAYS:
+            np.save(os.path.join(tmp_path, key + '.npy'), arrays[key])
+        with open(os.path.join(tmp_path, 'vocab.json'), 'w') as fout:
+            json.dump({'words' : words, 'ngrams' : ngrams}, fout)
+        # written last, a library is only complete once it has its meta
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as fout:
+            json.dump(meta, fout, default=util.json_default)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # written by a concurrent run in the meantime
+            if not os.path.isfile(os.path.join(path, 'meta.json')):
+                raise
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+
+# <abs path>: <SharedBusLib> attached by this process
+_attached = {}
+
+def attach(path):
+    """
+    attach the shared bus library at `path`, at most once per process
+    """
+    path = os.path.abspath(path)
+    if path not in _attached:
+        _attached[path] = SharedBusLib(path)
+    return _attached[path]
+
+def _attach_bus_def(path, i):
+    return attach(path).bus_defs[i]
+
+class SharedBusLib(object):
+    """
+    read-only view of a shared bus library written by `write_shared_lib`.
+    the arrays are memory-mapped, so the pages are shared by every process
+    attaching the same library
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as fin:
+            meta = json.load(fin)
+        assert meta['version'] == FORMAT_VERSION, \
+            'shared bus library {} has an unsupported format'.format(path)
+        self.names = meta['names']
+        self.meta = meta['bus_defs']
+        for key in _ARRAYS:
+            setattr(self, key, np.load(os.path.join(path, key + '.npy'), mmap_mode='r'))
+
+        with open(os.path.join(path, 'vocab.json')) as fin:
+            vocab = json.load(fin)
+        # token ids of the library are the ids of this process if nothing
+        # conflicting was interned before, otherwise they are translated
+        self._word_map = None
+        self._ngram_map = None
+        if not _tokenize.preload(vocab['words'], vocab['ngrams']):
+            self._word_map = np.array(
+                [_tokenize.intern_word(w) for w in vocab['words']],
+                dtype=np.int64,
+            )
+            self._ngram_map = np.array(
+                [_tokenize.intern_ngram(t) for t in vocab['ngrams']],
+                dtype=np.int64,
+            )
+        self.bus_defs = [SharedBusDef(self, i) for i in range(len(self.meta))]
+
+    def get_token_ids(self, key, j):
+        """
+        token ids of `key` ('word', 'ngram' or 'name_ngram') of port `j`
+        """
+        ptr = getattr(self, key + '_ptr')
+        ids = getattr(self, key + '_ids')[ptr[j]:ptr[j+1]]
+        tmap = self._word_map if key == 'word' else self._ngram_map
+        if tmap is not None:
+            ids = tmap[ids]
+        return frozenset(ids.tolist())
+
+class SharedCompiledBusDef(CompiledBusDef):
+    """
+    CompiledBusDef over a bus def of a SharedBusLib.  the numeric arrays
+    are views into the shared library and everything else is only built
+    when first used, as most bus defs never reach the mapping stage
+    """
+    def __init__(self, lib, i):
+        self._lib = lib
+        self._start = int(lib.bd_ptr[i])
+        self._end = int(lib.bd_ptr[i+1])
+        self._meta = lib.meta[i]
+        roles = lib.roles[self._start:self._end]
+        self.widths    = lib.widths[self._start:self._end]
+        self.dirs      = lib.dirs[self._start:self._end]
+        self.req_mask  = roles == ROLE_REQ
+        self.opt_mask  = roles == ROLE_OPT
+        self.user_mask = roles == ROLE_USER
+        self.num_match = int(np.sum(roles != ROLE_USER))
+        self.ngram_cols = None
+        self._ngram_matrix = None
+        self.digest = self._meta['digest']
+        # everything else is built on first use
+        self._ports = None
+        self._names = None
+        self._index = None
+        self._req_set = None
+        self._opt_set = None
+        self._user_port_groups = None
+        self._words = None
+        self._ngrams = None
+        self._name_ngrams = None
+        self._all_words = None
+        self._all_ngrams = None
+        self._num_ngrams = None
+        self._req_wd_counts = None
+        self._opt_wd_counts = None
+
+    @property
+    def ports(self):
+        if self._ports is None:
+            self._ports = tuple(
+                (
+                    self._lib.names[j],
+                    None if np.isnan(self._lib.widths[j]) else int(self._lib.widths[j]),
+                    np.sign(int(self._lib.dirs[j])),
+                )
+                for j in range(self._start, self._end)
+            )
+        return self._ports
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = tuple(p[0] for p in self.ports)
+        return self._names
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {p: i for i, p in reversed(list(enumerate(self.ports)))}
+        return self._index
+    @property
+    def req_set(self):
+        if self._req_set is None:
+            self._req_set = frozenset(p for p, m in zip(self.ports, self.req_mask) if m)
+        return self._req_set
+    @property
+    def opt_set(self):
+        if self._opt_set is None:
+            self._opt_set = frozenset(p for p, m in zip(self.ports, self.opt_mask) if m)
+        return self._opt_set
+    @property
+    def user_port_groups(self):
+        if self._user_port_groups is None:
+            self._user_port_groups = tuple(zip(
+                self._meta['user_groups'],
+                self.ports[self.num_match:],
+            ))
+        return self._user_port_groups
+    @property
+    def words(self):
+        if self._words is None:
+            self._words = self._get_token_ids('word')
+        return self._words
+    @property
+    def ngrams(self):
+        if self._ngrams is None:
+            self._ngrams = self._get_token_ids('ngram')
+        return self._ngrams
+    @property
+    def name_ngrams(self):
+        if self._name_ngrams is None:
+            self._name_ngrams = self._get_token_ids('name_ngram')
+        return self._name_ngrams
+    @property
+    def all_words(self):
+        if self._all_words is None:
+            self._all_words = frozenset().union(*self.words[:self.num_match])
+        return self._all_words
+    @property
+    def all_ngrams(self):
+        if self._all_ngrams is None:
+            self._all_ngrams = frozenset().union(*self.ngrams[:self.num_match])
+        return self._all_ngrams
+    @property
+    def num_ngrams(self):
+        if self._num_ngrams is None:
+            ptr = self._lib.ngram_ptr[self._start:self._end+1]
+            self._num_ngrams = np.diff(ptr).astype(np.float64)
+        return self._num_ngrams
+    @property
+    def req_wd_counts(self):
+        if self._req_wd_counts is None:
+            self._req_wd_counts = Counter(p[1:] for p, m in zip(self.ports, self.req_mask) if m)
+        return self._req_wd_counts
+    @property
+    def opt_wd_counts(self):
+        if self._opt_wd_counts is None:
+            self._opt_wd_counts = Counter(p[1:] for p, m in zip(self.ports, self.opt_mask) if m)
+        return self._opt_wd_counts
+
+    def _get_token_ids(self, key):
+        return tuple(
+            self._lib.get_token_ids(key, j) for j in range(self._start, self._end)
+        )
+
+class SharedBusDef(BusDef):
+    """
+    BusDef backed by a SharedBusLib, which is pickled as a handle to the
+    library rather than by value
+    """
+    def __init__(self, lib, i):
+        meta = lib.meta[i]
+        self.bus_type      = dotdict(meta['bus_type'])
+        self.abstract_type = dotdict(meta['abstract_type'])
+        self.driver_type   = meta['driver_type']
+        self.compiled      = SharedCompiledBusDef(lib, i)
+        self._lib = lib
+        self._idx = i
+        # port lists are built on first use
+        self._req_ports_list = None
+        self._opt_ports_list = None
+        self._user_port_groups_list = None
+
+    @property
+    def _req_ports(self):
+        if self._req_ports_list is None:
+            cbd = self.compiled
+            self._req_ports_list = [p for p, m in zip(cbd.ports, cbd.req_mask) if m]
+        return self._req_ports_list
+    @property
+    def _opt_ports(self):
+        if self._opt_ports_list is None:
+            cbd = self.compiled
+            self._opt_ports_list = [p for p, m in zip(cbd.ports, cbd.opt_mask) if m]
+        return self._opt_ports_list
+    @property
+    def _user_port_groups(self):
+        if self._user_port_groups_list is None:
+            self._user_port_groups_list = list(self.compiled.user_port_groups)
+        return self._user_port_groups_list
+
+    def __reduce__(self):
+        return (_attach_bus_def, (self._lib.path, self._idx))
+
+def get_shared_bus_defs(bus_defs, cache_dir, rootdir, max_age=SHARED_LIB_MAX_AGE):
+    """
+    return `bus_defs` backed by a shared bus library in `cache_dir`,
+    writing the library first unless an identical one is already there.
+    libraries of earlier contents of `rootdir` are removed once unused for
+    `max_age` seconds
+    """
+    rkey = hashlib.sha1(os.path.abspath(rootdir).encode('utf-8')).hexdigest()[:16]
+    name = 'buslib-{}-{}.shared'.format(rkey, get_lib_key(bus_defs)[:16])
+    path = os.path.join(cache_dir, name)
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        logging.info('  - writing shared bus library {}'.format(path))
+        write_shared_lib(path, bus_defs)
+    # the mtime of the meta marks the last run using the library, so that
+    # concurrent runs, and their workers yet to attach it, keep it around
+    try:
+        os.utime(meta_path)
+    except OSError:
+        pass
+    now = time.time()
+    for fname in os.listdir(cache_dir):
+        if not (
+            fname.startswith('buslib-{}-'.format(rkey)) and
+            fname.endswith('.shared') and
+            fname != name
+        ):
+            continue
+        try:
+            mtime = os.stat(os.path.join(cache_dir, fname, 'meta.json')).st_mtime
+        except OSError:
+            continue
+        if now - mtime > max_age:
+            shutil.rmtree(os.path.join(cache_dir, fname), ignore_errors=True)
+    return attach(path).bus_defs
@@ -0,0 +1,128 @@
+import re
+from functools import lru_cache
+
+# number of distinct names (or word sets) remembered by each memoized lookup
+CACHE_SIZE = 1 << 16
+
+_camel_re      = re.compile('(.)([A-Z][a-z]+)(.)')
+_lower_upper_re = re.compile('([a-z0-9])([A-Z])')
+_alpha_num_re  = re.compile('([a-zA-Z])([0-9]+)')
+
+# words and n-grams are interned to small integers so that the name
+# comparisons on the matching hot paths are integer set operations.  ids are
+# only meaningful within the process that interned them
+_word_ids = {}
+_words = []
+_ngram_ids = {}
+_ngrams = []
+
+def _intern(ids, vals, val):
+    i = ids.get(val)
+    if i is None:
+        i = ids[val] = len(vals)
+        vals.append(val)
+    return i
+
+def get_vocab():
+    """
+    snapshot of the interned words and n-grams, in order of id
+    """
+    return list(_words), list(_ngrams)
+
+def preload(words, ngrams):
+    """
+    intern `words` and `ngrams` in order, so that their ids are their
+    positions in the lists, and return True.  this is only possible if
+    everything interned so far is a prefix of them, otherwise nothing is
+    interned and False is returned
+    """
+    if _words != words[:len(_words)] or _ngrams != ngrams[:len(_ngrams)]:
+        return False
+    for w in words[len(_words):]:
+        _intern(_word_ids, _words, w)
+    for t in ngrams[len(_ngrams):]:
+        _intern(_ngram_ids, _ngrams, t)
+    return True
+
+def get_num_interned():
+    """
+    number of words and n-grams interned so far
+    """
+    return len(_words) + len(_ngrams)
+
+def reset():
+    """
+    forget every interned word and n-gram along with the memoized lookups.
+    ids handed out before are no longer valid, so everything holding them,
+    such as compiled bus defs, must be dropped as well
+    """
+    _word_ids.clear()
+    del _words[:]
+    _ngram_ids.clear()
+    del _ngrams[:]
+    for func in [words_from_name, word_ids, _word_ngram_ids, ngram_ids, name_ngram_ids]:
+        func.cache_clear()
+
+def intern_word(word):
+    return _intern(_word_ids, _words, word)
+
+def intern_ngram(ngram):
+    return _intern(_ngram_ids, _ngrams, ngram)
+
+def get_word(word_id):
+    return _words[word_id]
+
+def get_ngram(ngram_id):
+    return _ngrams[ngram_id]
+
+@lru_cache(maxsize=CACHE_SIZE)
+def words_from_name(name):
+    """
+    split a port name into lowercase words on '_', camelcase and
+    name/number boundaries
+    """
+    # convert camelcase to '_'
+    name = _camel_re.sub(r'\1_\2\3', name)
+    # always return lower case so case insensitive
+    name = _lower_upper_re.sub(r'\1_\2', name).lower()
+    # insert '_' in between names and numbers
+    name = _alpha_num_re.sub(r'\1_\2', name).lower()
+    return tuple(name.split('_'))
+
+def ngrams(s):
+    """all characters, pairs and triples within a string"""
+    s = s.replace('_', '').lower()
+    tokens = [c for c in s]
+    tokens.extend([''.join(cs) for cs in zip(s, s[1:])])
+    tokens.extend([''.join(cs) for cs in zip(s, s[1:], s[2:])])
+    return tokens
+
+@lru_cache(maxsize=CACHE_SIZE)
+def word_ids(name):
+    """
+    interned ids of the words of `name`
+    """
+    return frozenset(
+        _intern(_word_ids, _words, w) for w in words_from_name(name)
+    )
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _word_ngram_ids(word_id):
+    return frozenset(
+        _intern(_ngram_ids, _ngrams, t) for t in ngrams(_words[word_id])
+    )
+
+@lru_cache(maxsize=CACHE_SIZE)
+def ngram_ids(word_ids):
+    """
+    interned ids of the n-grams of each word in the frozenset `word_ids`
+    """
+    return frozenset().union(*[_word_ngram_ids(w) for w in word_ids])
+
+@lru_cache(maxsize=CACHE_SIZE)
+def name_ngram_ids(name):
+    """
+    interned ids of the n-grams of the whole of `name`, including those
+    spanning word boundaries
+    """
+    return frozenset(_intern(_ngram_ids, _ngrams, t) for t in ngrams(name))
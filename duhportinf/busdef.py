@@ -1,10 +1,14 @@
+import sys
+import hashlib
 import numpy as np
+import json
 import json5
 import logging
-from collections import defaultdict
+from collections import defaultdict, Counter
 from itertools import combinations
 from ._optimize import MatchCost
 from . import util
+from . import _tokenize
 
 class dotdict(dict):
     """
@@ -15,19 +19,155 @@ class dotdict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+class CompiledBusDef(object):
+    """
+    flat, read-only form of a BusDef that is built once at load time and read
+    directly by the matching code.  ports are laid out as required, optional
+    then user group ports; only the first `num_match` (required+optional)
+    are candidates in a bus mapping.
+    """
+    __slots__ = (
+        'ports',
+        'names',
+        'widths',
+        'dirs',
+        'req_mask',
+        'opt_mask',
+        'user_mask',
+        'num_match',
+        'index',
+        'req_set',
+        'opt_set',
+        'user_port_groups',
+        'words',
+        'ngrams',
+        'name_ngrams',
+        'all_words',
+        'all_ngrams',
+        'num_ngrams',
+        'ngram_cols',
+        '_ngram_matrix',
+        'req_wd_counts',
+        'opt_wd_counts',
+        'digest',
+    )
+
+    def __init__(self, bus_def):
+        req_ports = [_intern_port(p) for p in bus_def._req_ports]
+        opt_ports = [_intern_port(p) for p in bus_def._opt_ports]
+        user_port_groups = tuple(
+            (prefix, _intern_port(p)) for prefix, p in bus_def._user_port_groups
+        )
+        user_ports = [p for _, p in user_port_groups]
+        ports = tuple(req_ports + opt_ports + user_ports)
+        nr, no = len(req_ports), len(opt_ports)
+
+        self.ports     = ports
+        self.names     = tuple(p[0] for p in ports)
+        # None widths (parameterized in the spec) are encoded as nan
+        self.widths    = np.array(
+            [np.nan if p[1] is None else p[1] for p in ports],
+            dtype=np.float64,
+        )
+        self.dirs      = np.array([p[2] for p in ports], dtype=np.int8)
+        self.req_mask  = np.arange(len(ports)) < nr
+        self.opt_mask  = (np.arange(len(ports)) >= nr) & (np.arange(len(ports)) < nr+no)
+        self.user_mask = np.arange(len(ports)) >= nr+no
+        self.num_match = nr+no
+        self.index     = {p: i for i, p in reversed(list(enumerate(ports)))}
+        self.req_set   = frozenset(req_ports)
+        self.opt_set   = frozenset(opt_ports)
+        self.user_port_groups = user_port_groups
+
+        # words and n-grams are held as interned token ids
+        self.words = tuple(_tokenize.word_ids(p[0]) for p in ports)
+        self.ngrams = tuple(_tokenize.ngram_ids(w) for w in self.words)
+        self.name_ngrams = tuple(
+            _tokenize.name_ngram_ids(p[0]) for p in ports
+        )
+        self.all_words  = frozenset().union(*self.words[:nr+no])
+        self.all_ngrams = frozenset().union(*self.ngrams[:nr+no])
+        self.num_ngrams = np.array([len(t) for t in self.ngrams], dtype=np.float64)
+        # built on first use, as most bus defs never reach the mapping stage
+        self.ngram_cols = None
+        self._ngram_matrix = None
+        self.req_wd_counts = Counter(p[1:] for p in req_ports)
+        self.opt_wd_counts = Counter(p[1:] for p in opt_ports)
+        # content hash identifying the bus def across runs
+        self.digest = hashlib.sha1(json.dumps([
+            bus_def.bus_type,
+            bus_def.abstract_type,
+            bus_def.driver_type,
+            req_ports,
+            opt_ports,
+            user_port_groups,
+        ], sort_keys=True, default=util.json_default).encode('utf-8')).hexdigest()
+
+    @property
+    def match_ports(self):
+        return self.ports[:self.num_match]
+
+    def get_ngram_matrix(self):
+        """
+        sparse (match ports x n-grams) incidence matrix of the n-grams of
+        each match port, with columns given by `ngram_cols`
+        """
+        if self._ngram_matrix is None:
+            self.ngram_cols = {}
+            self._ngram_matrix = util.get_incidence_matrix(
+                self.ngrams[:self.num_match],
+                self.ngram_cols,
+                add_tokens=True,
+            )
+        return self._ngram_matrix
+
+def _intern_port(port):
+    # intern port names so that the many port tuples built while matching
+    # share a single string per name
+    name, width, direction = port
+    return (sys.intern(name), width, direction)
+
 class BusDef(object):
 
     @classmethod
-    def is_spec_bus_def(cls, spec_path):
+    def load_spec(cls, spec_path):
+        """
+        parse `spec_path` once and return the spec object if it describes a
+        bus abstractionDefinition, otherwise None
+        """
         if not spec_path.endswith('json5'):
-            return False
+            return None
         try:
             with open(spec_path) as fin:
-                spec = json5.load(fin)
-        except:
-            logging.warn('Warning, could not load {} with json5 parser'.format(spec_path))
-            return False
-        return 'abstractionDefinition' in spec
+                s = fin.read()
+        except (OSError, UnicodeDecodeError):
+            logging.warning('Warning, could not read {}'.format(spec_path))
+            return None
+        # cheaply sniff the raw text so that unrelated json5 files are
+        # never parsed at all
+        if 'abstractionDefinition' not in s:
+            return None
+        try:
+            spec = cls._loads(s)
+        except Exception:
+            logging.warning('Warning, could not load {} with json5 parser'.format(spec_path))
+            return None
+        if not isinstance(spec, dict) or 'abstractionDefinition' not in spec:
+            return None
+        return spec
+
+    @classmethod
+    def _loads(cls, s):
+        # most specs are plain json, which the C json parser handles far
+        # faster than the pure python json5 parser
+        try:
+            return json.loads(s)
+        except ValueError:
+            return json5.loads(s)
+
+    @classmethod
+    def is_spec_bus_def(cls, spec_path):
+        return cls.load_spec(spec_path) is not None
 
     @classmethod
     def bus_defs_from_spec(cls, spec_path):
@@ -35,7 +175,15 @@ class BusDef(object):
         parse spec def and create the described slave+master bus interfaces
         """
         with open(spec_path) as fin:
-            spec = json5.load(fin)
+            spec = cls._loads(fin.read())
+        return cls.bus_defs_from_obj(spec)
+
+    @classmethod
+    def bus_defs_from_obj(cls, spec):
+        """
+        create the slave+master bus interfaces described by an already
+        parsed spec object
+        """
         adkey = 'abstractionDefinition'
         bus_type = dotdict(spec[adkey]['busType'])
         abstract_type = dotdict({
@@ -194,7 +342,7 @@ class BusDef(object):
             port_name,
         ]
         # split each attribute
-        return [sw.lower() for w in attrs for sw in util.words_from_name(w)]
+        return [sw.lower() for w in attrs for sw in _tokenize.words_from_name(w)]
 
     def __str__(self):
         return \
@@ -221,11 +369,24 @@ class BusDef(object):
         self._opt_ports    = opt_ports
         # prefixes must all be lowercase
         self._user_port_groups = [(p.lower(), pp) for p, pp in user_port_groups]
+        self.compiled      = CompiledBusDef(self)
+
+    def __getstate__(self):
+        # the compiled form holds token ids that are only meaningful in the
+        # process that interned them, so it is rebuilt when unpickled
+        state = dict(self.__dict__)
+        del state['compiled']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compiled = CompiledBusDef(self)
 
 #--------------------------------------------------------------------------
 # debug
 #--------------------------------------------------------------------------
 def debug_bus_mapping(bm):
+    cbd = bm.bus_def.compiled
     debug_str = ''
     debug_str += str(bm.bus_def)+'\n'
     debug_str += ('  - cost:{}, fcost:{}'.format(bm.cost, bm.fcost))+'\n'
@@ -236,7 +397,7 @@ def debug_bus_mapping(bm):
         [
             (
                 (
-                    bp in set(bm.bus_def.opt_ports),
+                    bp in cbd.opt_set,
                     bm.match_cost_func(pp, bp),
                 ),
                 pp,
@@ -259,7 +420,7 @@ def debug_bus_mapping(bm):
             (
                 (
                     bp == None,
-                    bp in set(bm.bus_def.opt_ports),
+                    bp in cbd.opt_set,
                     MatchCost(1,1,1,) if bp == None else bm.match_cost_func(pp, bp),
                 ),
                 pp,
@@ -277,7 +438,7 @@ def debug_bus_mapping(bm):
 
     # busports unmapped in either primary or sideband mapping
     umap_busports = (
-        set(bm.bus_def.req_ports)
+        cbd.req_set
         - set(bm.mapping.values())
         - set(bm.sideband_mapping.values())
     )
@@ -6,77 +6,142 @@ import numpy as np
 import shutil
 import json5
 from jsonref import JsonRef
-import argparse
 import subprocess
+import multiprocessing
 import logging
 from .busdef import BusDef
 from ._optimize import (
     map_ports_to_bus,
+    get_cost_funcs,
+    BusMapping,
+    CostRowCache,
+    WarmStartCache,
+    MappingClassCache,
     get_mapping_fcost_global,
     get_mapping_fcost_local,
+    get_direction_block_solver,
+    get_sparse_solver,
     MatchCost,
 )
+from ._fcost import (
+    BusDefIndex,
+    get_lowest_fcosts,
+    get_mapping_cost_bounds,
+)
 from ._bundle import BundleTree
+from ._mapcache import MappingStore
+from ._incremental import get_prev_port_groups
+from ._assign import (
+    supports_warm_start,
+    CachedSolver,
+)
+from ._buslib import (
+    load_bus_defs,
+    get_num_jobs,
+)
 from . import busdef
 from . import util
+from . import _cli
 
 def get_bus_defs(spec_path):
     assert os.path.isfile(spec_path)
-    assert BusDef.is_spec_bus_def(spec_path), \
+    spec = BusDef.load_spec(spec_path)
+    assert spec is not None, \
         "{} does not describe a proper bus abstractionDefinition in JSON5".format(spec_path)
 
-    return BusDef.bus_defs_from_spec(spec_path)
-
-def load_bus_defs(rootdir):
-    spec_paths = []
-    for root, dirs, fnames in os.walk(rootdir):
-        for fname in fnames:
-            spec_path = os.path.join(root, fname)
-            if BusDef.is_spec_bus_def(spec_path):
-                spec_paths.append(spec_path)
-
-    bus_defs = []
-    logging.info('loading {} bus specs'.format(len(spec_paths)))
-    for spec_path in spec_paths:
-        bus_defs.extend(BusDef.bus_defs_from_spec(spec_path))
-
-    logging.info('  - done, loaded {} bus defs with {} required and {} optional ports '.format(
-        len(bus_defs),
-        sum([bd.num_req_ports for bd in bus_defs]),
-        sum([bd.num_opt_ports for bd in bus_defs]),
-    ))
-    return bus_defs
-
-def _get_low_fcost_bus_defs(interface, bus_defs):
-    def get_sorted_fcosts(fcost_func):
-        return list(sorted(
-            [(
-                fcost_func(interface, bus_def),
-                bus_def,
-            ) for bus_def in bus_defs],
-            key=lambda x:x[0].value,
-        ))
-    fcosts_global = get_sorted_fcosts(get_mapping_fcost_global)
-    fcosts_local  = get_sorted_fcosts(get_mapping_fcost_local)
+    return BusDef.bus_defs_from_obj(spec)
+
+def _get_low_fcost_bus_defs(interface, bus_defs, bus_index=None, name_fcosts=None):
+    """
+    return the 5 bus defs with the lowest global fcost and up to 4 more with
+    the lowest local fcost.  `bus_index`, if specified, must be built over
+    `bus_defs` and is used to only score the width+direction fcost of bus
+    defs whose name fcost alone does not already rule them out.  those
+    are scored in batches against the bus def (width, direction)
+    histograms held by the index.  `name_fcosts` may be specified with the
+    global and local name fcosts of `interface` that were already computed
+    in a batch
+    """
+    if bus_index is None:
+        bus_index = BusDefIndex(bus_defs)
+    if name_fcosts is None:
+        name_fcosts = bus_index.get_name_fcosts(interface)
+    name_fcosts_global, name_fcosts_local = name_fcosts
+    size = interface.size
+
+    def fcosts_global(idx):
+        wc, dc, _, _ = bus_index.get_wd_fcosts(interface, idx)
+        return [
+            MatchCost(float(name_fcosts_global[i])*size, int(w), int(d))
+            for i, w, d in zip(idx, wc, dc)
+        ]
+    def fcosts_local(idx):
+        _, _, wc, dc = bus_index.get_wd_fcosts(interface, idx)
+        return [
+            MatchCost(float(name_fcosts_local[i]), int(w), int(d))
+            for i, w, d in zip(idx, wc, dc)
+        ]
+
+    # width+direction costs are non-negative, so the weighted name costs
+    # are lower bounds on each fcost value
+    fcosts_global = [(c, bus_defs[i]) for c, i in get_lowest_fcosts(
+        MatchCost.NAME_W*(name_fcosts_global*size),
+        fcosts_global,
+        5,
+    )]
+    fcosts_local = [(c, bus_defs[i]) for c, i in get_lowest_fcosts(
+        MatchCost.NAME_W*name_fcosts_local,
+        fcosts_local,
+        4,
+    )]
     # only include local matches if they don't appear in global
-    top_global_bds = set([bd for _, bd in fcosts_global[:5]])
+    top_global_bds = set([bd for _, bd in fcosts_global])
     fcosts_local = [
-        (c, bd) for c, bd in fcosts_local[:4]
+        (c, bd) for c, bd in fcosts_local
             if bd not in top_global_bds
     ]
-    return fcosts_global[:5] + fcosts_local
+    return fcosts_global + fcosts_local
 
-def _get_bus_pairings(bt, bus_defs):
+def _get_bus_pairings(bt, bus_defs, bus_index=None):
     # pass over all initial port groups and compute fcost to prioritize
     # potential bus pairings to optimize
     # NOTE need to keep track of node id in port group tree to pass back
     # costs and figure out optimal port groupings to expose
     i_bus_pairings = []
     nid_cost_map = {}
+    if bus_index is None:
+        bus_index = BusDefIndex(bus_defs)
 
-    for nid, interface in bt.get_initial_interfaces():
+    nid_interfaces = list(bt.get_initial_interfaces())
+    # isomorphic port groups, such as replicated instances of a bus, have
+    # the same fcosts, so only score one port group of each class
+    class_idx = {}
+    classes = []
+    for _, interface in nid_interfaces:
+        if interface.signature not in class_idx:
+            class_idx[interface.signature] = len(classes)
+            classes.append(interface)
+    logging.info('  - {} port groups in {} equivalence classes'.format(
+        len(nid_interfaces),
+        len(classes),
+    ))
+    # name fcosts of all port group classes against all bus defs in one
+    # batch
+    name_fcosts_global, name_fcosts_local = bus_index.get_name_fcosts_batch(
+        classes
+    )
+    class_bus_defs = [
+        _get_low_fcost_bus_defs(
+            interface,
+            bus_defs,
+            bus_index,
+            (name_fcosts_global[c], name_fcosts_local[c]),
+        )
+        for c, interface in enumerate(classes)
+    ]
+    for nid, interface in nid_interfaces:
         # for each port group, only pair with the lowest fcost bus defs
-        i_bus_defs = _get_low_fcost_bus_defs(interface, bus_defs)
+        i_bus_defs = class_bus_defs[class_idx[interface.signature]]
 
         l_fcost = i_bus_defs[0][0]
         # NOTE direction seems to be the only really informative metric for
@@ -103,26 +168,378 @@ def _get_bus_pairings(bt, bus_defs):
 
     return opt_i_bus_pairings
 
-def _get_initial_bus_matches(bt, i_bus_pairings):
+# bus defs, cost rows, solutions and the mapping store shared with the
+# mapping worker processes
+_worker_bus_defs = None
+_worker_row_cache = None
+_worker_solver = None
+_worker_mapping_store = None
+
+# slack when comparing lower bounds against costs to allow for rounding
+BOUND_TOL = 1e-9
+
+def _init_mapping_worker(bus_defs, solver, solve_cache_dir, mapping_store):
+    global _worker_bus_defs, _worker_row_cache, _worker_solver
+    global _worker_mapping_store
+    _worker_bus_defs = bus_defs
+    _worker_row_cache = CostRowCache()
+    _worker_solver = CachedSolver(solver, cache_dir=solve_cache_dir)
+    _worker_mapping_store = mapping_store
+
+def _map_ports_to_bus_defs(
+    interface,
+    bus_defs,
+    solver=None,
+    keep_alts=None,
+    row_cache=None,
+    warm_starts=None,
+    class_cache=None,
+):
+    """
+    map `interface` to each of `bus_defs` and return (index, bus_mapping)
+    pairs in order of increasing cost.  if `keep_alts` is specified only the
+    `keep_alts` lowest cost mappings are returned, so bus defs are solved
+    best-first in order of a lower bound on mapping cost and those that can
+    no longer place among the lowest are skipped altogether
+    """
+    order = range(len(bus_defs))
+    bounds = None
+    if keep_alts is not None:
+        bounds = get_mapping_cost_bounds(interface, bus_defs)
+        order = sorted(order, key=lambda k: (bounds[k], k))
+    solved = []
+    for k in order:
+        if (
+            bounds is not None and
+            len(solved) >= keep_alts and
+            bounds[k] > solved[keep_alts-1][0] + BOUND_TOL
+        ):
+            # all remaining bounds are at least as high
+            break
+        bm = map_ports_to_bus(
+            interface,
+            bus_defs[k],
+            solver=solver,
+            row_cache=row_cache,
+            warm_starts=warm_starts,
+            class_cache=class_cache,
+        )
+        solved.append((bm.cost.value, k, bm))
+        # ties are broken by original order as with a stable sort
+        solved.sort(key=lambda x: x[:2])
+    return [(k, bm) for _, k, bm in solved[:keep_alts]]
+
+def _map_unit(
+    unit,
+    solver=None,
+    keep_alts=None,
+    row_cache=None,
+    mapping_store=None,
+):
+    """
+    map each <interface, bus_defs> pair of `unit` in order, seeding the
+    solves of later interfaces with those of the earlier ones they contain
+    if `solver` supports it.  isomorphic interfaces of the unit are only
+    solved once, and not at all if found in `mapping_store`
+    """
+    warm_starts = WarmStartCache() if supports_warm_start(solver) else None
+    class_cache = MappingClassCache(mapping_store, solver)
+    return [
+        _map_ports_to_bus_defs(
+            interface,
+            bus_defs,
+            solver,
+            keep_alts,
+            row_cache,
+            warm_starts,
+            class_cache,
+        )
+        for interface, bus_defs in unit
+    ]
+
+def _map_unit_task(task):
+    u, unit, keep_alts = task
+    unit = [
+        (interface, [_worker_bus_defs[idx] for idx in bd_idxs])
+        for interface, bd_idxs in unit
+    ]
+    stats = _worker_solver.get_stats()
+    if _worker_mapping_store is not None:
+        stats += _worker_mapping_store.get_stats()
+    unit_results = _map_unit(
+        unit,
+        _worker_solver,
+        keep_alts,
+        _worker_row_cache,
+        _worker_mapping_store,
+    )
+    end_stats = _worker_solver.get_stats()
+    if _worker_mapping_store is not None:
+        end_stats += _worker_mapping_store.get_stats()
+    # only send back the plain mapping, the bus def and cost function are
+    # rebound in the parent, along with the solution and mapping cache
+    # counts of the unit
+    return u, [
+        [
+            (k, (
+                bm.mapping,
+                bm.sideband_mapping,
+                bm.user_group_mapping,
+                bm.unmapped_ports,
+                bm.cost,
+            ))
+            for k, bm in k_bus_mappings
+        ]
+        for k_bus_mappings in unit_results
+    ], [b - a for a, b in zip(stats, end_stats)]
+
+def _rebind_bus_mapping(interface, bus_def, result):
+    mapping, sideband_mapping, user_group_mapping, unmapped_ports, cost = result
+    match_cost_func, _ = get_cost_funcs(interface, bus_def)
+    bm = BusMapping(
+        mapping = mapping,
+        sideband_mapping = sideband_mapping,
+        user_group_mapping = user_group_mapping,
+        unmapped_ports = unmapped_ports,
+        match_cost_func = match_cost_func,
+        bus_def = bus_def,
+    )
+    bm.cost = cost
+    return bm
+
+def _get_mapping_units(groups, solver=None, keep_alts=None):
+    """
+    split the solves of `groups` into units of work, each a list of
+    (group index, bus def indices) pairs to be solved in order.  the
+    groups of isomorphic interfaces are placed in the same units, so that
+    they are only solved once
+    """
+    def get_classes(keys):
+        classes = {}
+        for i, key in enumerate(keys):
+            classes.setdefault(key, []).append(i)
+        return list(classes.values())
+
+    # without pruning or seeding every bus def is solved independently
+    if keep_alts is None and not supports_warm_start(solver):
+        return [
+            [(i, [k]) for i in idxs]
+            for idxs in get_classes([
+                (interface.signature, tuple(map(id, bus_defs)))
+                for interface, bus_defs in groups
+            ])
+                for k in range(len(groups[idxs[0]][1]))
+        ]
+    # with pruning the bus defs of a group are solved best-first
+    if not supports_warm_start(solver):
+        return [
+            [(i, list(range(len(groups[i][1])))) for i in idxs]
+            for idxs in get_classes([
+                (interface.signature, tuple(map(id, bus_defs)))
+                for interface, bus_defs in groups
+            ])
+        ]
+    # with seeding the nested groups sharing ports are solved innermost
+    # first within a single unit, so that the seeds do not depend on how
+    # the units are spread across jobs
+    comp = list(range(len(groups)))
+    def find(i):
+        while comp[i] != i:
+            comp[i] = comp[comp[i]]
+            i = comp[i]
+        return i
+    port_groups = {}
+    for i, (interface, _) in enumerate(groups):
+        for p in interface.get_ports_to_map():
+            j = port_groups.setdefault(p, i)
+            comp[find(i)] = find(j)
+    comp_groups = {}
+    for i in range(len(groups)):
+        comp_groups.setdefault(find(i), []).append(i)
+    comps = [
+        list(sorted(idxs, key=lambda i: (groups[i][0].size, i)))
+        for idxs in comp_groups.values()
+    ]
+    return [
+        [
+            (i, list(range(len(groups[i][1]))))
+            for c in cidxs for i in comps[c]
+        ]
+        for cidxs in get_classes([
+            tuple(
+                (groups[i][0].signature, tuple(map(id, groups[i][1])))
+                for i in idxs
+            )
+            for idxs in comps
+        ])
+    ]
+
+def _get_bus_mappings(
+    groups,
+    solver=None,
+    jobs=1,
+    keep_alts=None,
+    solve_cache_dir=None,
+    mapping_store=None,
+):
+    """
+    map the interface of each <interface, bus_defs> pair in `groups` to its
+    bus defs, splitting the solves across `jobs` worker processes (0 for
+    one per cpu).  for each group, return the (index, bus_mapping) pairs
+    given by `_map_ports_to_bus_defs`, which are identical regardless of
+    the number of jobs.  solutions of identical assignment problems are
+    reused and, if `solve_cache_dir` is specified, kept on disk across
+    runs.  `solver` may also be a CachedSolver to reuse its solutions
+    across calls.  if `mapping_store` is specified with a MappingStore, the
+    mappings of port groups seen by earlier runs are not solved again
+    """
+    units = _get_mapping_units(groups, solver, keep_alts)
+    ptot = sum([len(bus_defs) for _, bus_defs in groups])
+    plen = min(ptot, 50)
+    pcurr = 0
+    util.progress_bar(pcurr, ptot, length=plen)
+    results = [[] for _ in groups]
+
+    def add_unit_results(unit, unit_results, rebind):
+        nonlocal pcurr
+        for (i, ks), k_results in zip(unit, unit_results):
+            interface, bus_defs = groups[i]
+            results[i].extend([
+                (
+                    ks[kk],
+                    _rebind_bus_mapping(interface, bus_defs[ks[kk]], result)
+                    if rebind else result,
+                )
+                for kk, result in k_results
+            ])
+            pcurr += len(ks)
+        util.progress_bar(pcurr, ptot, length=plen)
+
+    jobs = min(get_num_jobs(jobs), len(units))
+    # <in-memory hits, on-disk hits, misses> of the solution cache followed
+    # by <hits, misses> of the mapping store
+    stats = [0, 0, 0, 0, 0]
+    cached_solver = solver if isinstance(solver, CachedSolver) else \
+        CachedSolver(solver, cache_dir=solve_cache_dir)
+    if jobs <= 1:
+        # ports of nested and sibling port groups share cost matrix rows
+        row_cache = CostRowCache()
+        # the solver and store may be shared with earlier calls, so only
+        # count this call
+        def get_stats():
+            stats = cached_solver.get_stats()
+            if mapping_store is not None:
+                stats += mapping_store.get_stats()
+            return stats
+        stats_base = get_stats()
+        for unit in units:
+            add_unit_results(unit, _map_unit(
+                [
+                    (groups[i][0], [groups[i][1][k] for k in ks])
+                    for i, ks in unit
+                ],
+                cached_solver,
+                keep_alts,
+                row_cache,
+                mapping_store,
+            ), False)
+        stats = [a - b for a, b in zip(get_stats(), stats_base)]
+    else:
+        solve_cache_dir = cached_solver.cache_dir
+        solver = cached_solver.solver
+        # only ship the paired bus defs to the workers
+        bd_idx_map = {}
+        worker_bus_defs = []
+        for _, bus_defs in groups:
+            for bus_def in bus_defs:
+                if id(bus_def) not in bd_idx_map:
+                    bd_idx_map[id(bus_def)] = len(worker_bus_defs)
+                    worker_bus_defs.append(bus_def)
+        # schedule the largest problems first so that a few large solves do
+        # not trail behind once the rest of the pool is idle
+        tasks = []
+        for u, unit in enumerate(units):
+            size = 0
+            task_unit = []
+            for i, ks in unit:
+                interface, bus_defs = groups[i]
+                size += len(interface.get_ports_to_map())*sum([
+                    bus_defs[k].compiled.num_match for k in ks
+                ])
+                task_unit.append(
+                    (interface, [bd_idx_map[id(bus_defs[k])] for k in ks])
+                )
+            tasks.append((-size, u, (u, task_unit, keep_alts)))
+        tasks = [task for _, _, task in sorted(tasks, key=lambda x: x[:2])]
+        with multiprocessing.Pool(
+            jobs,
+            initializer=_init_mapping_worker,
+            initargs=(worker_bus_defs, solver, solve_cache_dir, mapping_store),
+        ) as pool:
+            for u, unit_results, u_stats in pool.imap_unordered(_map_unit_task, tasks):
+                add_unit_results(units[u], unit_results, True)
+                stats = [a + b for a, b in zip(stats, u_stats)]
+
+    for i_results in results:
+        i_results.sort(key=lambda x: (x[1].cost.value, x[0]))
+    if mapping_store is not None:
+        logging.info('  - {} of {} bus mappings reused from the mapping cache'.format(
+            stats[3],
+            stats[3] + stats[4],
+        ))
+        num_evicted = mapping_store.prune()
+        if num_evicted > 0:
+            logging.info('  - evicted {} cached bus mappings'.format(num_evicted))
+    logging.info('  - {} of {} assignment solves reused ({} from disk)'.format(
+        stats[0] + stats[1],
+        sum(stats[:3]),
+        stats[1],
+    ))
+    num_evicted = cached_solver.prune()
+    if num_evicted > 0:
+        logging.info('  - evicted {} cached assignment solutions'.format(num_evicted))
+    if keep_alts is not None:
+        logging.info('  - skipped {} of {} bus mapping solves'.format(
+            ptot - sum([len(r) for r in results]),
+            ptot,
+        ))
+    return results
+
+def _get_initial_bus_matches(
+    bt,
+    i_bus_pairings,
+    solver=None,
+    jobs=1,
+    keep_alts=None,
+    solve_cache_dir=None,
+    mapping_store=None,
+):
 
     # perform bus mappings for chosen subset to determine lowest cost bus
     # mapping for each port group
+    group_bus_mappings = _get_bus_mappings(
+        [
+            (interface, [bus_def for _, bus_def in bus_defs])
+            for _, _, interface, bus_defs in i_bus_pairings
+        ],
+        solver,
+        jobs,
+        keep_alts,
+        solve_cache_dir,
+        mapping_store,
+    )
     i_bus_mappings = []
     nid_cost_map = {}
-    ptot = sum([len(bd) for _, _, _, bd in i_bus_pairings])
-    plen = min(ptot, 50)
-    pcurr = 0
-    util.progress_bar(pcurr, ptot, length=plen)
-    for i, (nid, l_fcost, interface, bus_defs) in enumerate(i_bus_pairings):
+    for (nid, l_fcost, interface, bus_defs), k_bus_mappings in zip(
+        i_bus_pairings,
+        group_bus_mappings,
+    ):
+        # bus mappings are already in order of increasing cost
         bus_mappings = []
-        for fcost, bus_def in bus_defs:
-            bm = map_ports_to_bus(interface, bus_def)
-            bm.fcost = fcost
+        for k, bm in k_bus_mappings:
+            bm.fcost = bus_defs[k][0]
             bus_mappings.append(bm)
-            util.progress_bar(pcurr+1, ptot, length=plen)
-            pcurr += 1
 
-        bus_mappings.sort(key=lambda bm: bm.cost)
         lcost = bus_mappings[0].cost
         nid_cost_map[nid] = lcost
 
@@ -141,15 +558,45 @@ def _get_initial_bus_matches(bt, i_bus_pairings):
 
     return opt_i_bus_mappings
 
-def get_bus_matches(ports, bus_defs):
+def get_bus_matches(
+    ports,
+    bus_defs,
+    bus_index=None,
+    solver=None,
+    jobs=1,
+    keep_alts=None,
+    solve_cache_dir=None,
+    mapping_store=None,
+):
+    """
+    group `ports` and return pairings of <interface, bus_mappings> for the
+    optimal port groups.  `bus_index` may be specified to reuse a
+    BusDefIndex built over `bus_defs` across calls.  `solver` selects the
+    assignment solver backend (default: hungarian) and bus mapping is split
+    across `jobs` worker processes (0 for one per cpu).  if `keep_alts` is
+    specified, only the `keep_alts` lowest cost bus mappings are kept for
+    each port group and solves that cannot place among them are skipped.
+    `solve_cache_dir` may be specified to keep assignment solutions on disk
+    and `mapping_store` with a MappingStore to reuse the bus mappings of
+    earlier runs
+    """
+    assert keep_alts is None or keep_alts >= 1, "must keep at least one bus mapping"
     bt = BundleTree(ports)
 
     logging.info('initial bus pairing with port groups')
-    opt_i_bus_pairings = _get_bus_pairings(bt, bus_defs)
+    opt_i_bus_pairings = _get_bus_pairings(bt, bus_defs, bus_index)
     logging.info('  - done')
 
     logging.info('bus mapping')
-    opt_i_bus_mappings = _get_initial_bus_matches(bt, opt_i_bus_pairings)
+    opt_i_bus_mappings = _get_initial_bus_matches(
+        bt,
+        opt_i_bus_pairings,
+        solver,
+        jobs,
+        keep_alts,
+        solve_cache_dir,
+        mapping_store,
+    )
     logging.info('  - done')
 
     # return pairings of <interface, bus_mapping>
@@ -158,65 +605,129 @@ def get_bus_matches(ports, bus_defs):
 #--------------------------------------------------------------------------
 # main
 #--------------------------------------------------------------------------
-def main():
-    logging.basicConfig(format='%(message)s', level=logging.DEBUG)
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '-b', '--duh-bus',
-        default=None,
-        required=False,
-        help='duh-bus root directory that contains bus specifications.  will default to $(duh-bus-which), which requires duh-bus to be installed',)
-    parser.add_argument(
-        '-o', '--output',
-        default=sys.stdout,
-        required=False,
-        help='output path to busprop.json with proposed bus mappings for select groups of ports (default: stdout)',
-    )
-    parser.add_argument(
-        '--debug',
-        action='store_true',
-        help='dump debug format',
+def get_duh_bus_path(duh_bus=None):
+    """
+    resolve the duh-bus root directory, invoking duh-bus-which to locate
+    it if `duh_bus` is not specified
+    """
+    if duh_bus is not None:
+        assert os.path.isdir(duh_bus), '{} not a directory'.format(duh_bus)
+        return duh_bus
+    if shutil.which('duh-bus-which'):
+        duh_bus_path = subprocess.check_output('duh-bus-which').strip()
+        duh_bus_path = duh_bus_path.decode('ascii')
+        assert os.path.isdir(duh_bus_path), \
+            "duh-bus not properly installed, please use -b/--duh-bus"
+        return duh_bus_path
+    logging.error('error: duh-bus not installed and -b/--duh-bus not specified')
+    sys.exit(1)
 
-    )
-    parser.add_argument(
-        'component_json5',
-        help='input component.json5 with port list of top-level module',
+def get_args_solver(args):
+    """
+    assignment solver selected by the parsed `duh-portinf` arguments `args`
+    """
+    solver = args.solver
+    if args.decompose:
+        solver = get_direction_block_solver(solver)
+    if args.sparse_k is not None:
+        solver = get_sparse_solver(solver, k=args.sparse_k)
+    return solver
 
+def get_args_mapping_store(args, prune_interval=0):
+    """
+    MappingStore selected by the parsed `duh-portinf` arguments `args`, or
+    None if caching is disabled
+    """
+    cache_dir = _cli.get_cache_dir(args)
+    if cache_dir is None:
+        return None
+    return MappingStore(
+        os.path.join(cache_dir, 'mappings'),
+        args.cache_size << 20,
+        prune_interval=prune_interval,
     )
-    if len(sys.argv) == 1:
-        parser.print_help(sys.stderr)
-        sys.exit(1)
-    args = parser.parse_args()
 
-    assert os.path.isfile(args.component_json5), '{} does not exist'.format(args.component_json5)
-    if args.output != sys.stdout and os.path.dirname(args.output) != '':
-        dn = os.path.dirname(args.output)
-        assert os.path.isdir(dn), 'output directory {} does not exist'.format(dn)
-
-    # try to invoke duh-bus-which to load bus specs if not specified with -b
-    if args.duh_bus == None:
-        if shutil.which('duh-bus-which'):
-            duh_bus_path = subprocess.check_output('duh-bus-which').strip()
-            duh_bus_path = duh_bus_path.decode('ascii')
-            assert os.path.isdir(duh_bus_path), \
-                "duh-bus not properly installed, please use -b/--duh-bus"
-        else:
-            logging.error('error: duh-bus not installed and -b/--duh-bus not specified')
-            sys.exit(1)
-    else:
-        assert os.path.isdir(args.duh_bus), '{} not a directory'.format(args.duh_bus)
-        duh_bus_path = args.duh_bus
+def get_args_cached_solver(args, prune_interval=0):
+    """
+    CachedSolver for `get_args_solver(args)`, keeping solutions on disk if
+    selected by the parsed `duh-portinf` arguments `args`
+    """
+    cache_dir = _cli.get_cache_dir(args)
+    return CachedSolver(
+        get_args_solver(args),
+        cache_dir=(
+            os.path.join(cache_dir, 'solves')
+            if args.solve_cache and cache_dir is not None else None
+        ),
+        max_disk_size=args.cache_size << 20,
+        prune_interval=prune_interval,
+    )
 
+def infer_component(
+    args,
+    bus_defs,
+    bus_index=None,
+    solver=None,
+    mapping_store=None,
+):
+    """
+    map the unassigned ports of `args.component_json5` to `bus_defs` and
+    write the proposed bus interfaces to `args.output`, for parsed
+    `duh-portinf` arguments `args`.  `bus_index`, `solver` (a CachedSolver
+    for `get_args_solver(args)`) and `mapping_store` may be specified to reuse them
+    across calls, otherwise they are set up from `args`.  returns the newly
+    mapped <interface, bus_mappings> pairs
+    """
     unassn_ports = util.get_unassigned_ports(args.component_json5)
-    bus_defs = load_bus_defs(duh_bus_path)
+    carried = None
+    if args.incremental is not None:
+        logging.info('diffing against previous run {}'.format(args.incremental))
+        carried, unassn_ports = get_prev_port_groups(
+            args.incremental,
+            unassn_ports,
+            bus_defs,
+        )
+    if mapping_store is None:
+        mapping_store = get_args_mapping_store(args)
+    if solver is None:
+        solver = get_args_cached_solver(args)
     logging.info('mapping {} unassigned ports'.format(len(unassn_ports)))
-    i_bus_mappings = get_bus_matches(unassn_ports, bus_defs)
+    i_bus_mappings = [] if len(unassn_ports) == 0 else get_bus_matches(
+        unassn_ports,
+        bus_defs,
+        bus_index=bus_index,
+        solver=solver,
+        jobs=args.jobs,
+        keep_alts=args.keep_alts,
+        mapping_store=mapping_store,
+    )
     util.dump_json_bus_candidates(
         args.output,
         args.component_json5,
         i_bus_mappings,
         args.debug,
+        carried,
+    )
+    return i_bus_mappings
+
+def main():
+    logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+    parser = _cli.get_portinf_parser()
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    args = parser.parse_args()
+    _cli.check_portinf_args(args)
+
+    duh_bus_path = get_duh_bus_path(args.duh_bus)
+    bus_defs = load_bus_defs(
+        duh_bus_path,
+        cache_dir=_cli.get_cache_dir(args),
+        jobs=args.jobs,
+        # workers attach the bus library instead of receiving copies
+        shared=args.jobs != 1,
     )
+    infer_component(args, bus_defs)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import copy
+import glob
+import time
+import logging
+import traceback
+import multiprocessing
+from ._fcost import BusDefIndex
+from ._buslib import (
+    load_bus_defs,
+    get_num_jobs,
+)
+from . import main_portinf
+from . import util
+from . import _cli
+
+# read-only state shared with the worker processes
+_worker_args = None
+_worker_bus_defs = None
+_worker_bus_index = None
+_worker_solver = None
+_worker_mapping_store = None
+
+def get_component_paths(patterns):
+    """
+    expand the file names and glob `patterns` into component paths, in
+    order of first match and skipping the outputs of earlier runs
+    """
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        assert len(matches) > 0, '{} does not match any file'.format(pattern)
+        for path in matches:
+            if (
+                os.path.isfile(path) and
+                not path.endswith('.portinf.json') and
+                path not in seen
+            ):
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+def get_output_path(component_json5):
+    """
+    <name>.portinf.json next to `component_json5`
+    """
+    stem, ext = os.path.splitext(component_json5)
+    if ext not in ['.json5', '.json']:
+        stem = component_json5
+    return stem + '.portinf.json'
+
+def _init_batch_worker(args, bus_defs, bus_index, quiet=True):
+    global _worker_args, _worker_bus_defs, _worker_bus_index
+    global _worker_solver, _worker_mapping_store
+    _worker_args = args
+    _worker_bus_defs = bus_defs
+    _worker_bus_index = bus_index
+    # the caches are pruned once at the end of the batch rather than after
+    # every component
+    _worker_solver = main_portinf.get_args_cached_solver(args, prune_interval=None)
+    _worker_mapping_store = main_portinf.get_args_mapping_store(args, prune_interval=None)
+    if quiet:
+        # keep the log readable with several components in flight
+        logging.getLogger().setLevel(logging.WARNING)
+        util.silent = True
+
+def _infer_task(component_json5):
+    """
+    map a single component and return (path, number of port groups,
+    seconds, error), where error is None unless the component failed
+    """
+    args = copy.copy(_worker_args)
+    args.component_json5 = component_json5
+    args.output = get_output_path(component_json5)
+    args.incremental = None
+    start = time.time()
+    try:
+        i_bus_mappings = main_portinf.infer_component(
+            args,
+            _worker_bus_defs,
+            bus_index=_worker_bus_index,
+            solver=_worker_solver,
+            mapping_store=_worker_mapping_store,
+        )
+    except (Exception, SystemExit):
+        return component_json5, None, time.time() - start, traceback.format_exc()
+    return component_json5, len(i_bus_mappings), time.time() - start, None
+
+def infer_components(args, paths, bus_defs):
+    """
+    map each component in `paths` to `bus_defs` with the parsed
+    `duh-portinf-batch` arguments `args`, fanning the components out across
+    `args.jobs` worker processes, and return the (path, number of port
+    groups, seconds, error) of each in the order of `paths`
+    """
+    bus_index = BusDefIndex(bus_defs)
+    jobs = min(get_num_jobs(args.jobs), len(paths))
+    # the components are split across workers, so each is mapped serially
+    args = copy.copy(args)
+    args.jobs = 1
+    if jobs <= 1:
+        _init_batch_worker(args, bus_defs, bus_index, quiet=False)
+        results = [_infer_task(path) for path in paths]
+    else:
+        with multiprocessing.Pool(
+            jobs,
+            initializer=_init_batch_worker,
+            initargs=(args, bus_defs, bus_index),
+        ) as pool:
+            results = {}
+            for result in pool.imap_unordered(_infer_task, paths):
+                results[result[0]] = result
+                logging.info('  - {} {}'.format(
+                    'failed' if result[3] is not None else 'done',
+                    result[0],
+                ))
+        results = [results[path] for path in paths]
+
+    num_evicted = main_portinf.get_args_cached_solver(args).prune()
+    mapping_store = main_portinf.get_args_mapping_store(args)
+    if mapping_store is not None:
+        num_evicted += mapping_store.prune()
+    if num_evicted > 0:
+        logging.info('  - evicted {} cached bus mappings and solutions'.format(num_evicted))
+    return results
+
+#--------------------------------------------------------------------------
+# main
+#--------------------------------------------------------------------------
+def main():
+    logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+    parser = _cli.get_portinf_parser(prog='duh-portinf-batch', batch=True)
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    args = parser.parse_args()
+    assert args.duh_bus is None or os.path.isdir(args.duh_bus), \
+        '{} not a directory'.format(args.duh_bus)
+    paths = get_component_paths(args.component_json5s)
+
+    duh_bus_path = main_portinf.get_duh_bus_path(args.duh_bus)
+    bus_defs = load_bus_defs(
+        duh_bus_path,
+        cache_dir=_cli.get_cache_dir(args),
+        jobs=args.jobs,
+        # workers attach the bus library instead of receiving copies
+        shared=args.jobs != 1,
+    )
+    logging.info('mapping {} components'.format(len(paths)))
+    start = time.time()
+    results = infer_components(args, paths, bus_defs)
+    elapsed = time.time() - start
+
+    width = max([len(path) for path in paths])
+    logging.info('')
+    logging.info('{:<{}}  {:>11}  {:>8}'.format('component', width, 'port groups', 'seconds'))
+    for path, num_groups, seconds, error in results:
+        logging.info('{:<{}}  {:>11}  {:>8.2f}'.format(
+            path,
+            width,
+            'failed' if error is not None else num_groups,
+            seconds,
+        ))
+    failed = [(path, error) for path, _, _, error in results if error is not None]
+    logging.info('  - mapped {} of {} components in {:.2f}s ({:.2f}s of work)'.format(
+        len(paths) - len(failed),
+        len(paths),
+        elapsed,
+        sum([seconds for _, _, seconds, _ in results]),
+    ))
+    for path, error in failed:
+        logging.error('error: {} failed\n{}'.format(path, error))
+    if len(failed) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
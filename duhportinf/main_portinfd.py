@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import argparse
+import logging
+from . import _cli
+
+#--------------------------------------------------------------------------
+# server
+#--------------------------------------------------------------------------
+def main():
+    logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--socket',
+        default=_cli.get_default_socket_path(),
+        required=False,
+        help='path of the Unix socket to listen on (default: {})'.format(_cli.get_default_socket_path()),
+    )
+    parser.add_argument(
+        '--stop',
+        action='store_true',
+        help='stop the server listening on the socket and exit',
+    )
+    args = parser.parse_args()
+
+    if args.stop:
+        if not _cli.is_listening(args.socket):
+            logging.error('error: no duh-portinfd listening on {}'.format(args.socket))
+            sys.exit(1)
+        response = _cli.send_request(args.socket, {'command' : 'stop'})
+        if response.get('error') is not None:
+            logging.error('error: {}'.format(response['error']))
+            sys.exit(1)
+        return
+
+    # only the server itself needs the whole matching stack
+    from . import _server
+
+    if os.path.exists(args.socket):
+        assert not _cli.is_listening(args.socket), \
+            'duh-portinfd already listening on {}'.format(args.socket)
+        # left behind by a server that did not exit cleanly
+        os.unlink(args.socket)
+    dn = os.path.dirname(args.socket)
+    if dn != '':
+        os.makedirs(dn, exist_ok=True)
+    server = _server.PortinfServer(args.socket)
+    logging.info('listening on {}'.format(args.socket))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    logging.info('served {} requests'.format(server.num_requests))
+
+#--------------------------------------------------------------------------
+# client
+#--------------------------------------------------------------------------
+def client_main():
+    parser = _cli.get_portinf_parser(prog='duh-portinf-client')
+    parser.add_argument(
+        '--socket',
+        default=_cli.get_default_socket_path(),
+        required=False,
+        help='path of the Unix socket duh-portinfd listens on (default: {})'.format(_cli.get_default_socket_path()),
+    )
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    args = parser.parse_args()
+    _cli.check_portinf_args(args)
+
+    if not _cli.is_listening(args.socket):
+        sys.stderr.write('error: no duh-portinfd listening on {}\n'.format(args.socket))
+        sys.exit(1)
+    request_args = _cli.get_abs_args(args)
+    del request_args['socket']
+    response = _cli.send_request(
+        args.socket,
+        {'command' : 'infer', 'args' : request_args},
+    )
+    sys.stderr.write(response['log'])
+    if response.get('error') is not None:
+        sys.stderr.write('error: duh-portinfd could not serve the request: {}\n'.format(
+            response['error'],
+        ))
+    if response['output'] is not None:
+        sys.stdout.write(response['output'])
+    sys.exit(response['status'])
+
+if __name__ == '__main__':
+    main()
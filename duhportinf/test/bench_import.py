@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+"""
+time the import of the command line entry points, each in a fresh
+interpreter, and list the heavy packages each one loads
+
+    python -m duhportinf.test.bench_import [-n RUNS]
+"""
+import sys
+import argparse
+import subprocess
+
+MODULES = [
+    'duhportinf.main_portbundler',
+    'duhportinf.main_portinf',
+    'duhportinf.main_portinf_batch',
+    'duhportinf.main_portinfd',
+]
+HEAVY = ['numpy', 'scipy', 'cvxopt', 'json5', 'jsonref']
+
+_SNIPPET = '''
+import sys, time
+t = time.perf_counter()
+import {}
+t = time.perf_counter() - t
+print(t, ','.join(m for m in {!r} if m in sys.modules))
+'''
+
+def time_import(module, runs):
+    """
+    return the best of `runs` import times of `module` in seconds along
+    with the heavy packages it loaded
+    """
+    best = None
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', _SNIPPET.format(module, HEAVY)],
+        ).decode('utf-8').split()
+        t = float(out[0])
+        best = t if best is None else min(best, t)
+    loaded = out[1].split(',') if len(out) > 1 else []
+    return best, loaded
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--runs',
+        type=int,
+        default=5,
+        required=False,
+        help='number of runs per module, the best is reported (default: 5)',
+    )
+    args = parser.parse_args()
+    width = max([len(m) for m in MODULES])
+    print('{:<{}}  {:>8}  {}'.format('module', width, 'ms', 'loaded'))
+    for module in MODULES:
+        t, loaded = time_import(module, args.runs)
+        print('{:<{}}  {:>8.1f}  {}'.format(module, width, t*1000, ' '.join(loaded)))
+
+if __name__ == '__main__':
+    main()
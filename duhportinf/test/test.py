@@ -1,13 +1,34 @@
+import io
 import os
+import pickle
+import sys
+import shutil
+import subprocess
+import socket
+import threading
+import tempfile
 import unittest
 import json
+import numpy as np
+import scipy.sparse as sp
+from unittest import mock
 
 from .. import util
 from .. import main_portinf
 from .. import main_portbundler
+from .. import main_portinf_batch
 from .. import _optimize 
 from ..busdef import BusDef
 from .. import _bundle
+from .. import _buslib
+from .. import _fcost
+from .. import _tokenize
+from .. import _assign
+from .. import _mapcache
+from .. import _sharedlib
+from .. import _cli
+from .. import _server
+from .._incremental import get_prev_port_groups
 
 util.silent = True
 
@@ -230,6 +251,27 @@ class Grouper(unittest.TestCase):
         # must see all three full prefix groups
         self.assertEqual(len(seen_prefix), 3)
 
+    def test_replicated_signatures(self):
+        # instances that only differ in their prefix are isomorphic
+        suffixes = ['ACLK', 'ARESETn', 'ARQOS', 'AWQOS', 'AWID', 'AWLEN']
+        ports = set()
+        for i in range(3):
+            ports |= set([
+                ('axi{}_{}'.format(i, s), 8 if (i, s) == (2, 'AWLEN') else 1, 1)
+                for s in suffixes
+            ])
+        bt = _bundle.BundleTree(ports)
+        sigs = {}
+        for nid, inter in bt.get_initial_interfaces():
+            if len(inter.ports) == len(suffixes):
+                sigs[inter.prefix] = inter.signature
+        self.assertEqual(sigs['axi0_A'], sigs['axi1_A'])
+        self.assertNotEqual(sigs['axi0_A'], sigs['axi2_A'])
+        self.assertEqual(
+            [s[0] for s in sigs['axi0_A']],
+            list(sorted([s[1:] for s in suffixes])),
+        )
+
     def test_filter_optimal_groups(self):
         port_names = [
             'clk',
@@ -384,6 +426,64 @@ class Fcost(unittest.TestCase):
         self.assertTrue(corr_bd1 in sel_bus_defs)
         self.assertTrue(corr_bd2 in sel_bus_defs)
 
+    def test_batched_wd_fcost(self):
+        bds = _get_random_bus_defs(40)
+        bus_index = _fcost.BusDefIndex(bds)
+        interfaces = _get_random_interfaces(10)
+        # include widths that do not appear anywhere in the library
+        interfaces.append(_bundle.Interface(
+            [('odd_a', 7, 1), ('odd_b', 7, -1), ('odd_c', 1, 1)], [],
+        ))
+        for interface in interfaces:
+            wcg, dcg, wcl, dcl = bus_index.get_wd_fcosts(interface)
+            for i, bd in enumerate(bds):
+                cg = _optimize._get_mapping_fcost_base(interface, bd, penalize_umap=True)
+                cl = _optimize._get_mapping_fcost_base(interface, bd, penalize_umap=False)
+                self.assertEqual((cg.wc, cg.dc), (wcg[i], dcg[i]))
+                self.assertEqual((cl.wc, cl.dc), (wcl[i], dcl[i]))
+
+    def test_indexed_low_fcost(self):
+        # pruning with the n-gram index must select exactly the same bus
+        # defs as scoring the full library
+        bds = _get_random_bus_defs(80)
+        bus_index = _fcost.BusDefIndex(bds)
+        for interface in _get_random_interfaces(10):
+            def get_sorted_fcosts(fcost_func):
+                return list(sorted(
+                    [(fcost_func(interface, bd), bd) for bd in bds],
+                    key=lambda x:x[0].value,
+                ))
+            fcosts_global = get_sorted_fcosts(_optimize.get_mapping_fcost_global)[:5]
+            fcosts_local = get_sorted_fcosts(_optimize.get_mapping_fcost_local)[:4]
+            top_global_bds = set([bd for _, bd in fcosts_global])
+            answer = fcosts_global + [
+                (c, bd) for c, bd in fcosts_local if bd not in top_global_bds
+            ]
+            i_bus_defs = main_portinf._get_low_fcost_bus_defs(interface, bds, bus_index)
+            self.assertEqual(
+                [(c.value, id(bd)) for c, bd in i_bus_defs],
+                [(c.value, id(bd)) for c, bd in answer],
+            )
+
+    def test_batched_name_fcost(self):
+        # the sparse n-gram kernel must reproduce the name fcosts of every
+        # interface against every bus def exactly
+        bds = _get_random_bus_defs(40)
+        bus_index = _fcost.BusDefIndex(bds)
+        interfaces = _get_random_interfaces(12)
+        name_g, name_l = bus_index.get_name_fcosts_batch(interfaces)
+        self.assertEqual(name_g.shape, (len(interfaces), len(bds)))
+        for i, interface in enumerate(interfaces):
+            for j, bd in enumerate(bds):
+                self.assertEqual(
+                    name_g[i, j],
+                    _optimize._get_name_fcost1(interface, bd),
+                )
+                self.assertEqual(
+                    name_l[i, j],
+                    _optimize._get_name_fcost2(interface, bd),
+                )
+
     def tearDown(self):
         pass
 
@@ -541,22 +641,1069 @@ class BusMapping(unittest.TestCase):
             answer_umap_ports,
         )
 
+    def test_solver_backends(self):
+        # all backends must reach the same optimum, although ties may be
+        # broken differently
+        rng = np.random.RandomState(0)
+        for _ in range(20):
+            m = rng.randint(1, 12)
+            n = rng.randint(m, 16)
+            # coarse costs so that there are plenty of ties
+            C = rng.randint(0, 4, size=(m, n)).astype(np.float64)
+            costs = []
+            for name in sorted(_assign.SOLVERS):
+                X = _assign.get_solver(name)(C)
+                self.assertTrue(np.all(X.sum(axis=1) == 1))
+                self.assertTrue(np.all(X.sum(axis=0) <= 1))
+                costs.append(C[X].sum())
+            self.assertEqual(len(set(costs)), 1)
+
+        interface = _get_random_interfaces(1)[0]
+        bd = _get_random_bus_defs(1)[0]
+        costs = [
+            _optimize.map_ports_to_bus(interface, bd, solver=name).cost
+            for name in sorted(_assign.SOLVERS)
+        ]
+        self.assertTrue(all(c is not None for c in costs))
+
+    def test_lp_constraints(self):
+        # problems of the same shape share their constraint matrices and
+        # only differ in the cost vector
+        _assign._get_lp_constraints.cache_clear()
+        rng = np.random.RandomState(1)
+        for _ in range(3):
+            C = rng.rand(4, 7)
+            X = _assign.get_glpk_assignment(C)
+            self.assertEqual(C[X].sum(), C[_assign.get_hungarian_assignment(C)].sum())
+        info = _assign._get_lp_constraints.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+        G, h, A, b = _assign._get_lp_constraints(4, 7)
+        self.assertEqual((G.size, h.size, A.size, b.size), ((2*28+7, 28), (2*28+7, 1), (4, 28), (4, 1)))
+        x = X.reshape(-1).astype(np.float64)
+        self.assertTrue(np.all(np.array(G*_assign._get_cvxopt().matrix(x)) <= np.array(h)))
+        self.assertTrue(np.all(np.array(A*_assign._get_cvxopt().matrix(x)) == np.array(b)))
+
+    def test_block_solver(self):
+        # two blocks with only expensive entries across them are solved
+        # separately, to the same optimum as the whole problem
+        rng = np.random.RandomState(2)
+        C = np.full((6, 9), 10.0)
+        C[:4, :5] = rng.randint(0, 4, size=(4, 5))
+        C[4:, 5:] = rng.randint(0, 4, size=(2, 4))
+        blocks = _assign.get_blocks(C, 4)
+        self.assertEqual(
+            [(list(r), list(c)) for r, c in blocks],
+            [([0, 1, 2, 3], [0, 1, 2, 3, 4]), ([4, 5], [5, 6, 7, 8])],
+        )
+        for name in sorted(_assign.SOLVERS):
+            solver = _assign.BlockSolver(name, threshold=4)
+            X = solver(C)
+            self.assertEqual(C[X].sum(), C[_assign.get_hungarian_assignment(C)].sum())
+            self.assertEqual((solver.num_split, solver.num_fallback), (1, 0))
+        self.assertNotEqual(_assign.get_solver_name(solver), _assign.get_solver_name(name))
+
+        # a block without enough columns for its rows is not split
+        C[4:, 5:] = 10
+        C[4:, 5] = 0
+        self.assertIsNone(_assign.get_blocks(C, 4))
+
+        # neither are blocks that are only optimal on their own
+        C = np.array([
+            [4, 0, 4, 2, 2],
+            [4, 0, 3, 4, 5],
+            [1, 1, 0, 3, 5],
+            [4, 5, 3, 0, 3],
+        ], dtype=np.float64)
+        solver = _assign.BlockSolver('hungarian', threshold=2)
+        X = solver(C)
+        self.assertEqual(C[X].sum(), C[_assign.get_hungarian_assignment(C)].sum())
+        self.assertEqual((solver.num_split, solver.num_fallback), (0, 1))
+
+        # splitting bus mappings by direction does not change their cost
+        interface = _get_random_interfaces(1)[0]
+        bd = _get_random_bus_defs(1)[0]
+        self.assertEqual(
+            _optimize.map_ports_to_bus(interface, bd).cost,
+            _optimize.map_ports_to_bus(
+                interface,
+                bd,
+                solver=_optimize.get_direction_block_solver(),
+            ).cost,
+        )
+
+    def test_sparse_assignment(self):
+        # rows are left unassigned only if their candidates are taken, and
+        # zero costs are edges like any other
+        C = np.array([
+            [0, 1, 0],
+            [0, 0, 0],
+            [0, 0, 0],
+        ], dtype=np.float64)
+        mask = np.array([
+            [1, 1, 0],
+            [1, 0, 0],
+            [1, 0, 0],
+        ], dtype=bool)
+        rows, cols = np.nonzero(mask)
+        C = sp.csr_matrix((C[rows, cols], (rows, cols)), shape=C.shape)
+        cols = _assign.get_sparse_assignment(C, 100)
+        self.assertEqual(cols[0], 1)
+        self.assertEqual(sorted(cols[1:].tolist()), [-1, 0])
+
+        interface = _get_random_interfaces(1, seed=4)[0]
+        bd = _get_random_bus_defs(1, seed=5)[0]
+        ports = list(sorted(interface.get_ports_to_map(), key=lambda p: p[0]))
+        n = bd.compiled.num_match
+        dense = _optimize.get_cost_matrix(interface, ports, bd)
+        C = _optimize.get_sparse_cost_matrix(interface, ports, bd, 2)
+        # the cheapest pairs of every row and column are candidates, with
+        # the same costs as in the dense matrix
+        self.assertLessEqual(C.nnz, 2*(len(ports) + n))
+        # zero costs are stored explicitly, so the structure is compared
+        coo = C.tocoo()
+        np.testing.assert_array_equal(coo.data, dense[coo.row, coo.col])
+        for i in range(len(ports)):
+            self.assertIn(np.min(dense[i]), dense[i, coo.col[coo.row == i]])
+        for j in range(n):
+            self.assertIn(np.min(dense[:, j]), dense[coo.row[coo.col == j], j])
+
+        # with all pairs as candidates the sparse solve is exact
+        mapping = _optimize.solve_ports_to_bus(
+            interface,
+            bd,
+            _optimize.get_sparse_solver(k=max(len(ports), n), min_ports=1),
+        )
+        mc_func, _ = _optimize.get_cost_funcs(interface, bd)
+        self.assertAlmostEqual(
+            sum([mc_func(k, v).value for k, v in mapping.items()]),
+            sum([mc_func(k, v).value for k, v in _optimize.solve_ports_to_bus(interface, bd).items()]),
+        )
+        self.assertEqual(len(mapping), min(len(ports), n))
+        # scipy without sparse assignment falls back to the dense solver
+        with mock.patch.object(_optimize, 'has_sparse_assignment', return_value=False):
+            self.assertEqual(_optimize.get_sparse_solver('ssp', k=2), 'ssp')
+        # and smaller interfaces are solved densely
+        self.assertEqual(
+            _optimize.solve_ports_to_bus(
+                interface,
+                bd,
+                _optimize.get_sparse_solver(k=1, min_ports=len(ports)+1),
+            ),
+            _optimize.solve_ports_to_bus(interface, bd),
+        )
+
+    def test_ssp_warm_start(self):
+        # seeding with an optimal partial assignment, or with one that is
+        # not and must be ignored, still reaches the optimum
+        rng = np.random.RandomState(0)
+        for _ in range(20):
+            m = rng.randint(2, 12)
+            n = rng.randint(m, 16)
+            C = rng.randint(0, 4, size=(m, n)).astype(np.float64)
+            cost = C[_assign.get_hungarian_assignment(C)].sum()
+            rows = rng.permutation(m)[:rng.randint(1, m)]
+            X = _assign.get_hungarian_assignment(C[rows])
+            init = [(rows[i], j) for i, j in np.argwhere(X)]
+            self.assertIsNotNone(_assign._get_warm_potentials(C, init))
+            for init in [init, list(zip(rows, rng.permutation(n)))]:
+                X = _assign.get_ssp_assignment(C, init=init)
+                self.assertTrue(np.all(X.sum(axis=1) == 1))
+                self.assertTrue(np.all(X.sum(axis=0) <= 1))
+                self.assertEqual(C[X].sum(), cost)
+
+        interface = _get_random_interfaces(1)[0]
+        bd = _get_random_bus_defs(1)[0]
+        ports = list(sorted(interface.ports, key=lambda p: p[0]))
+        child = _bundle.Interface(ports[:len(ports)//2], [])
+        warm_starts = _optimize.WarmStartCache()
+        cbm = _optimize.map_ports_to_bus(
+            child,
+            bd,
+            solver='ssp',
+            warm_starts=warm_starts,
+        )
+        # the seed is the primary mapping of the child before sideband
+        # ports are removed
+        init = warm_starts.get_init(interface.ports, bd)
+        self.assertTrue(set(cbm.mapping.items()).issubset(set(init.items())))
+        self.assertTrue(set(init).issubset(set(child.ports)))
+        self.assertEqual(warm_starts.get_init(ports[1:], bd), {})
+        bm = _optimize.map_ports_to_bus(
+            interface,
+            bd,
+            solver='ssp',
+            warm_starts=warm_starts,
+        )
+        self.assertTrue(set(interface.ports).issubset(set(bm.get_ports())))
+
+    def test_isomorphic_mapping(self):
+        # mappings remapped from an isomorphic interface must be exactly
+        # those of solving each interface
+        rng = np.random.RandomState(3)
+        suffixes = _get_random_ports(rng, 12)
+        interfaces = [
+            _bundle.Interface(
+                [('inst{}_{}'.format(i, n), w, d) for n, w, d in suffixes],
+                [],
+            )
+            for i in range(3)
+        ]
+        self.assertEqual(len(set([i.signature for i in interfaces])), 1)
+        bds = _get_random_bus_defs(3)
+        def get_fields(bm):
+            return (
+                list(bm.mapping.items()),
+                list(bm.sideband_mapping.items()),
+                list(bm.user_group_mapping.items()),
+                list(bm.unmapped_ports),
+                (bm.cost.nc, bm.cost.wc, bm.cost.dc),
+            )
+        class_cache = _optimize.MappingClassCache()
+        for interface in interfaces:
+            for bd in bds:
+                self.assertEqual(
+                    get_fields(_optimize.map_ports_to_bus(
+                        interface,
+                        bd,
+                        class_cache=class_cache,
+                    )),
+                    get_fields(_optimize.map_ports_to_bus(interface, bd)),
+                )
+        self.assertEqual(class_cache.num_misses, len(bds))
+        self.assertEqual(class_cache.num_hits, 2*len(bds))
+
+    def test_cached_solver(self):
+        rng = np.random.RandomState(0)
+        Cs = [rng.randint(0, 4, size=(6, 9)).astype(np.float64) for _ in range(3)]
+        cache_dir = tempfile.mkdtemp()
+        try:
+            solver = _assign.CachedSolver('hungarian', maxsize=2, cache_dir=cache_dir)
+            for C in Cs + Cs[-1:] + Cs[:1]:
+                X = solver(C)
+                self.assertTrue(np.array_equal(X, _assign.get_hungarian_assignment(C)))
+            # the first solution was evicted from memory, but not from disk
+            self.assertEqual(solver.get_stats(), (1, 1, 3))
+            # a new process reuses the solutions on disk
+            solver = _assign.CachedSolver('hungarian', cache_dir=cache_dir)
+            for C in Cs:
+                solver(C)
+            self.assertEqual(solver.get_stats(), (0, 3, 0))
+            # the fingerprint covers the backend and the seed
+            solver = _assign.CachedSolver('ssp', cache_dir=cache_dir)
+            solver(Cs[0])
+            solver(Cs[0], init=[(0, 0)])
+            self.assertEqual(solver.get_stats(), (0, 0, 2))
+            # solutions read back from disk are the last to be evicted
+            paths = []
+            for root, dirs, fnames in os.walk(cache_dir):
+                paths.extend([os.path.join(root, fname) for fname in fnames])
+            for path in paths:
+                os.utime(path, (0, 0))
+            solver = _assign.CachedSolver(
+                'hungarian',
+                cache_dir=cache_dir,
+                max_disk_size=os.path.getsize(paths[0]),
+            )
+            solver(Cs[1])
+            self.assertEqual(solver.prune(), 4)
+            solver = _assign.CachedSolver('hungarian', cache_dir=cache_dir)
+            for C in Cs:
+                solver(C)
+            self.assertEqual(solver.get_stats(), (0, 1, 2))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_mapping_store(self):
+        # mappings stored by one run are reused by the next and give the
+        # same bus mappings
+        interfaces = _get_random_interfaces(3)
+        bds = _get_random_bus_defs(2)
+        def get_fields(bm):
+            return (
+                list(bm.mapping.items()),
+                list(bm.sideband_mapping.items()),
+                (bm.cost.nc, bm.cost.wc, bm.cost.dc),
+            )
+        cache_dir = tempfile.mkdtemp()
+        try:
+            fields = []
+            for _ in range(2):
+                store = _mapcache.MappingStore(cache_dir)
+                class_cache = _optimize.MappingClassCache(store)
+                fields.append([
+                    get_fields(_optimize.map_ports_to_bus(
+                        interface,
+                        bd,
+                        class_cache=class_cache,
+                    ))
+                    for interface in interfaces for bd in bds
+                ])
+            self.assertEqual(fields[0], fields[1])
+            self.assertEqual(store.get_stats(), (6, 0))
+            # a different solver is a different key
+            store = _mapcache.MappingStore(cache_dir)
+            class_cache = _optimize.MappingClassCache(store, 'glpk')
+            self.assertIsNone(class_cache.get_mapping(interfaces[0], bds[0]))
+            # least recently used entries are evicted first
+            store = _mapcache.MappingStore(cache_dir, max_size=0, prune_interval=3600)
+            self.assertEqual(store.prune(), 6)
+            # long-lived stores only walk the store once per interval
+            store.put(store.get_key('k'), 'v')
+            self.assertEqual(store.prune(), 0)
+            store.prune_interval = 0
+            self.assertEqual(store.prune(), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_incremental(self):
+        # only the port groups of changed subtrees are mapped again and the
+        # rest are carried forward from the previous run
+        names = [
+            'ar_bits_id', 'ar_bits_addr', 'ar_bits_len', 'ar_bits_size',
+            'ar_bits_burst', 'ar_valid', 'ar_ready', 'aw_bits_id',
+            'aw_bits_addr', 'aw_bits_len', 'aw_bits_burst', 'aw_valid',
+            'aw_ready', 'w_bits_data', 'w_bits_strb', 'w_valid', 'w_ready',
+            'b_valid', 'b_ready',
+        ]
+        def get_component(addr_width):
+            ports = {}
+            for i in range(2):
+                for n in names:
+                    d = -1 if n in ['ar_ready', 'aw_ready', 'w_ready', 'b_valid'] else 1
+                    w = addr_width if i == 1 and n == 'ar_bits_addr' else 1
+                    ports['front_port_axi4_{}_{}'.format(i, n)] = d*w
+            return {'component' : {'model' : {'ports' : ports}, 'busInterfaces' : []}}
+        def get_prefixes(path):
+            with open(path) as fin:
+                pgs = json.load(fin)['definitions']['busMappedPortGroups']
+            return sorted([dict(pg[1])['prefix'] for pg in pgs])
+        def get_pg_names(path):
+            with open(path) as fin:
+                pgs = json.load(fin)['definitions']['busMappedPortGroups']
+            return [pg[0] for pg in pgs]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            comp_path = os.path.join(tmpdir, 'comp.json5')
+            prev_path = os.path.join(tmpdir, 'prev.json')
+            with open(comp_path, 'w') as fout:
+                json.dump(get_component(40), fout)
+            ports = util.get_unassigned_ports(comp_path)
+            util.dump_json_bus_candidates(
+                prev_path,
+                comp_path,
+                main_portinf.get_bus_matches(ports, self.bus_defs),
+            )
+            prev_prefixes = get_prefixes(prev_path)
+            # nothing to map again if nothing changed
+            carried, remaining = get_prev_port_groups(prev_path, ports, self.bus_defs)
+            self.assertEqual(remaining, [])
+            self.assertEqual(len(carried['busMappedPortGroups']), len(prev_prefixes))
+
+            # a changed width only affects the ports of its own instance
+            with open(comp_path, 'w') as fout:
+                json.dump(get_component(32), fout)
+            ports = util.get_unassigned_ports(comp_path)
+            carried, remaining = get_prev_port_groups(prev_path, ports, self.bus_defs)
+            self.assertGreater(len(remaining), 0)
+            self.assertTrue(all([
+                p[0].startswith('front_port_axi4_1_') for p in remaining
+            ]))
+            self.assertGreater(len(carried['busMappedPortGroups']), 0)
+            out_path = os.path.join(tmpdir, 'out.json')
+            util.dump_json_bus_candidates(
+                out_path,
+                comp_path,
+                main_portinf.get_bus_matches(remaining, self.bus_defs),
+                carried=carried,
+            )
+            self.assertEqual(get_prefixes(out_path), prev_prefixes)
+            # new port groups are numbered after the carried ones
+            pg_names = get_pg_names(out_path)
+            self.assertEqual(len(set(pg_names)), len(pg_names))
+
+            # a fresh run numbers its port groups from 0 even if the
+            # document was annotated before
+            comp = get_component(40)
+            comp['definitions'] = {'pg_cnt' : 5}
+            with open(comp_path, 'w') as fout:
+                json.dump(comp, fout)
+            util.dump_json_bus_candidates(
+                out_path,
+                comp_path,
+                main_portinf.get_bus_matches(
+                    util.get_unassigned_ports(comp_path),
+                    self.bus_defs,
+                ),
+            )
+            self.assertEqual(get_pg_names(out_path), get_pg_names(prev_path))
+
+            # and a later incremental run still carries its port groups
+            # along with their bus interfaces
+            comp = get_component(32)
+            comp['definitions'] = {'pg_cnt' : 5}
+            with open(comp_path, 'w') as fout:
+                json.dump(comp, fout)
+            ports = util.get_unassigned_ports(comp_path)
+            carried, remaining = get_prev_port_groups(out_path, ports, self.bus_defs)
+            self.assertGreater(len(carried['busMappedPortGroups']), 0)
+            self.assertEqual(
+                len(carried['busMappedPortGroups']),
+                len(carried['busInterfaces']),
+            )
+            inc_path = os.path.join(tmpdir, 'inc.json')
+            util.dump_json_bus_candidates(
+                inc_path,
+                comp_path,
+                main_portinf.get_bus_matches(remaining, self.bus_defs),
+                carried=carried,
+            )
+            self.assertEqual(get_prefixes(inc_path), prev_prefixes)
+            pg_names = get_pg_names(inc_path)
+            self.assertEqual(len(set(pg_names)), len(pg_names))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_cost_matrix(self):
+        # the vectorized cost matrix must exactly match the pairwise cost
+        # function
+        for interface, bd in zip(
+            _get_random_interfaces(10),
+            _get_random_bus_defs(10),
+        ):
+            match_cost_func, _ = _optimize.get_cost_funcs(interface, bd)
+            ports = list(interface.get_ports_to_map())
+            C = _optimize.get_cost_matrix(interface, ports, bd)
+            answer = np.array([
+                [match_cost_func(p1, p2).value for p2 in bd.compiled.match_ports]
+                for p1 in ports
+            ])
+            self.assertTrue(np.array_equal(C, answer))
+
+    def test_cost_row_cache(self):
+        # rows shared across nested and sibling port groups must give the
+        # same cost matrices as building each from scratch
+        ports = [
+            ('axi{}_{}_{}'.format(i, ch, sig), w, d)
+            for i in range(3)
+                for ch in ['ar', 'aw']
+                    for sig, w, d in [
+                        ('valid', 1, 1),
+                        ('ready', 1, -1),
+                        ('addr', 32, 1),
+                        ('id', None, 1),
+                    ]
+        ]
+        bt = _bundle.BundleTree(ports)
+        bds = _get_random_bus_defs(3) + self.bus_defs[:3]
+        row_cache = _optimize.CostRowCache()
+        for _, interface in bt.get_initial_interfaces():
+            i_ports = list(interface.get_ports_to_map())
+            for bd in bds:
+                self.assertTrue(np.array_equal(
+                    _optimize.get_cost_matrix(interface, i_ports, bd, row_cache),
+                    _optimize.get_cost_matrix(interface, i_ports, bd),
+                ))
+        self.assertGreater(row_cache.num_hits, 0)
+
+    def test_parallel_mapping(self):
+        # mapping in worker processes must give exactly the serial result,
+        # in the same order
+        bds = _get_random_bus_defs(4)
+        groups = [
+            (interface, bds[i%4:] + bds[:i%4])
+            for i, interface in enumerate(_get_random_interfaces(6))
+        ]
+        def get_fields(k, bm):
+            return (
+                k,
+                list(bm.mapping.items()),
+                list(bm.sideband_mapping.items()),
+                list(bm.user_group_mapping.items()),
+                list(bm.unmapped_ports),
+                (bm.cost.nc, bm.cost.wc, bm.cost.dc),
+                id(bm.bus_def),
+            )
+        for solver, keep_alts in [(None, None), (None, 2), ('ssp', None)]:
+            serial = main_portinf._get_bus_mappings(
+                groups,
+                solver=solver,
+                keep_alts=keep_alts,
+            )
+            parallel = main_portinf._get_bus_mappings(
+                groups,
+                solver=solver,
+                jobs=2,
+                keep_alts=keep_alts,
+            )
+            self.assertEqual(
+                [[get_fields(k, bm) for k, bm in r] for r in serial],
+                [[get_fields(k, bm) for k, bm in r] for r in parallel],
+            )
+        for (interface, bus_defs), r in zip(groups, parallel):
+            for k, bm in r:
+                self.assertIs(bm.bus_def, bus_defs[k])
+                for pp, bp in bm.mapping.items():
+                    self.assertEqual(
+                        bm.match_cost_func(pp, bp),
+                        _optimize.get_cost_funcs(interface, bm.bus_def)[0](pp, bp),
+                    )
+
+    def test_keep_alts(self):
+        # the mapping cost bound must never exceed the actual cost, so that
+        # pruning keeps exactly the lowest cost mappings
+        bds = _get_random_bus_defs(20)
+        for interface in _get_random_interfaces(6):
+            bms = main_portinf._map_ports_to_bus_defs(interface, bds)
+            bounds = _fcost.get_mapping_cost_bounds(interface, bds)
+            ports = list(interface.get_ports_to_map())
+            name_bounds = _fcost.BusDefIndex(bds).get_port_name_bounds(interface, ports)
+            for k, bd in enumerate(bds):
+                self.assertTrue(np.all(
+                    name_bounds[:, k] <=
+                    _optimize.get_name_cost_matrix(interface, ports, bd).min(axis=1) +
+                    main_portinf.BOUND_TOL
+                ))
+            for k, bm in bms:
+                self.assertLessEqual(
+                    bounds[k],
+                    bm.cost.value + main_portinf.BOUND_TOL,
+                )
+            for keep_alts in [1, 3]:
+                kept = main_portinf._map_ports_to_bus_defs(
+                    interface,
+                    bds,
+                    keep_alts=keep_alts,
+                )
+                self.assertEqual(
+                    [(k, bm.cost.value) for k, bm in kept],
+                    [(k, bm.cost.value) for k, bm in bms[:keep_alts]],
+                )
+
     def tearDown(self):
         pass
 
+class CompiledBusDef(unittest.TestCase):
+
+    def setUp(self):
+        self.bus_defs, self.mem_bus_defs = _load_test_bus_defs()
+
+    def test_roles_and_tokens(self):
+        for bd in self.bus_defs + self.mem_bus_defs:
+            cbd = bd.compiled
+            self.assertEqual(int(cbd.req_mask.sum()), bd.num_req_ports)
+            self.assertEqual(int(cbd.opt_mask.sum()), bd.num_opt_ports)
+            self.assertEqual(int(cbd.user_mask.sum()), len(bd.user_port_groups))
+            self.assertEqual(list(cbd.match_ports), bd.all_ports)
+            for port in bd.all_ports:
+                i = cbd.index[port]
+                self.assertEqual(cbd.ports[i], port)
+                self.assertEqual(
+                    set(_tokenize.get_ngram(t) for t in cbd.ngrams[i]),
+                    set(util.get_tokens(bd.words_from_name(port[0]))),
+                )
+                if port[1] is None:
+                    self.assertTrue(np.isnan(cbd.widths[i]))
+                else:
+                    self.assertEqual(cbd.widths[i], port[1])
+                self.assertEqual(cbd.dirs[i], port[2])
+
+    def test_pickle_rebuilds_compiled(self):
+        # token ids are process local, so the compiled form must be rebuilt
+        # rather than carried through a pickle
+        import pickle
+        bd = self.bus_defs[0]
+        state = bd.__getstate__()
+        self.assertNotIn('compiled', state)
+        bd2 = pickle.loads(pickle.dumps(bd))
+        self.assertEqual(bd2.compiled.ports, bd.compiled.ports)
+        self.assertEqual(bd2.compiled.ngrams, bd.compiled.ngrams)
+
+    def tearDown(self):
+        pass
+
+class Tokenizer(unittest.TestCase):
+
+    def test_preload(self):
+        # the vocab of this process can always be preloaded onto itself,
+        # but never onto a conflicting one
+        words, ngrams = _tokenize.get_vocab()
+        self.assertTrue(_tokenize.preload(words, ngrams))
+        self.assertTrue(_tokenize.preload(words + ['zzpreload'], ngrams))
+        self.assertEqual(_tokenize.get_word(len(words)), 'zzpreload')
+        self.assertFalse(_tokenize.preload(['zzconflict'] + words, ngrams))
+        self.assertEqual(len(_tokenize.get_vocab()[0]), len(words)+1)
+
+    def test_words_and_ids(self):
+        names = [
+            'axi0_ARESETn',
+            'mainClockEnable',
+            'DDR_DQS_t',
+            'foo__bar12baz',
+            '_lead',
+        ]
+        for name in names:
+            words = _tokenize.words_from_name(name)
+            self.assertEqual(list(words), util.words_from_name(name))
+            self.assertEqual(
+                set(_tokenize.get_word(w) for w in _tokenize.word_ids(name)),
+                set(words),
+            )
+            self.assertEqual(
+                set(_tokenize.get_ngram(t) for t in _tokenize.name_ngram_ids(name)),
+                set(util.get_tokens(name)),
+            )
+            word_ids = _tokenize.word_ids(name)
+            self.assertEqual(
+                set(_tokenize.get_ngram(t) for t in _tokenize.ngram_ids(word_ids)),
+                set(util.get_tokens(list(words))),
+            )
+        self.assertEqual(
+            list(_tokenize.words_from_name('axi0_ARESETn')),
+            ['axi', '0', 'aresetn'],
+        )
+        # interning is stable
+        self.assertIs(
+            _tokenize.word_ids('axi0_ARESETn'),
+            _tokenize.word_ids('axi0_ARESETn'),
+        )
+
+    def tearDown(self):
+        pass
+
+class BusLibCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rootdir = os.path.join(self.tmpdir, 'bus')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        shutil.copytree(_get_test_bus_spec_dir(), self.rootdir)
+
+    def test_warm_load_skips_parse(self):
+        cold = _buslib.load_bus_defs(self.rootdir, cache_dir=self.cache_dir)
+        # a warm load must not touch the spec parser at all
+        with mock.patch.object(BusDef, '_loads', side_effect=AssertionError):
+            warm = _buslib.load_bus_defs(self.rootdir, cache_dir=self.cache_dir)
+        self.assertEqual(
+            [(bd.abstract_type.name, bd.driver_type, bd.req_ports) for bd in cold],
+            [(bd.abstract_type.name, bd.driver_type, bd.req_ports) for bd in warm],
+        )
+
+    def test_get_bus_defs_parses_once(self):
+        spec_path = os.path.join(self.rootdir, 'DPRAM_rtl.json5')
+        with mock.patch.object(BusDef, '_loads', wraps=BusDef._loads) as loads:
+            bus_defs = main_portinf.get_bus_defs(spec_path)
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual(
+            [(bd.abstract_type.name, bd.driver_type, bd.req_ports) for bd in bus_defs],
+            [
+                (bd.abstract_type.name, bd.driver_type, bd.req_ports)
+                for bd in BusDef.bus_defs_from_spec(spec_path)
+            ],
+        )
+
+    def test_reparse_changed_spec(self):
+        _buslib.load_bus_defs(self.rootdir, cache_dir=self.cache_dir)
+        spec_path = os.path.join(self.rootdir, 'DPRAM_rtl.json5')
+        with open(spec_path) as fin:
+            s = fin.read()
+        with open(spec_path, 'w') as fout:
+            fout.write(s.replace("name: 'DPRAM_rtl'", "name: 'DPRAM2_rtl'"))
+        cache_path = _buslib.BusLibCache.get_cache_path(self.cache_dir, self.rootdir)
+        cache = _buslib.BusLibCache.load(cache_path)
+        bus_defs = []
+        for spec_path in _buslib.get_candidate_spec_paths(self.rootdir):
+            bus_defs.extend(cache.get_bus_defs(spec_path))
+        # only the modified spec should be parsed again
+        self.assertEqual(cache.num_misses, 1)
+        self.assertEqual(cache.num_hits, 1)
+        self.assertTrue(any(
+            [bd.abstract_type.name == 'DPRAM2_rtl' for bd in bus_defs]
+        ))
+
+    def test_single_parse(self):
+        with open(os.path.join(self.rootdir, 'unrelated.json5'), 'w') as fout:
+            fout.write("{component: {name: 'foo'}}")
+        with mock.patch.object(BusDef, '_loads', wraps=BusDef._loads) as loads:
+            bus_defs = _buslib.load_bus_defs(self.rootdir)
+        # each bus spec parsed exactly once, unrelated files never parsed
+        self.assertEqual(loads.call_count, 2)
+        self.assertEqual(len(bus_defs), 4)
+
+    def test_shared_lib(self):
+        # bus defs of a shared bus library are identical to the parsed
+        # ones and are pickled as handles to the library
+        bus_defs = _buslib.load_bus_defs(self.rootdir)
+        shared = _sharedlib.get_shared_bus_defs(bus_defs, self.cache_dir, self.rootdir)
+        self.assertEqual(len(shared), len(bus_defs))
+        for bd, sbd in zip(bus_defs, shared):
+            cbd, scbd = bd.compiled, sbd.compiled
+            for attr in [
+                'ports', 'req_set', 'opt_set', 'user_port_groups', 'words',
+                'ngrams', 'name_ngrams', 'all_ngrams', 'req_wd_counts',
+                'num_match', 'digest',
+            ]:
+                self.assertEqual(getattr(cbd, attr), getattr(scbd, attr))
+            np.testing.assert_array_equal(cbd.widths, scbd.widths)
+            np.testing.assert_array_equal(cbd.dirs, scbd.dirs)
+            self.assertEqual(
+                (bd.abstract_type.name, bd.driver_type, bd.req_ports, bd.opt_ports),
+                (sbd.abstract_type.name, sbd.driver_type, sbd.req_ports, sbd.opt_ports),
+            )
+        self.assertIs(pickle.loads(pickle.dumps(shared[1])), shared[1])
+        self.assertLess(len(pickle.dumps(shared)), len(pickle.dumps(bus_defs)))
+        # the same contents are written once
+        self.assertEqual(
+            len([f for f in os.listdir(self.cache_dir) if f.endswith('.shared')]),
+            1,
+        )
+        interface = _bundle.Interface([
+            ('axi0_ARADDR', 37, 1),
+            ('axi0_ARVALID', 1, 1),
+            ('axi0_ARREADY', 1, -1),
+            ('axi0_RDATA', 64, -1),
+        ], [])
+        for bd, sbd in zip(bus_defs, shared):
+            bm = _optimize.map_ports_to_bus(interface, bd)
+            sbm = _optimize.map_ports_to_bus(interface, sbd)
+            self.assertEqual(list(bm.mapping.items()), list(sbm.mapping.items()))
+            self.assertEqual(bm.cost, sbm.cost)
+
+    def test_shared_lib_prune(self):
+        # libraries of earlier contents are only removed once unused for
+        # a while, as other runs may still attach them
+        bus_defs = _buslib.load_bus_defs(self.rootdir)
+        _sharedlib.get_shared_bus_defs(bus_defs, self.cache_dir, self.rootdir)
+        old = [f for f in os.listdir(self.cache_dir) if f.endswith('.shared')]
+        spec_path = os.path.join(self.rootdir, 'DPRAM_rtl.json5')
+        with open(spec_path) as fin:
+            s = fin.read()
+        with open(spec_path, 'w') as fout:
+            fout.write(s.replace("name: 'DPRAM_rtl'", "name: 'DPRAM2_rtl'"))
+        bus_defs = _buslib.load_bus_defs(self.rootdir)
+        _sharedlib.get_shared_bus_defs(bus_defs, self.cache_dir, self.rootdir)
+        libs = [f for f in os.listdir(self.cache_dir) if f.endswith('.shared')]
+        self.assertEqual(len(libs), 2)
+        os.utime(os.path.join(self.cache_dir, old[0], 'meta.json'), (0, 0))
+        _sharedlib.get_shared_bus_defs(bus_defs, self.cache_dir, self.rootdir)
+        libs = [f for f in os.listdir(self.cache_dir) if f.endswith('.shared')]
+        self.assertEqual(len(libs), 1)
+        self.assertNotIn(old[0], libs)
+
+    def test_parallel_load(self):
+        serial = _buslib.load_bus_defs(self.rootdir)
+        parallel = _buslib.load_bus_defs(self.rootdir, jobs=2)
+        # bus defs must come back in the same deterministic order
+        self.assertEqual(
+            [(bd.abstract_type.name, bd.driver_type, bd.all_ports) for bd in serial],
+            [(bd.abstract_type.name, bd.driver_type, bd.all_ports) for bd in parallel],
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+class Server(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rootdir = os.path.join(self.tmpdir, 'bus')
+        shutil.copytree(_get_test_bus_spec_dir(), self.rootdir)
+        self.comp_path = os.path.join(self.tmpdir, 'comp.json5')
+        _write_test_component(self.comp_path)
+
+    def test_server(self):
+        # requests served from a warm server give the output of a direct
+        # run and only reparse the bus specs that changed
+        args = _cli.get_portinf_parser().parse_args([
+            '-b', self.rootdir,
+            '--cache-dir', os.path.join(self.tmpdir, 'cache'),
+            self.comp_path,
+        ])
+        output = io.StringIO()
+        args.output = output
+        main_portinf.infer_component(args, _buslib.load_bus_defs(self.rootdir))
+
+        socket_path = os.path.join(self.tmpdir, 'portinfd.sock')
+        server = _server.PortinfServer(socket_path)
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        try:
+            request = {'command' : 'infer', 'args' : _cli.get_abs_args(
+                _cli.get_portinf_parser().parse_args([
+                    '-b', self.rootdir,
+                    '--cache-dir', os.path.join(self.tmpdir, 'cache'),
+                    self.comp_path,
+                ])
+            )}
+            response = _cli.send_request(socket_path, request)
+            self.assertEqual(response['status'], 0)
+            self.assertEqual(response['output'], output.getvalue())
+
+            spec_path = os.path.join(self.rootdir, 'DPRAM_rtl.json5')
+            with open(spec_path, 'a') as fout:
+                fout.write('\n')
+            response = _cli.send_request(socket_path, request)
+            self.assertEqual(response['output'], output.getvalue())
+            lib = next(iter(server._libs.values()))
+            # both specs parsed by the first request, just the one by the
+            # second
+            self.assertEqual((lib.num_hits, lib.num_misses), (1, 3))
+        finally:
+            _cli.send_request(socket_path, {'command' : 'stop'})
+            thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertEqual(server.num_requests, 2)
+
+    def test_server_errors(self):
+        # malformed requests get an error response instead of a dropped
+        # connection
+        socket_path = os.path.join(self.tmpdir, 'portinfd.sock')
+        server = _server.PortinfServer(socket_path)
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+                sock.sendall(b'not json\n')
+                sock.shutdown(socket.SHUT_WR)
+                with sock.makefile('rb') as fin:
+                    response = json.loads(fin.read().decode('utf-8'))
+            self.assertEqual(response['status'], 1)
+            self.assertIn('JSONDecodeError', response['error'])
+            for request in [{'command' : 'foo'}, {'command' : 'infer'}]:
+                response = _cli.send_request(socket_path, request)
+                self.assertEqual(response['status'], 1)
+                self.assertIsNotNone(response['error'])
+        finally:
+            _cli.send_request(socket_path, {'command' : 'stop'})
+            thread.join()
+
+    def test_server_reset_tokens(self):
+        # once too many tokens are interned, they are forgotten along with
+        # the bus defs holding their ids, and later requests are unaffected
+        args = _cli.get_portinf_parser().parse_args([
+            '-b', self.rootdir,
+            '--no-cache',
+            self.comp_path,
+        ])
+        request = {'command' : 'infer', 'args' : _cli.get_abs_args(args)}
+        server = _server.PortinfServer(os.path.join(self.tmpdir, 'portinfd.sock'))
+        state = (
+            dict(_tokenize._word_ids), list(_tokenize._words),
+            dict(_tokenize._ngram_ids), list(_tokenize._ngrams),
+        )
+        try:
+            expected = server.serve_request(request)['output']
+            with mock.patch.object(_server, 'MAX_INTERNED', 0):
+                response = server.serve_request(request)
+            self.assertEqual(response['output'], expected)
+            self.assertEqual(_tokenize.get_num_interned(), 0)
+            self.assertEqual(server._libs, {})
+            self.assertEqual(server.serve_request(request)['output'], expected)
+        finally:
+            server.server_close()
+            # restore the ids held by the bus defs of the other tests
+            _tokenize.reset()
+            _tokenize._word_ids.update(state[0])
+            _tokenize._words.extend(state[1])
+            _tokenize._ngram_ids.update(state[2])
+            _tokenize._ngrams.extend(state[3])
+
+    def test_server_duh_bus_path(self):
+        # duh-bus-which is only run by the first request without -b
+        args = _cli.get_portinf_parser().parse_args(['--no-cache', self.comp_path])
+        server = _server.PortinfServer(os.path.join(self.tmpdir, 'portinfd.sock'))
+        try:
+            with mock.patch.object(
+                main_portinf,
+                'get_duh_bus_path',
+                return_value=self.rootdir,
+            ) as get_duh_bus_path:
+                for _ in range(2):
+                    bus_defs, _ = server.get_bus_defs(args)
+                    self.assertTrue(len(bus_defs) > 0)
+            get_duh_bus_path.assert_called_once_with()
+        finally:
+            server.server_close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+class Batch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bus_defs = _buslib.load_bus_defs(_get_test_bus_spec_dir())
+
+    def test_batch(self):
+        # every component of a batch gets the output of a direct run,
+        # regardless of the number of jobs
+        for i in range(3):
+            os.makedirs(os.path.join(self.tmpdir, 'c{}'.format(i)))
+            _write_test_component(os.path.join(self.tmpdir, 'c{}'.format(i), 'comp.json5'), i)
+        paths = main_portinf_batch.get_component_paths([
+            os.path.join(self.tmpdir, '**', '*.json5'),
+        ])
+        self.assertEqual(len(paths), 3)
+        args = _cli.get_portinf_parser(batch=True).parse_args(['--no-cache'] + paths)
+        outputs = []
+        for path in paths:
+            output = io.StringIO()
+            direct_args = _cli.get_portinf_parser().parse_args(['--no-cache', path])
+            direct_args.output = output
+            main_portinf.infer_component(direct_args, self.bus_defs)
+            outputs.append(output.getvalue())
+        for jobs in [1, 2]:
+            args.jobs = jobs
+            results = main_portinf_batch.infer_components(args, paths, self.bus_defs)
+            self.assertEqual([r[0] for r in results], paths)
+            self.assertTrue(all([r[3] is None for r in results]))
+            for path, output in zip(paths, outputs):
+                out_path = main_portinf_batch.get_output_path(path)
+                self.assertEqual(out_path, path[:-len('.json5')] + '.portinf.json')
+                with open(out_path) as fin:
+                    self.assertEqual(fin.read(), output)
+        # outputs of earlier runs are not picked up as components
+        self.assertEqual(
+            main_portinf_batch.get_component_paths([os.path.join(self.tmpdir, '**', '*')]),
+            paths,
+        )
+
+    def test_batch_prune(self):
+        # the caches are pruned once for the whole batch, not after every
+        # component
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(self.tmpdir, 'c{}.json5'.format(i)))
+            _write_test_component(paths[-1], i)
+        args = _cli.get_portinf_parser(batch=True).parse_args([
+            '--cache-dir', os.path.join(self.tmpdir, 'cache'),
+            '--solve-cache',
+        ] + paths)
+        args.jobs = 1
+        with mock.patch.object(_mapcache, 'prune_cache_dir', return_value=0) as prune_mappings, \
+             mock.patch.object(_assign, 'prune_cache_dir', return_value=0) as prune_solves:
+            results = main_portinf_batch.infer_components(args, paths, self.bus_defs)
+        self.assertTrue(all([r[3] is None for r in results]))
+        self.assertEqual(prune_mappings.call_count, 1)
+        self.assertEqual(prune_solves.call_count, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+class Startup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        # the command line entry points load the solver and sparse matrix
+        # stacks only once they are used, and the bundler not even numpy
+        for module, heavy in [
+            ('main_portbundler', ['cvxopt', 'scipy', 'numpy']),
+            ('main_portinf', ['cvxopt', 'scipy']),
+            ('main_portinfd', ['cvxopt', 'scipy', 'numpy', 'json5', 'jsonref']),
+        ]:
+            loaded = subprocess.check_output([
+                sys.executable, '-c',
+                'import sys, duhportinf.{}; '
+                'print(sorted(m for m in sys.modules if m.split(".")[0] in {!r}))'.format(module, heavy),
+            ]).decode('utf-8').strip()
+            self.assertEqual(loaded, '[]', module)
+        # while the public api is still reachable from the package
+        import duhportinf
+        self.assertIs(duhportinf.get_bus_matches, main_portinf.get_bus_matches)
+        self.assertIs(duhportinf.main_portbundler, main_portbundler)
+
+    def test_cache_opt_in(self):
+        # nothing is cached on disk unless a cache directory is given
+        parser = _cli.get_portinf_parser()
+        self.assertIsNone(_cli.get_cache_dir(parser.parse_args(['c.json5'])))
+        args = parser.parse_args(['--cache-dir', 'cache', 'c.json5'])
+        self.assertEqual(_cli.get_cache_dir(args), 'cache')
+        self.assertIsNone(main_portinf.get_args_mapping_store(
+            parser.parse_args(['--solve-cache', 'c.json5'])
+        ))
+        self.assertIsNone(main_portinf.get_args_cached_solver(
+            parser.parse_args(['--solve-cache', 'c.json5'])
+        ).cache_dir)
+        args = parser.parse_args(['--cache-dir', 'cache', '--no-cache', 'c.json5'])
+        self.assertIsNone(_cli.get_cache_dir(args))
+
+    def test_positive_options(self):
+        # counts of candidates and alternates are checked when parsing
+        parser = _cli.get_portinf_parser()
+        self.assertEqual(parser.parse_args(['--sparse-k', '4', 'c.json5']).sparse_k, 4)
+        for opt in ['--sparse-k', '--keep-alts']:
+            for value in ['0', '-2', 'x']:
+                with mock.patch('sys.stderr', io.StringIO()):
+                    with self.assertRaises(SystemExit):
+                        parser.parse_args([opt, value, 'c.json5'])
+
 #--------------------------------------------------------------------------
 # helpers
 #--------------------------------------------------------------------------
-# load test bus defs
-def _load_test_bus_defs():
-    bus_defs = []
-    bsdir = os.path.join(
+def _write_test_component(path, idx=0):
+    names = [
+        'ar_bits_id', 'ar_bits_addr', 'ar_bits_len', 'ar_valid',
+        'ar_ready', 'r_bits_id', 'r_bits_data', 'r_valid', 'r_ready',
+    ]
+    ports = {
+        'front_port_axi4_{}_{}'.format(idx, n) : -1 if n in ['ar_ready', 'r_valid'] else 1
+        for n in names
+    }
+    with open(path, 'w') as fout:
+        json.dump({'component' : {'model' : {'ports' : ports}, 'busInterfaces' : []}}, fout)
+
+def _get_test_bus_spec_dir():
+    return os.path.join(
         os.path.dirname(__file__),
         'test-bus-specs',
     )
+
+# load test bus defs
+def _load_test_bus_defs():
+    bus_defs = []
+    bsdir = _get_test_bus_spec_dir()
     spec_path = os.path.join(bsdir, 'AXI4_rtl.json5')
     bus_defs.extend(BusDef.bus_defs_from_spec(spec_path))
     spec_path = os.path.join(bsdir, 'DPRAM_rtl.json5')
     mem_bus_defs = BusDef.bus_defs_from_spec(spec_path)
     return bus_defs, mem_bus_defs
 
+_random_words = [
+    'addr', 'data', 'valid', 'ready', 'id', 'len', 'burst', 'resp', 'last',
+    'strb', 'clk', 'rst', 'en', 'req', 'ack', 'wr', 'rd', 'cmd', 'qos', 'user',
+]
+
+# random bus defs and interfaces drawn from a shared vocabulary, for
+# checking optimized paths against the reference implementation
+def _get_random_ports(rng, n, prefix=''):
+    ports = set()
+    while len(ports) < n:
+        words = rng.choice(_random_words, size=rng.randint(1, 4))
+        name = prefix + '_'.join(words)
+        width = [None, 1, 1, 2, 8, 32][rng.randint(6)]
+        ports.add((name, width, int(rng.choice([-1, 1]))))
+    return list(sorted(ports, key=lambda p: p[0]))
+
+def _get_random_bus_defs(n, seed=0):
+    rng = np.random.RandomState(seed)
+    bus_defs = []
+    for i in range(n):
+        ports = _get_random_ports(rng, rng.randint(2, 20))
+        nreq = rng.randint(1, len(ports)+1)
+        bus_defs.append(BusDef(
+            {'name': 'bus{}'.format(i)},
+            {'name': 'bus{}_rtl'.format(i)},
+            'master',
+            ports[:nreq],
+            ports[nreq:],
+            [],
+        ))
+    return bus_defs
+
+def _get_random_interfaces(n, seed=1):
+    rng = np.random.RandomState(seed)
+    return [
+        _bundle.Interface(_get_random_ports(rng, rng.randint(2, 30), 'pfx_'), [])
+        for _ in range(n)
+    ]
@@ -4,11 +4,14 @@ import json
 from jsonref import JsonRef
 import json5
 import re
-import numpy as np
 import logging
+from . import _tokenize
 
 silent = False
 
+def _sign(x):
+    return (x > 0) - (x < 0)
+
 def format_ports(in_ports):
     """
     convert input component.json5 port shorthand to
@@ -17,10 +20,10 @@ def format_ports(in_ports):
     fmt_ports = []
     for name, pw in in_ports.items():
         try:
-            w, d = np.abs(pw), np.sign(pw)
+            w, d = abs(pw), _sign(pw)
         except Exception as e:
             #print('Warning', (name, pw), 'not correctly parsed')
-            w, d = None, np.sign(-1) if pw[0] == '-' else np.sign(1)
+            w, d = None, -1 if pw[0] == '-' else 1
         fmt_ports.append((name, w, d))
     return fmt_ports
 
@@ -88,14 +91,7 @@ def get_unassigned_ports(component_json):
     return unassn_ports
 
 def words_from_name(name):
-    # convert camelcase to '_'
-    name = re.sub('(.)([A-Z][a-z]+)(.)', r'\1_\2\3', name)
-    # always return lower case so case insensitive
-    name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name).lower()
-    ## insert '_' in between names and numbers
-    name = re.sub('([a-zA-Z])([0-9]+)', r'\1_\2', name).lower()
-    words = name.split('_')
-    return words
+    return list(_tokenize.words_from_name(name))
 
 def flatten(l):
     return [e for ll in l for e in ll]
@@ -128,11 +124,33 @@ def get_tokens(n):
         return _get_tokens(n)
 
 def _get_tokens(n):
-    n = n.replace('_', '').lower()
-    tokens = [c for c in n]
-    tokens.extend([''.join(cs) for cs in zip(n, n[1:])])
-    tokens.extend([''.join(cs) for cs in zip(n, n[1:], n[2:])])
-    return tokens
+    return _tokenize.ngrams(n)
+
+def get_incidence_matrix(token_sets, token_cols, add_tokens=False):
+    """
+    sparse csr incidence matrix with a row for each set in `token_sets` and
+    columns given by the mapping `token_cols` of tokens to column indices.
+    tokens missing from `token_cols` are either assigned new columns (and
+    added to `token_cols`) or dropped
+    """
+    indptr = [0]
+    indices = []
+    for tokens in token_sets:
+        for token in tokens:
+            col = token_cols.get(token)
+            if col is None and add_tokens:
+                col = token_cols[token] = len(token_cols)
+            if col is not None:
+                indices.append(col)
+        indptr.append(len(indices))
+    # numpy and scipy are only needed once matching starts, not by the
+    # bundler
+    import numpy as np
+    import scipy.sparse as sp
+    return sp.csr_matrix(
+        (np.ones(len(indices)), indices, indptr),
+        shape=(len(token_sets), len(token_cols)),
+    )
 
 def get_jaccard_dist(n1, n2):
     """
@@ -207,6 +225,18 @@ class NoIndent(object):
     def __init__(self, value):
         self.value = value
 
+def json_default(obj):
+    """
+    encode numpy scalars, such as port widths and directions, as plain
+    json values
+    """
+    import numpy as np
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(obj).__name__,
+    ))
+
 class PrettyPrintEncoder(json.JSONEncoder):
     """
     special json encoder that selectively skips certain objects for
@@ -252,7 +282,15 @@ def dump_json_bus_candidates(
     component_json5,
     i_bus_mappings,
     debug=False,
+    carried=None,
 ):
+    """
+    write the duh-document `component_json5` updated with the bus mappings
+    of each <interface, bus_mappings> pair in `i_bus_mappings` to `output`.
+    `carried` may be specified with the definitions of port groups carried
+    forward from a previous run (see `_incremental.get_prev_port_groups`),
+    which are written out unchanged ahead of the new ones
+    """
 
     def expand_if_vector(interface, port):
         if interface.is_vector(port):
@@ -288,6 +326,9 @@ def dump_json_bus_candidates(
     busint_refs = []
     busint_alt_refs = []
     pg_cnt_base = get_cnt_base()
+    if carried is not None:
+        # number new port groups after those of the previous run
+        pg_cnt_base = max(pg_cnt_base, carried['pg_cnt'])
 
     for i, (interface, bus_mappings) in enumerate(sorted(
         i_bus_mappings,
@@ -341,8 +382,8 @@ def dump_json_bus_candidates(
             #    portmap_o['__UMAP__'] = [p[0] for p in sbm_umap]
 
             # format debug portmap object that tags req, opt, sideband signals
-            req_mapped_names = [NoIndent((bp[0], pp[0])) for pp, bp in mapped_ports if bp in bm.bus_def.req_ports]
-            opt_mapped_names = [NoIndent((bp[0], pp[0])) for pp, bp in mapped_ports if bp in bm.bus_def.opt_ports]
+            req_mapped_names = [NoIndent((bp[0], pp[0])) for pp, bp in mapped_ports if bp in bm.bus_def.compiled.req_set]
+            opt_mapped_names = [NoIndent((bp[0], pp[0])) for pp, bp in mapped_ports if bp in bm.bus_def.compiled.opt_set]
             sideband_names =   [NoIndent((bp[0], pp[0])) for pp, bp in mapped_sideband_ports]
             sideband_names.extend([NoIndent((None, pp[0])) for pp in sbm_umap])
             debug_portmap_o = [
@@ -371,7 +412,9 @@ def dump_json_bus_candidates(
         busint_obj_map.update({name:o for name, o in pg_busints})
 
         pgo = (
-            'portgroup_{}'.format(i),
+            # port groups of a fresh run are numbered from 0 as before, only
+            # those added to carried ones must not collide with them
+            'portgroup_{}'.format(i if carried is None else pg_cnt_base+i),
             # show cost of best bus mapping
             [NoIndent(e) for e in get_cost_obj(interface, bus_mappings[0])],
             #[NoIndent(json_format(p)) for p in sorted(interface.ports)],
@@ -391,11 +434,17 @@ def dump_json_bus_candidates(
     bdkey = 'busDefinitions'
     if bdkey not in block_obj[dkey]:
         block_obj[dkey][bdkey] = {}
+    if carried is not None:
+        block_obj[dkey][bdkey].update(carried[bdkey])
     block_obj[dkey][bdkey].update(busint_obj_map)
 
     bmkey = 'busMappedPortGroups'
     if bmkey not in block_obj[dkey]:
         block_obj[dkey][bmkey] = []
+    if carried is not None:
+        block_obj[dkey][bmkey].extend(
+            (pgo[0], [NoIndent(e) for e in pgo[1]]) for pgo in carried[bmkey]
+        )
     block_obj[dkey][bmkey].extend(portgroup_objs)
     assert 'component' in block_obj, \
         'component key not defined in input block object'
@@ -403,11 +452,15 @@ def dump_json_bus_candidates(
 
     bkey = 'busInterfaces'
     refs = [] if bkey not in comp_obj else comp_obj[bkey]
+    if carried is not None:
+        refs.extend(carried[bkey])
     refs.extend(busint_refs)
     comp_obj[bkey] = [NoIndent(o) for o in refs]
 
     abkey = 'busInterfaceAlts'
     refs = [] if abkey not in comp_obj else comp_obj[abkey]
+    if carried is not None:
+        refs.extend(carried[abkey])
     refs.extend(busint_alt_refs)
     comp_obj[abkey] = [NoIndent(o) for o in refs]
 
@@ -7,6 +7,9 @@ setup(
     entry_points = {'console_scripts': [
         'duh-portinf=duhportinf.main_portinf:main',
         'duh-portbundler=duhportinf.main_portbundler:main',
+        'duh-portinf-batch=duhportinf.main_portinf_batch:main',
+        'duh-portinfd=duhportinf.main_portinfd:main',
+        'duh-portinf-client=duhportinf.main_portinfd:client_main',
     ]},
     url='https://github.com/sifive/duhportinf',
     author='Alex Bishara',